@@ -7,9 +7,7 @@ import argparse
 import math
 import numpy
 import os, sys
-from onmt.model_factory import build_model, build_language_model
-from copy import deepcopy
-from onmt.utils import checkpoint_paths, normalize_gradients
+from onmt.utils import checkpoint_paths, checkpoint_epoch, average_checkpoints, ema_weights
 
 
 parser = argparse.ArgumentParser(description='translate.py')
@@ -18,25 +16,21 @@ onmt.markdown.add_md_help_argument(parser)
 parser.add_argument('-models', required=True,
                     help='Path to model .pt file')
 parser.add_argument('-lm', action='store_true',
-                    help='Language model (default is seq2seq model')
+                    help='Language model (not needed anymore: the models are not built)')
 parser.add_argument('-output', default='model.averaged',
                     help="""Path to output averaged model""")
 parser.add_argument('-gpu', type=int, default=-1,
                     help="Device to run on")
 parser.add_argument('-top', type=int, default=10,
-                    help="Device to run on")
+                    help="Number of models to average (the ones with the lowest validation perplexity)")
 parser.add_argument('-method', default='mean',
-                    help="method to average: mean|gmean")
-
+                    help="method to average: mean|gmean|ema")
+parser.add_argument('-ema_decay', type=float, default=0.9,
+                    help="""Weight of each model relative to the next (more recent) one with -method ema""")
+parser.add_argument('-mmap', action='store_true',
+                    help="""Memory-map the checkpoints (only the model tensors are read,
+                    not the optimizer states)""")
 
-def custom_build_model(opt, dict, lm=False):
-
-    if not lm:
-        model = build_model(opt, dict)
-    else:
-        model = build_language_model(opt, dict)
-
-    return model
 
 def main():
     
@@ -49,101 +43,29 @@ def main():
 
     path = opt.models
 
+    # the checkpoints sorted by validation perplexity
     existed_save_files = checkpoint_paths(path)
 
-    # print(existed_save_files)
-    models = existed_save_files
-    # # opt.model should be a string of models, split by |
-    # models = list()
-    #
-
     # take the top
-    models = models[:opt.top]
-
-    # print(models)
-    #
+    models = existed_save_files[:opt.top]
     n_models = len(models)
-    #
-    print("Loading main model from %s ..." % models[0])
-    checkpoint = torch.load(models[0], map_location=lambda storage, loc: storage)
-
-    if 'optim' in checkpoint:
-        del checkpoint['optim']
-
-    main_checkpoint = checkpoint
-
-    # best_checkpoint = {
-    #     'model': deepcopy(main_checkpoint['model']),
-    #     'dicts': main_checkpoint['dicts'],
-    #     'opt': main_checkpoint['opt'],
-    #     'epoch': -1,
-    #     'iteration': -1,
-    #     'batchOrder': None,
-    #     'optim': None
-    # }
-    best_checkpoint = main_checkpoint
-
-    # print("Saving best model to %s" % opt.output + ".top")
-
-    # torch.save(best_checkpoint, opt.output + ".top")
-
-    model_opt = checkpoint['opt']
-    dicts = checkpoint['dicts']
-
-    print(model_opt.layers)
 
-    main_model = custom_build_model(model_opt, checkpoint['dicts'], lm=opt.lm)
-
-    main_model.load_state_dict(checkpoint['model'])
-
-    if opt.cuda:
-        main_model = main_model.cuda()
-
-    for i in range(1, len(models)):
-
-        model = models[i]
-        print("Loading model from %s ..." % models[i])
-        checkpoint = torch.load(model, map_location=lambda storage, loc: storage)
-
-        model_opt = checkpoint['opt']
-
-        # delete optim information to save GPU memory
-        if 'optim' in checkpoint:
-            del checkpoint['optim']
-
-        current_model = custom_build_model(model_opt, checkpoint['dicts'], lm=opt.lm)
-
-        current_model.load_state_dict(checkpoint['model'])
-
-        if opt.cuda:
-            current_model = current_model.cuda()
-
-        if opt.method == 'mean':
-            # Sum the parameter values
-            for (main_param, param) in zip(main_model.parameters(), current_model.parameters()):
-                main_param.data.add_(param.data)
-        elif opt.method == 'gmean':
-            # Take the geometric mean of parameter values
-            for (main_param, param) in zip(main_model.parameters(), current_model.parameters()):
-                main_param.data.mul_(param.data)
-        else:
-            raise NotImplementedError
+    if opt.method == 'ema':
+        # the weights decay from the most recent model to the oldest one
+        models = sorted(models, key=checkpoint_epoch)
+        method, weights = 'mean', ema_weights(n_models, opt.ema_decay)
+    else:
+        method, weights = opt.method, None
 
-    # Normalizing
-    if opt.method == 'mean':
-        for main_param in main_model.parameters():
-            main_param.data.div_(n_models)
-    elif opt.method == 'gmean':
-        for main_param in main_model.parameters():
-            main_param.data.pow_(1. / n_models)
+    # the state dicts are averaged one checkpoint at a time (the models are not built)
+    model_state_dict, checkpoint = average_checkpoints(models, weights=weights, method=method, mmap=opt.mmap,
+                                                       device='cuda' if opt.cuda else 'cpu')
 
     # Saving
-    model_state_dict = main_model.state_dict()
-
     save_checkpoint = {
         'model': model_state_dict,
-        'dicts': dicts,
-        'opt': model_opt,
+        'dicts': checkpoint['dicts'],
+        'opt': checkpoint['opt'],
         'epoch': -1,
         'iteration': -1,
         'batchOrder': None,
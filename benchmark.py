@@ -0,0 +1,443 @@
+#!/usr/bin/env python
+from __future__ import division
+
+import onmt
+import onmt.markdown
+import torch
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+parser = argparse.ArgumentParser(description='benchmark.py')
+onmt.markdown.add_md_help_argument(parser)
+
+parser.add_argument('-task', default='vocab',
+                    help="Which component to benchmark. "
+                         "Options are [vocab|fetch|shuffle|augment|distributed|checkpointing].")
+parser.add_argument('-input', default='',
+                    help="Path to a tokenized text file. Synthetic data is generated if not given")
+parser.add_argument('-lower', action='store_true',
+                    help="Lowercase the vocabulary")
+parser.add_argument('-num_sentences', type=int, default=100000,
+                    help="Number of synthetic sentences")
+parser.add_argument('-vocab_size', type=int, default=32000,
+                    help="Number of synthetic word types")
+parser.add_argument('-batch_size_sents', type=int, default=128,
+                    help="Number of sentences per batch (fetch, shuffle)")
+parser.add_argument('-batch_size_words', type=int, default=4096,
+                    help="Number of words per batch (shuffle)")
+parser.add_argument('-num_batches', type=int, default=1000,
+                    help="Number of random batches to read (fetch)")
+parser.add_argument('-workers', type=int, nargs='+', default=[1, 2, 4],
+                    help="Numbers of CPU processes to compare (distributed)")
+parser.add_argument('-model_size', type=int, default=128,
+                    help="Size of the transformer (distributed, checkpointing)")
+parser.add_argument('-layers', type=int, default=12,
+                    help="Number of layers of the encoder and of the decoder (checkpointing)")
+parser.add_argument('-checkpointing_intervals', type=int, nargs='+', default=[1, 2, 3],
+                    help="Checkpoint every k-th layer, for each of these values of k (checkpointing)")
+parser.add_argument('-repeat', type=int, default=3,
+                    help="Repeat each measurement this many times and report the best")
+parser.add_argument('-seed', type=int, default=3435,
+                    help="Random seed")
+
+
+def timeit(func, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.time()
+        result = func()
+        best = min(best, time.time() - start)
+
+    return best, result
+
+
+def timeit_memory(func, repeat):
+    """
+    :return: the best time, the peak of the memory allocated by python during the call (bytes) and the result
+    """
+    best, result = timeit(func, repeat)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return best, peak, result
+
+
+def read_sentences(opt):
+    if opt.input:
+        with open(opt.input) as f:
+            return [line.split() for line in f]
+
+    random.seed(opt.seed)
+    words = ["Word%d" % i for i in range(opt.vocab_size)]
+    return [[random.choice(words) for _ in range(random.randint(1, 50))]
+            for _ in range(opt.num_sentences)]
+
+
+def benchmark_vocab(opt):
+    sentences = read_sentences(opt)
+    n_tokens = sum(len(sent) for sent in sentences)
+
+    vocab = onmt.Dict([onmt.constants.PAD_WORD, onmt.constants.UNK_WORD,
+                       onmt.constants.BOS_WORD, onmt.constants.EOS_WORD], lower=opt.lower)
+    for sent in sentences:
+        for word in sent:
+            vocab.add(word)
+
+    unk_word = onmt.constants.UNK_WORD
+    bos_word, eos_word = onmt.constants.BOS_WORD, onmt.constants.EOS_WORD
+
+    def per_token():
+        # the reference implementation: one lookup call per token, one tensor per sentence
+        unk = vocab.lookup(unk_word)
+        tensors = []
+        for sent in sentences:
+            vec = [vocab.lookup(bos_word)]
+            for word in sent:
+                vec.append(vocab.lookup(word, default=unk))
+            vec.append(vocab.lookup(eos_word))
+            tensors.append(torch.LongTensor(vec))
+        return tensors
+
+    def per_sentence():
+        return [vocab.convertToIdx(sent, unk_word, bos_word, eos_word) for sent in sentences]
+
+    def batch():
+        return vocab.convertToIdxBatch(sentences, unk_word, bos_word, eos_word)
+
+    print("* %d sentences, %d tokens, vocabulary size %d" % (len(sentences), n_tokens, vocab.size()))
+
+    reference_time, reference = timeit(per_token, opt.repeat)
+    sentence_time, _ = timeit(per_sentence, opt.repeat)
+    batch_time, (data, offsets) = timeit(batch, opt.repeat)
+
+    # sanity check: the batch conversion must give the same indices
+    assert torch.equal(torch.cat(reference), torch.from_numpy(data))
+    assert offsets[-1] == data.shape[0]
+
+    for name, elapsed in [('per-token lookup', reference_time),
+                          ('convertToIdx', sentence_time),
+                          ('convertToIdxBatch', batch_time)]:
+        print("%-20s %8.3f s  %10.0f tok/s  (x%.2f)" % (name, elapsed, n_tokens / elapsed, reference_time / elapsed))
+
+
+def benchmark_fetch(opt):
+    from onmt.data.mmap_indexed_dataset import MMapIndexedDataset, MMapIndexedDatasetBuilder, best_fitting_dtype
+    from onmt.data.dataset import to_tensors
+
+    sentences = read_sentences(opt)
+    vocab = onmt.Dict(lower=opt.lower)
+    for sent in sentences:
+        for word in sent:
+            vocab.add(word)
+    data, offsets = vocab.convertToIdxBatch(sentences, onmt.constants.UNK_WORD)
+
+    prefix = os.path.join(tempfile.mkdtemp(), 'fetch')
+    builder = MMapIndexedDatasetBuilder(prefix + '.bin', dtype=best_fitting_dtype(vocab.size()))
+    builder.add_items(data, offsets)
+    builder.finalize(prefix + '.idx')
+    dataset = MMapIndexedDataset(prefix, warmup='full')
+
+    # random batches (as after length sorting, the sentences of a batch are spread over the file)
+    rng = np.random.RandomState(opt.seed)
+    batches = [rng.randint(0, len(dataset), opt.batch_size_sents) for _ in range(opt.num_batches)]
+
+    def per_item():
+        return [to_tensors([dataset[i] for i in batch.tolist()]) for batch in batches]
+
+    def get_batch():
+        return [to_tensors(dataset.get_batch(batch)) for batch in batches]
+
+    print("* %d sentences, %d batches of %d sentences" % (len(dataset), opt.num_batches, opt.batch_size_sents))
+
+    item_time, reference = timeit(per_item, opt.repeat)
+    batch_time, result = timeit(get_batch, opt.repeat)
+
+    # sanity check: both accessors must give the same sentences
+    assert all(torch.equal(x, y) for ref, res in zip(reference, result) for x, y in zip(ref, res))
+
+    for name, elapsed in [('__getitem__', item_time), ('get_batch', batch_time)]:
+        print("%-20s %8.3f s  %10.1f us/batch  (x%.2f)" % (name, elapsed, elapsed / opt.num_batches * 1e6,
+                                                          item_time / elapsed))
+
+    del dataset
+    os.remove(prefix + '.bin')
+    os.remove(prefix + '.idx')
+    os.rmdir(os.path.dirname(prefix))
+
+
+def benchmark_shuffle(opt):
+    from onmt.data.mmap_indexed_dataset import MMapIndexedDataset, MMapIndexedDatasetBuilder, best_fitting_dtype
+
+    sentences = read_sentences(opt)
+    vocab = onmt.Dict([onmt.constants.PAD_WORD, onmt.constants.UNK_WORD,
+                       onmt.constants.BOS_WORD, onmt.constants.EOS_WORD], lower=opt.lower)
+    for sent in sentences:
+        for word in sent:
+            vocab.add(word)
+    data, offsets = vocab.convertToIdxBatch(sentences, onmt.constants.UNK_WORD,
+                                            onmt.constants.BOS_WORD, onmt.constants.EOS_WORD)
+
+    prefix = os.path.join(tempfile.mkdtemp(), 'shuffle')
+    builder = MMapIndexedDatasetBuilder(prefix + '.bin', dtype=best_fitting_dtype(vocab.size()))
+    builder.add_items(data, offsets)
+    builder.finalize(prefix + '.idx')
+    mmap_data = MMapIndexedDataset(prefix, warmup='full')
+    tensors = list(torch.from_numpy(data.astype(np.int64)).split(np.diff(offsets).tolist()))
+
+    print("* %d sentences" % len(tensors))
+
+    for name, src, tgt in [('in memory', tensors, tensors), ('memory indexed', mmap_data, mmap_data)]:
+        dataset = onmt.Dataset(src, tgt, [torch.Tensor([0])], [torch.Tensor([1])],
+                               batch_size_words=opt.batch_size_words,
+                               batch_size_sents=opt.batch_size_sents, data_type='text', sorting=True)
+
+        def zip_shuffle():
+            # the reference implementation: zip both sides into a list of pairs and rebuild them
+            pairs = list(zip(dataset.get_items(dataset.src, range(dataset.size())),
+                             dataset.get_items(dataset.tgt, range(dataset.size()))))
+            return zip(*[pairs[i] for i in torch.randperm(len(pairs))])
+
+        def index_shuffle():
+            dataset.shuffle()
+
+        zip_time, zip_memory, _ = timeit_memory(zip_shuffle, opt.repeat)
+        index_time, index_memory, _ = timeit_memory(index_shuffle, opt.repeat)
+
+        for method, elapsed, memory in [('zip', zip_time, zip_memory), ('index', index_time, index_memory)]:
+            print("%-15s %-6s %8.3f s  %10.1f MB peak  (x%.2f)" % (name, method, elapsed, memory / 2 ** 20,
+                                                                  zip_time / elapsed))
+
+    del mmap_data
+    os.remove(prefix + '.bin')
+    os.remove(prefix + '.idx')
+    os.rmdir(os.path.dirname(prefix))
+
+
+def benchmark_augment(opt):
+    from onmt.data.dataset import Batch
+    from onmt.speech.Augmenter import Augmenter
+
+    # log mel features (40) with 4 frames concatenated
+    rng = np.random.RandomState(opt.seed)
+    torch.manual_seed(opt.seed)
+    batches = [[torch.rand(int(length), 160) for length in rng.randint(50, 500, opt.batch_size_sents)]
+               for _ in range(opt.num_batches // 10)]
+    augmenter = Augmenter()
+
+    def per_utterance():
+        # the reference implementation: the masks are drawn and applied for every utterance
+        for data in batches:
+            samples = []
+            for sample in data:
+                sample = sample.float()
+                sample = sample.view(-1, 40).new(*sample.size()).copy_(sample)
+                for _ in range(augmenter.mf):
+                    f = int(random.uniform(0.0, augmenter.F))
+                    f_0 = int(random.uniform(0.0, 40 - f))
+                    sample[:, f_0:f_0 + f].zero_()
+                for _ in range(augmenter.mt):
+                    t = min(int(random.uniform(0.0, augmenter.T)), int(augmenter.max_t * sample.size(0)))
+                    t_0 = int(random.uniform(0.0, sample.size(0) - t - 1))
+                    sample[t_0:t_0 + t].zero_()
+                samples.append(sample)
+            Batch(samples, src_type='audio')
+
+    def batched():
+        for data in batches:
+            Batch(data, src_type='audio', augmenter=augmenter)
+
+    print("* %d batches of %d utterances" % (len(batches), opt.batch_size_sents))
+
+    utterance_time, _ = timeit(per_utterance, opt.repeat)
+    batch_time, _ = timeit(batched, opt.repeat)
+
+    for name, elapsed in [('per utterance', utterance_time), ('batched', batch_time)]:
+        print("%-20s %8.3f s  %10.1f ms/batch  (x%.2f)" % (name, elapsed, elapsed / len(batches) * 1e3,
+                                                          utterance_time / elapsed))
+
+
+def _distributed_worker(rank, opt, world_size, port, results):
+    import argparse
+    from options import make_parser
+    from onmt.model_factory import build_model, init_model_parameters
+    from onmt.modules.loss import NMTLossFunc
+    from onmt.multiprocessing.distributed import init_distributed, wrap_model, shard_steps, common_random_state
+
+    # one thread per process: the processes share the CPU cores
+    torch.set_num_threads(1)
+    train_opt = make_parser(argparse.ArgumentParser()).parse_args(
+        ['-data', '', '-save_model', '', '-model_size', str(opt.model_size), '-inner_size', str(opt.model_size * 4),
+         '-layers', '2', '-cpu_workers', str(world_size), '-dist_url', 'tcp://localhost:%d' % port])
+    init_distributed(train_opt, rank)
+
+    rng = np.random.RandomState(opt.seed)
+    vocab = onmt.Dict([onmt.constants.PAD_WORD, onmt.constants.UNK_WORD,
+                       onmt.constants.BOS_WORD, onmt.constants.EOS_WORD])
+    for i in range(opt.vocab_size):
+        vocab.add("Word%d" % i)
+    src = [torch.from_numpy(rng.randint(4, vocab.size(), length)) for length in rng.randint(5, 50, opt.num_sentences)]
+    tgt = [torch.cat([torch.LongTensor([onmt.constants.BOS]), sent, torch.LongTensor([onmt.constants.EOS])])
+           for sent in src]
+    dataset = onmt.Dataset(src, tgt, [torch.Tensor([0])], [torch.Tensor([1])],
+                           batch_size_words=opt.batch_size_words,
+                           batch_size_sents=opt.batch_size_sents, data_type='text', sorting=True)
+
+    dicts = {'src': vocab, 'tgt': vocab, 'langs': {'src': 0, 'tgt': 1}}
+    model = build_model(train_opt, dicts)
+    init_model_parameters(model, train_opt)
+    loss_function = NMTLossFunc(train_opt.model_size, vocab.size(), label_smoothing=0.1)
+    ddp_model = wrap_model(model, train_opt) if world_size > 1 else model
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.01)
+
+    with common_random_state(opt.seed):
+        dataset.create_order()
+
+    n_words = 0
+    start = time.time()
+    for i in shard_steps(0, min(opt.num_batches, len(dataset))):
+        dataset.set_index(i + rank)
+        batch = dataset.next()[0]
+        targets = batch.get('target_output')
+        tgt_mask = targets.ne(onmt.constants.PAD)
+        outputs = ddp_model(batch, target_mask=tgt_mask)
+        outputs['tgt_mask'] = tgt_mask
+        loss_function(outputs, targets, model=model)['loss'].backward()
+        optimizer.step()
+        optimizer.zero_grad()
+        n_words += batch.tgt_size
+
+    results[rank] = (n_words, time.time() - start)
+
+
+def benchmark_distributed(opt):
+    import torch.multiprocessing as mp
+
+    print("* %d synthetic sentences, at most %d batches of %d words, %d CPU cores" %
+          (opt.num_sentences, opt.num_batches, opt.batch_size_words, os.cpu_count()))
+
+    reference = None
+    for port, world_size in enumerate(opt.workers, 23456):
+        results = mp.Manager().dict()
+        mp.spawn(_distributed_worker, args=(opt, world_size, port, results), nprocs=world_size)
+
+        n_words = sum(words for words, _ in results.values())
+        elapsed = max(elapsed for _, elapsed in results.values())
+        throughput = n_words / elapsed
+        reference = throughput if reference is None else reference
+        print("%2d workers %8.3f s  %10.0f tgt tok/s  (x%.2f)" % (world_size, elapsed, throughput,
+                                                                throughput / reference))
+
+
+def saved_tensor_memory(func):
+    """
+    :return: the memory of the tensors saved for the backward pass during the call (bytes) and the result
+    (the storages shared by several saved tensors are counted once)
+    """
+    storages = dict()
+
+    def pack(tensor):
+        storage = tensor.untyped_storage()
+        storages[storage.data_ptr()] = storage.nbytes()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        result = func()
+
+    return sum(storages.values()), result
+
+
+def benchmark_checkpointing(opt):
+    from options import make_parser
+    from onmt.model_factory import build_model, init_model_parameters
+    from onmt.modules.loss import NMTLossFunc
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    rng = np.random.RandomState(opt.seed)
+    vocab = onmt.Dict([onmt.constants.PAD_WORD, onmt.constants.UNK_WORD,
+                       onmt.constants.BOS_WORD, onmt.constants.EOS_WORD])
+    for i in range(opt.vocab_size):
+        vocab.add("Word%d" % i)
+    src = [torch.from_numpy(rng.randint(4, vocab.size(), 64)) for _ in range(opt.batch_size_sents)]
+    tgt = [torch.cat([torch.LongTensor([onmt.constants.BOS]), sent, torch.LongTensor([onmt.constants.EOS])])
+           for sent in src]
+    dataset = onmt.Dataset(src, tgt, [torch.Tensor([0])], [torch.Tensor([1])], batch_size_words=opt.batch_size_words,
+                           batch_size_sents=opt.batch_size_sents, data_type='text', sorting=True)
+    batch = dataset.next()[0]
+    if device.type == 'cuda':
+        batch.cuda()
+
+    print("* %d layers of size %d, batches of %d x %d tokens on %s" %
+          (opt.layers, opt.model_size, batch.size, batch.get('target_output').size(0), device))
+
+    policies = [('none', 0, 1)] + [('every %d' % k if k > 1 else 'all', -1, k) for k in opt.checkpointing_intervals]
+    reference = None
+    for name, n_checkpointed, interval in policies:
+        train_opt = make_parser(argparse.ArgumentParser()).parse_args(
+            ['-data', '', '-save_model', '', '-model_size', str(opt.model_size),
+             '-inner_size', str(opt.model_size * 4), '-layers', str(opt.layers),
+             '-checkpointing', str(n_checkpointed), '-checkpointing_interval', str(interval)])
+        torch.manual_seed(opt.seed)
+        model = build_model(train_opt, {'src': vocab, 'tgt': vocab, 'langs': {'src': 0, 'tgt': 1}})
+        init_model_parameters(model, train_opt)
+        model = model.to(device)
+        model.train()
+        loss_function = NMTLossFunc(train_opt.model_size, vocab.size(), label_smoothing=0.1)
+
+        def forward():
+            targets = batch.get('target_output')
+            tgt_mask = targets.ne(onmt.constants.PAD)
+            outputs = model(batch, target_mask=tgt_mask)
+            outputs['tgt_mask'] = tgt_mask
+            return loss_function(outputs, targets, model=model)['loss']
+
+        def step():
+            forward().backward()
+            model.zero_grad()
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+
+        elapsed, _ = timeit(step, opt.repeat)
+        saved, loss = saved_tensor_memory(forward)
+        del loss
+
+        peak = ''
+        if device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats()
+            step()
+            peak = "  %8.1f MB peak" % (torch.cuda.max_memory_allocated() / 2 ** 20)
+
+        reference = (elapsed, saved) if reference is None else reference
+        print("%-10s %3d layers %8.3f s/step (x%.2f)  %8.1f MB saved for backward (x%.2f)%s" %
+              (name, len(model.encoder.checkpointed) + len(model.decoder.checkpointed), elapsed,
+               elapsed / reference[0], saved / 2 ** 20, saved / reference[1], peak))
+
+
+def main():
+    opt = parser.parse_args()
+
+    if opt.task == 'vocab':
+        benchmark_vocab(opt)
+    elif opt.task == 'fetch':
+        benchmark_fetch(opt)
+    elif opt.task == 'shuffle':
+        benchmark_shuffle(opt)
+    elif opt.task == 'augment':
+        benchmark_augment(opt)
+    elif opt.task == 'distributed':
+        benchmark_distributed(opt)
+    elif opt.task == 'checkpointing':
+        benchmark_checkpointing(opt)
+    else:
+        raise NotImplementedError("Unknown benchmark task %s" % opt.task)
+
+
+if __name__ == "__main__":
+    main()
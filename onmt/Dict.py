@@ -1,12 +1,41 @@
 import torch
+import numpy as np
 import math
 import random, string
 from multiprocessing import Pool
 from collections import Counter
+import heapq
 import os
 from onmt.utils import safe_readline
 
 
+np_types = {
+    'int64': np.int64,
+    'int32': np.int32,
+    'int': np.int32,
+    'int16': np.int16
+}
+
+
+class _LookupTable(dict):
+    """
+    Surface form -> index table used for batch conversion.
+    Unknown surface forms are resolved once (with lowercasing if necessary) and then cached,
+    so every word type is lowered only once per batch.
+    """
+
+    def __init__(self, label_to_idx, unk, lower=False):
+        super().__init__()
+        self.label_to_idx = label_to_idx
+        self.unk = unk
+        self.lower = lower
+
+    def __missing__(self, key):
+        idx = self.label_to_idx.get(key.lower() if self.lower else key, self.unk)
+        self[key] = idx
+        return idx
+
+
 class Dict(object):
     def __init__(self, data=None, lower=False):
         self.idxToLabel = {}
@@ -101,9 +130,9 @@ class Dict(object):
             return self
 
         # Only keep the `size` most frequent entries.
-        freq = torch.Tensor(
-                [self.frequencies[i] for i in range(len(self.frequencies))])
-        _, idx = torch.sort(freq, 0, True)
+        # (partial selection with a heap instead of sorting all frequencies)
+        idx = heapq.nlargest(size + len(self.special), range(self.size()),
+                             key=lambda i: self.frequencies.get(i, 0))
 
         newDict = Dict()
         newDict.lower = self.lower
@@ -114,7 +143,7 @@ class Dict(object):
             newDict.addSpecial(self.idxToLabel[i])
             count = count + 1
 
-        for i in idx.tolist():
+        for i in idx:
             newDict.add(self.idxToLabel[i])
             count = count + 1
             
@@ -123,6 +152,17 @@ class Dict(object):
 
         return newDict
 
+    def frequency_order(self):
+        """
+        The indices ordered by decreasing frequency: the special entries first, ties keep the order of the indices
+        (the entries added from a counter or by pruning are already in this order)
+        """
+        special = set(self.special)
+        others = sorted((i for i in range(self.size()) if i not in special),
+                        key=lambda i: -self.frequencies.get(i, 0))
+
+        return list(self.special) + others
+
     def convertToIdx(self, labels, unkWord, bos_word=None, eos_word=None, type='int64'):
         """
         Convert `labels` to indices. Use `unkWord` if not found.
@@ -134,9 +174,11 @@ class Dict(object):
             vec += [self.lookup(bos_word)]
 
         unk = self.lookup(unkWord)
-        for label in labels:
-            vec.append(self.lookup(label, default=unk))
-        # vec += [self.lookup(label, default=unk) for label in labels]
+        get = self.labelToIdx.get
+        if self.lower:
+            vec += [get(label.lower(), unk) for label in labels]
+        else:
+            vec += [get(label, unk) for label in labels]
 
         if eos_word is not None:
             vec += [self.lookup(eos_word)]
@@ -150,6 +192,44 @@ class Dict(object):
         else:
             raise NotImplementedError
 
+    def convertToIdxBatch(self, sentences, unkWord, bos_word=None, eos_word=None, type='int64'):
+        """
+        Convert a list of tokenized sentences to indices at once.
+        Returns one flat numpy array containing the indices of all sentences
+        and the offsets (len(sentences) + 1) so that sentence i is data[offsets[i]:offsets[i+1]]
+        """
+        if type not in np_types:
+            raise NotImplementedError
+
+        table = _LookupTable(self.labelToIdx, self.lookup(unkWord), lower=self.lower)
+        get = table.__getitem__
+
+        prefix = [self.lookup(bos_word)] if bos_word is not None else []
+        suffix = [self.lookup(eos_word)] if eos_word is not None else []
+        n_extra = len(prefix) + len(suffix)
+
+        vec = []
+        lengths = [0]
+
+        for labels in sentences:
+            vec += prefix
+            vec += map(get, labels)
+            vec += suffix
+            lengths.append(len(labels) + n_extra)
+
+        offsets = np.cumsum(lengths, dtype=np.int64)
+
+        return np.array(vec, dtype=np_types[type]), offsets
+
+    def convertToIdxTensors(self, sentences, unkWord, bos_word=None, eos_word=None, type='int64'):
+        """
+        Batch version of convertToIdx: returns one tensor per sentence
+        (the tensors are views of one flat tensor built by convertToIdxBatch)
+        """
+        data, offsets = self.convertToIdxBatch(sentences, unkWord, bos_word=bos_word, eos_word=eos_word, type=type)
+
+        return list(torch.from_numpy(data).split(np.diff(offsets).tolist()))
+
     def convertToIdx2(self, labels, unkWord, bos_word=None, eos_word=None):
         """
         Convert `labels` to indices. Use `unkWord` if not found.
@@ -215,14 +295,15 @@ class Dict(object):
         print("Vocabulary size after patching: %d" % self.size())
 
     @staticmethod
-    def count_file(filename, tokenizer, worker_id=0, num_workers=1):
+    def count_file(filename, tokenizer, worker_id=0, num_workers=1, verbose=True):
 
         counter = Counter()
         with open(filename, 'r', encoding='utf-8') as f:
             size = os.fstat(f.fileno()).st_size
             chunk_size = size // num_workers
             offset = worker_id * chunk_size
-            end = offset + chunk_size
+            # the last worker takes the remainder of the file
+            end = offset + chunk_size if worker_id < num_workers - 1 else size
 
             f.seek(offset)
 
@@ -233,46 +314,100 @@ class Dict(object):
             count = 0
 
             while line:
-                tokenized_words = tokenizer.tokenize(line)
-                for word in tokenized_words:
-                    counter.update([word])
+                counter.update(tokenizer.tokenize(line))
                 if f.tell() > end:
                     break
                 line = f.readline()
 
                 count += 1
-                if count % 100000 == 0:
+                if verbose and count % 100000 == 0:
                     print("[INFO] Thread %d processed %d lines." % (worker_id, count))
 
         return counter
 
     @staticmethod
-    def gen_dict_from_file(filename, dict, tokenizer, num_workers):
-
-        def merge_result(counter):
-            for w, c in sorted(counter.items()):
-                # dict.add_symbol(w, c)
-                dict.add(w, num=c)
+    def merge_counters(counters):
+        """
+        Merge a list of counters pairwise (tree reduction) and return the merged counter.
+        The smaller counter of each pair is always merged into the larger one.
+        """
+        counters = list(counters)
+        if len(counters) == 0:
+            return Counter()
+
+        while len(counters) > 1:
+            merged = []
+            for i in range(0, len(counters) - 1, 2):
+                large, small = sorted(counters[i:i + 2], key=len, reverse=True)
+                large.update(small)
+                merged.append(large)
+            if len(counters) % 2 == 1:
+                merged.append(counters[-1])
+            counters = merged
+
+        return counters[0]
 
+    @staticmethod
+    def count_files(filenames, tokenizer, num_workers=1, verbose=True):
+        """
+        Count the tokens of the files. Each file is streamed in `num_workers` chunks
+        (all chunks of all files are processed by the same pool) and the counters
+        of the workers are merged pairwise.
+        """
         if num_workers > 1:
-            pool = Pool(processes = num_workers)
+            pool = Pool(processes=num_workers)
             results = []
 
-            for worker_id in range(num_workers):
-                results.append(pool.apply_async(
-                    Dict.count_file,
-                    (filename, tokenizer, worker_id, num_workers)
-                ))
+            for filename in filenames:
+                for worker_id in range(num_workers):
+                    results.append(pool.apply_async(
+                        Dict.count_file,
+                        (filename, tokenizer, worker_id, num_workers, verbose)
+                    ))
             pool.close()
             pool.join()
 
-            for r in results:
-                merge_result(r.get())
+            counters = [r.get() for r in results]
+        else:
+            counters = [Dict.count_file(filename, tokenizer, verbose=verbose) for filename in filenames]
+
+        return Dict.merge_counters(counters)
 
+    def add_counter(self, counter, size=None):
+        """
+        Add the entries of `counter` to the dictionary, most frequent first.
+        If `size` is given, the dictionary keeps at most `size` entries (special entries included)
+        and only those are selected from the counter with a heap, instead of sorting all entries.
+        """
+        if self.lower:
+            lowered = Counter()
+            for w, c in counter.items():
+                lowered[w.lower()] += c
+            counter = lowered
+
+        # order by frequency, ties are broken alphabetically
+        key = lambda x: (-x[1], x[0])
+        if size is None:
+            entries = sorted(counter.items(), key=key)
         else:
-            counts = Dict.count_file(filename, tokenizer)
-            merge_result(counts)
+            # the entries already in the dictionary don't take new places: the n_entries most frequent entries
+            # contain enough new entries (those are added until the dictionary reaches the size)
+            n_existing = sum(1 for w in self.labelToIdx if w in counter)
+            n_entries = max(size - self.size() + n_existing, 0)
+            entries = heapq.nsmallest(n_entries, counter.items(), key=key)
+
+        for w, c in entries:
+            if size is not None and w not in self.labelToIdx and self.size() >= size:
+                continue
+            self.add(w, num=c)
+
+        return self
+
+    @staticmethod
+    def gen_dict_from_file(filename, dict, tokenizer, num_workers, size=None):
 
+        counter = Dict.count_files([filename], tokenizer, num_workers=num_workers)
+        dict.add_counter(counter, size=size)
 
     #
     # @staticmethod
@@ -0,0 +1,245 @@
+from __future__ import division
+
+import os
+import time
+
+import h5py as h5
+import numpy as np
+import torch.multiprocessing as mp
+
+import onmt
+from onmt.data.mmap_indexed_dataset import MMapIndexedDatasetBuilder, data_file_path, index_file_path
+from onmt.data.preprocess_pipeline import shard_prefix
+
+"""
+Parallel preprocessing of speech features (ASR)
+
+The utterance i has the features i (the key str(i) in the h5 files or the line i of the scp file)
+and the transcript on the line i of the target file.
+The utterances are split into contiguous ranges, one per worker. Each worker reads its features,
+applies stride / concat / type conversion in numpy and writes its own memory indexed shards.
+The shards are concatenated (byte copy) in the order of the ranges, so the output keeps the order of the input.
+"""
+
+
+def reshape_features(features, stride=1, concat=1, dtype=np.float32):
+    """
+    Keep every stride-th frame and concatenate every concat frames into one (the last frames are padded with 0)
+    :param features: numpy array (frames x feature size)
+    :return: numpy array (frames / concat x feature size * concat) of the type dtype (at most one copy)
+    """
+    if stride != 1:
+        features = features[0::stride]
+
+    if concat == 1:
+        return features.astype(dtype, copy=False)
+
+    n_frames, feature_size = features.shape
+    n_rows = (n_frames + concat - 1) // concat
+
+    reshaped = np.zeros((n_rows * concat, feature_size), dtype=dtype)
+    reshaped[:n_frames] = features
+
+    return reshaped.reshape(n_rows, concat * feature_size)
+
+
+def add_previous_context(features, previous):
+    """
+    Prepend the features of the previous utterances (each one followed by a frame of zeros)
+    :param previous: list of the features of the previous utterances (oldest first)
+    """
+    blocks = list()
+    for context in previous:
+        blocks += [context, np.zeros((1, features.shape[1]), dtype=features.dtype)]
+
+    return np.concatenate(blocks + [features]) if len(blocks) > 0 else features
+
+
+def h5_files(src_file):
+    """
+    :return: the h5 files of the features: src_file (if it ends with h5) or src_file.0.h5, src_file.1.h5 ...
+    """
+    if src_file.endswith("h5"):
+        return [src_file]
+
+    files = list()
+    while os.path.exists(src_file + "." + str(len(files)) + ".h5"):
+        files.append(src_file + "." + str(len(files)) + ".h5")
+
+    return files
+
+
+class FeatureReader(object):
+    """
+    Random access to the features of the utterances
+    (the files are opened on the first access, so that the reader can be sent to worker processes)
+    """
+
+    def __init__(self, src_file, asr_format="h5"):
+        self.src_file = src_file
+        self.asr_format = asr_format
+        self.files = None
+        self.entries = None
+
+        if asr_format == "h5":
+            self.paths = h5_files(src_file)
+            if len(self.paths) == 0:
+                raise FileNotFoundError("No feature file found for %s" % src_file)
+        elif asr_format in ["scp", "kaldi"]:
+            with open(src_file) as f:
+                self.entries = [line.strip().split(None, 1)[1] for line in f if line.strip()]
+        else:
+            raise NotImplementedError("Unknown ASR format %s" % asr_format)
+
+    def open(self):
+        if self.asr_format == "h5" and self.files is None:
+            self.files = [h5.File(path, 'r') for path in self.paths]
+
+    def __len__(self):
+        if self.asr_format == "h5":
+            self.open()
+            return sum(len(f) for f in self.files)
+
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        if self.asr_format == "h5":
+            self.open()
+
+            key = str(index)
+            for f in self.files:
+                if key in f:
+                    return np.asarray(f[key])
+
+            raise KeyError("No feature vector for index: %d" % index)
+
+        import kaldiio
+        return kaldiio.load_mat(self.entries[index])
+
+    def close(self):
+        if self.files is not None:
+            for f in self.files:
+                f.close()
+        self.files = None
+
+
+def _binarize_range(worker_id, reader, lines, start, tgt_dict, tokenizer, output_prefix, settings):
+    """
+    Process the utterances start ... start + len(lines) into the shards of the worker
+    """
+    stride, concat = settings['stride'], settings['concat']
+    src_builder = MMapIndexedDatasetBuilder(data_file_path(shard_prefix(output_prefix, 'src', worker_id)),
+                                            dtype=settings['src_dtype'])
+    tgt_builder = MMapIndexedDatasetBuilder(data_file_path(shard_prefix(output_prefix, 'tgt', worker_id)),
+                                            dtype=settings['tgt_dtype'])
+    n_empty, n_ignored, n_frames = 0, 0, 0
+    read_time = 0
+    targets = list()
+
+    for i, line in enumerate(lines):
+        tokens = tokenizer.tokenize(line)
+        # source and/or target are empty
+        if len(tokens) == 0:
+            n_empty += 1
+            continue
+
+        # the features are only read if the target is not too long
+        if len(tokens) > settings['max_tgt_length'] - 2:
+            n_ignored += 1
+            continue
+
+        read_start = time.time()
+        features = reader[start + i]
+        read_time += time.time() - read_start
+
+        features = reshape_features(features, stride=stride, concat=concat, dtype=settings['src_dtype'])
+        if features.shape[0] > settings['max_src_length']:
+            n_ignored += 1
+            continue
+
+        if settings['tgt_trunc'] > 0:
+            tokens = tokens[:settings['tgt_trunc']]
+
+        src_builder.add_item(features)
+        targets.append(tokens)
+        n_frames += features.shape[0]
+
+    reader.close()
+
+    unk_word = onmt.constants.UNK_WORD
+    data, offsets = tgt_dict.convertToIdxBatch(targets, unk_word,
+                                               bos_word=onmt.constants.BOS_WORD, eos_word=onmt.constants.EOS_WORD)
+    tgt_builder.add_items(data, offsets)
+    n_unk = int((data == tgt_dict.lookup(unk_word)).sum())
+
+    src_builder.finalize(index_file_path(shard_prefix(output_prefix, 'src', worker_id)))
+    tgt_builder.finalize(index_file_path(shard_prefix(output_prefix, 'tgt', worker_id)))
+
+    return {'id': worker_id, 'written': len(targets), 'empty': n_empty, 'ignored': n_ignored,
+            'unk': n_unk, 'frames': n_frames, 'read_time': read_time}
+
+
+def _binarize_range_star(args):
+    return _binarize_range(*args)
+
+
+def binarize_asr_parallel(src_file, tgt_file, tgt_dict, output_prefix, asr_format="h5", input_type='word',
+                          max_src_length=64, max_tgt_length=64, tgt_trunc=0, stride=1, concat=1, fp16=False,
+                          tgt_dtype=np.int64, num_workers=1, verbose=False):
+    """
+    Binarize the features and transcripts into memory indexed files output_prefix.src/tgt.bin/idx
+    (the features are 2D: frames x feature size)
+    :param src_file: the h5 file (or the prefix of the files prefix.0.h5 ...) or the scp file
+    :param tgt_file: the transcripts (one line per utterance)
+    :param tgt_dict: onmt.Dict of the target
+    :param num_workers: number of worker processes (each one processes a contiguous range of utterances)
+    :return: dictionary with the number of written sentences, empty lines and ignored sentences
+    """
+    start_time = time.time()
+
+    with open(tgt_file, encoding='utf-8') as f:
+        lines = f.readlines()
+
+    reader = FeatureReader(src_file, asr_format=asr_format)
+    tokenizer = onmt.Tokenizer(input_type)
+    settings = {'stride': stride, 'concat': concat, 'max_src_length': max_src_length,
+                'max_tgt_length': max_tgt_length, 'tgt_trunc': tgt_trunc,
+                'src_dtype': np.float16 if fp16 else np.float32, 'tgt_dtype': tgt_dtype}
+
+    num_workers = max(min(num_workers, len(lines)), 1)
+    bounds = np.linspace(0, len(lines), num_workers + 1).astype(np.int64).tolist()
+    tasks = [(worker_id, reader, lines[bounds[worker_id]:bounds[worker_id + 1]], bounds[worker_id],
+              tgt_dict, tokenizer, output_prefix, settings) for worker_id in range(num_workers)]
+
+    if num_workers > 1:
+        with mp.Pool(num_workers) as pool:
+            results = pool.map(_binarize_range_star, tasks)
+    else:
+        results = [_binarize_range_star(tasks[0])]
+
+    # merge the shards in the order of the ranges
+    for name, dtype in [('src', settings['src_dtype']), ('tgt', tgt_dtype)]:
+        builder = MMapIndexedDatasetBuilder(data_file_path(output_prefix + ".%s" % name), dtype=dtype)
+        for worker_id in range(num_workers):
+            prefix = shard_prefix(output_prefix, name, worker_id)
+            builder.merge_file_(prefix)
+            os.remove(data_file_path(prefix))
+            os.remove(index_file_path(prefix))
+        builder.finalize(index_file_path(output_prefix + ".%s" % name))
+
+    summary = dict()
+    for key in ['written', 'empty', 'ignored', 'unk', 'frames']:
+        summary[key] = sum(result[key] for result in results)
+
+    elapse = time.time() - start_time
+    if verbose:
+        read_time = sum(result['read_time'] for result in results)
+        print("[INFO] Reading the features: %.2f s busy in %d workers" % (read_time, num_workers))
+
+    print('Total number of unk words: %d' % summary['unk'])
+    print("[INFO] Wrote %d utterances (%d frames) to %s.* (%d empty lines, %d ignored due to length "
+          "src len > %d or tgt len > %d) in %.1f s (%.0f utterances/s)" %
+          (summary['written'], summary['frames'], output_prefix, summary['empty'], summary['ignored'],
+           max_src_length, max_tgt_length, elapse, summary['written'] / max(elapse, 1e-6)))
+
+    return summary
@@ -1,6 +1,8 @@
 from __future__ import division
 
+import copy
 import math
+import numpy as np
 import torch
 import torch.utils.data
 from collections import defaultdict
@@ -16,6 +18,23 @@ Two basic classes:
 """
 
 
+def to_tensors(data, dtype=np.int64):
+    """
+    Convert a list of numpy arrays (views on the memory indexed data, stored with a compact type)
+    into tensors. The conversion is done once for the whole list and the results are views.
+    :param data: list of numpy arrays (1D or 2D) or tensors (returned unchanged)
+    :param dtype: the type of the tensors (int64 for text, float32 for audio features)
+    :return: list of tensors
+    """
+    if len(data) == 0 or not isinstance(data[0], np.ndarray):
+        return data
+
+    lengths = [x.shape[0] for x in data]
+    flat = torch.from_numpy(np.concatenate(data).astype(dtype, copy=False))
+
+    return list(flat.split(lengths))
+
+
 class Batch(object):
     # An object to manage the data within a minibatch
     def __init__(self, src_data, tgt_data=None,
@@ -50,8 +69,11 @@ class Batch(object):
             self.src_align_right = True
 
         self.tgt_align_right = tgt_align_right
+        # the augmentation which is applied after the transfer to the GPU (see cuda)
+        self.augmenter = augmenter if augmenter is not None and augmenter.on_gpu else None
 
         if src_data is not None:
+            src_data = to_tensors(src_data, dtype=np.int64 if self.src_type == 'text' else np.float32)
             self.tensors['source'], self.tensors['source_pos'], self.src_lengths = \
                                                                     self.collate(src_data,
                                                                                  align_right=self.src_align_right,
@@ -68,6 +90,7 @@ class Batch(object):
             self.src_size = 0
 
         if tgt_data is not None:
+            tgt_data = to_tensors(tgt_data)
             target_full, target_pos, self.tgt_lengths = self.collate(tgt_data, align_right=self.tgt_align_right)
             target_full = target_full.t().contiguous()  # transpose BxT to TxB
             self.tensors['target'] = target_full
@@ -84,9 +107,9 @@ class Batch(object):
         self.size = len(src_data) if src_data is not None else len(tgt_data)
 
         if src_lang_data is not None:
-            self.tensors['source_lang'] = torch.cat(src_lang_data).long()
+            self.tensors['source_lang'] = torch.cat(to_tensors(src_lang_data)).long()
         if tgt_lang_data is not None:
-            self.tensors['target_lang'] = torch.cat(tgt_lang_data).long()
+            self.tensors['target_lang'] = torch.cat(to_tensors(tgt_lang_data)).long()
 
     def switchout(self, swrate, src_vocab_size, tgt_vocab_size):
         # Switch out function ... currently works with only source text data
@@ -151,15 +174,11 @@ class Batch(object):
 
             # First step: on-the-fly processing for the samples
             # Reshaping: either downsampling or upsampling
-            # On the fly augmentation
             samples = []
 
             for i in range(len(data)):
                 sample = data[i]
 
-                if augmenter is not None:
-                    sample = augmenter.augment(sample)
-
                 if self.upsampling:
                     sample = sample.view(-1, self.feature_size)
 
@@ -177,15 +196,22 @@ class Batch(object):
             # feature size + 1 because the last dimension is created for padding
             tensor = data[0].float().new(batch_size, max_length, feature_size + 1).fill_(onmt.constants.PAD)
 
-            for i in range(len(samples)):
-                sample = samples[i]
+            # copy all the frames at once: the rows of the frames in the (batch x length) rows of the tensor
+            lengths_ = torch.LongTensor(lengths)
+            starts = torch.arange(batch_size) * max_length
+            if align_right:
+                starts += max_length - lengths_
+            starts = torch.repeat_interleave(starts - torch.cumsum(lengths_, 0) + lengths_, lengths_)
+            rows = starts + torch.arange(starts.size(0))
 
-                data_length = sample.size(0)
-                offset = max_length - data_length if align_right else 0
+            tensor_ = tensor.view(batch_size * max_length, feature_size + 1)
+            tensor_[rows, 1:] = torch.cat(samples).to(tensor.dtype)
+            # in padding dimension: 0 is not padded, 1 is padded
+            tensor_[rows, 0] = 1
 
-                tensor[i].narrow(0, offset, data_length).narrow(1, 1, sample.size(1)).copy_(sample)
-                # in padding dimension: 0 is not padded, 1 is padded
-                tensor[i].narrow(0, offset, data_length).narrow(1, 0, 1).fill_(1)
+            # On the fly augmentation of the whole batch (here or after the transfer to the GPU)
+            if augmenter is not None and not augmenter.on_gpu:
+                augmenter.augment_batch(tensor, lengths, align_right=align_right)
 
             return tensor, None, lengths
         else:
@@ -197,6 +223,64 @@ class Batch(object):
         else:
             return None
 
+    def split(self, n_parts):
+        """
+        Split the batch into n_parts batches of consecutive sequences
+        (e.g. to process a batch which does not fit into memory in several passes)
+        The padding which is not needed by the sequences of a part is removed.
+        :return: list of batches
+        """
+        def trim(tensor, length, align_right):
+            # keep the length first rows (or the last ones for the sequences aligned to the right)
+            offset = tensor.size(0) - length if align_right else 0
+            return tensor.narrow(0, offset, length).contiguous()
+
+        parts = list()
+        for ids in torch.arange(self.size).chunk(n_parts):
+            start, size = int(ids[0]), ids.size(0)
+            part = copy.copy(self)
+            part.size = size
+            part.tensors = defaultdict(lambda: None)
+
+            for key, tensor in self.tensors.items():
+                if tensor is None:
+                    continue
+                if key == 'src_length' or (key in ['source_lang', 'target_lang'] and tensor.size(0) == self.size):
+                    # one value per sequence
+                    part.tensors[key] = tensor.narrow(0, start, size)
+                elif key in ['source_lang', 'target_lang']:
+                    # bilingual: one value for the whole batch
+                    part.tensors[key] = tensor
+                else:
+                    # T x B (x feature size)
+                    part.tensors[key] = tensor.narrow(1, start, size).contiguous()
+
+            if part.tensors['src_length'] is not None:
+                part.src_lengths = part.tensors['src_length']
+                part.src_size = int(part.src_lengths.sum())
+                length = int(part.src_lengths.max())
+                for key in ['source', 'source_pos']:
+                    if part.tensors[key] is not None:
+                        part.tensors[key] = trim(part.tensors[key], length, self.src_align_right)
+
+            if self.tensors['target'] is not None:
+                part.tgt_lengths = self.tgt_lengths[start:start + size]
+                part.tgt_size = sum([length - 1 for length in part.tgt_lengths])
+                length = max(part.tgt_lengths)
+                target_full = trim(part.tensors['target'], length, self.tgt_align_right)
+                part.tensors['target'] = target_full
+                part.tensors['target_input'] = target_full[:-1]
+                part.tensors['target_output'] = target_full[1:]
+                part.tensors['target_pos'] = trim(part.tensors['target_pos'], length - 1, self.tgt_align_right)
+                part.tensors['tgt_mask'] = part.tensors['target_output'].ne(onmt.constants.PAD)
+            elif part.tensors['tgt_mask'] is not None:
+                # language model blocks (no padding to remove)
+                part.tgt_size = int(part.tensors['tgt_mask'].sum())
+
+            parts.append(part)
+
+        return parts
+
     def cuda(self, fp16=False):
         """
         Send the minibatch data into GPU. Old-fashioned without the 'device' control
@@ -215,6 +299,12 @@ class Batch(object):
             else:
                 continue
 
+        # the source is T x B x (1 + feature_size) after collate
+        if self.augmenter is not None and self.tensors['source'] is not None:
+            self.augmenter.augment_batch(self.tensors['source'].transpose(0, 1), self.src_lengths,
+                                         align_right=self.src_align_right)
+            self.augmenter = None
+
 
 class Dataset(torch.utils.data.Dataset):
     def __init__(self, src_data, tgt_data,
@@ -235,6 +325,12 @@ class Dataset(torch.utils.data.Dataset):
         :param multiplier: The number of sequences must divide by this number (for fp16 when multiplier=8)
         :param reshape_speech: Put N frames together to reduce the length (this might be done already in preprocessing)
         :param augment: Speech Augmentation (currently only spec augmentation is implemented)
+        :param augment_on_gpu: (kwargs) apply the augmentation after the batch is sent to the GPU
+        :param subset: (kwargs) only use the sentences with these indices (memory indexed data)
+        :param bucket_shuffle: (kwargs) pack the batches again for every (random) order,
+        shuffling the sentences with the same length
+        :param prefetch_batches: (kwargs) prefetch the data of the next K batches (memory indexed data opened with
+        the madvise warmup policy)
         """
 
         """
@@ -255,6 +351,28 @@ class Dataset(torch.utils.data.Dataset):
         self.tgt_align_right = tgt_align_right
         self.upsampling = kwargs.get('upsampling', False)
         # self.reshape_speech = reshape_speech
+        self.bucket_shuffle = kwargs.get('bucket_shuffle', False)
+        self.order_seed = None
+
+        # the data which can be prefetched (memory indexed) and the index of each sentence in this data
+        self.prefetch_batches = kwargs.get('prefetch_batches', 0)
+        self.prefetch_data = [data for data in [src_data, tgt_data]
+                              if getattr(data, 'supports_prefetch', False)]
+        self.prefetch_index = 0
+
+        # memory indexed data (with get_batch) is never reordered in memory, and no data is reordered by shuffle():
+        # data_order maps the sentences of the dataset to their indices in the data (None: same order)
+        self.indexed = all(data is None or hasattr(data, 'get_batch') for data in [src_data, tgt_data])
+        self.data_order = None
+        # the lengths of the sentences of each side in the order of the data (computed once)
+        self._data_sizes = dict()
+
+        # e.g. one language pair of a multilingual corpus
+        subset = kwargs.get('subset', None)
+        if subset is not None:
+            assert self.indexed, "Subsets are only supported for memory indexed data"
+            self.data_order = np.asarray(subset, dtype=np.int64)
+
         if tgt_data:
             self.tgt = tgt_data
 
@@ -268,23 +386,29 @@ class Dataset(torch.utils.data.Dataset):
             assert self.src is not None
             assert self.tgt is not None
 
-            src_sizes = [data.size(0) for data in src_data]
-            tgt_sizes = [data.size(0) for data in tgt_data]
-            orders = range(len(self.src))
+            src_sizes = self.get_sizes(src_data).tolist()
+            tgt_sizes = self.get_sizes(tgt_data).tolist()
+            orders = range(len(src_sizes))
 
             z = zip(src_sizes, tgt_sizes, orders)
 
             if self._type == 'text':
-                # For machine translation, sort by source first, and then target
-                sorted_z = sorted(sorted(z, key=lambda x: x[0]), key=lambda x: x[1])
+                # For machine translation, sort by the length used for batching (the longest side),
+                # then by target and source so that both sides have little padding
+                sorted_z = sorted(z, key=lambda x: (max(x[1] - 1, x[0]), x[1], x[0]))
 
             elif self._type == 'audio':
                 sorted_z = sorted(sorted(z, key=lambda x: x[1]), key=lambda x: x[0])
 
             sorted_order = [z_[2] for z_ in sorted_z]
 
-            self.src = [self.src[i] for i in sorted_order]
-            self.tgt = [self.tgt[i] for i in sorted_order]
+            if self.indexed:
+                sorted_order = np.asarray(sorted_order, dtype=np.int64)
+                self.data_order = sorted_order if self.data_order is None else self.data_order[sorted_order]
+            else:
+                self.src = [self.src[i] for i in sorted_order]
+                self.tgt = [self.tgt[i] for i in sorted_order]
+                self._data_sizes = dict()
 
         self.src_langs = src_langs
         self.tgt_langs = tgt_langs
@@ -297,11 +421,14 @@ class Dataset(torch.utils.data.Dataset):
             self.bilingual = True
         else:
             self.bilingual = False
-            if sorting:
+            if sorting and not self.indexed:
                 self.src_langs = [self.src_langs[i] for i in sorted_order]
                 self.tgt_langs = [self.tgt_langs[i] for i in sorted_order]
 
-        self.fullSize = len(self.src) if self.src is not None else len(self.tgt)
+        if self.data_order is not None:
+            self.fullSize = len(self.data_order)
+        else:
+            self.fullSize = len(self.src) if self.src is not None else len(self.tgt)
 
         # maximum number of tokens in a mb
         self.batch_size_words = batch_size_words
@@ -324,7 +451,7 @@ class Dataset(torch.utils.data.Dataset):
         self.batchOrder = None
 
         if augment:
-            self.augmenter = Augmenter()
+            self.augmenter = Augmenter(on_gpu=kwargs.get('augment_on_gpu', False))
         else:
             self.augmenter = None
 
@@ -336,12 +463,69 @@ class Dataset(torch.utils.data.Dataset):
 
         pass
 
+    def get_sizes(self, data):
+        """
+        :return: the lengths of the sentences (numpy array in the order of the dataset)
+        """
+        if id(data) not in self._data_sizes:
+            if hasattr(data, 'sizes'):
+                sizes = np.asarray(data.sizes, dtype=np.int64)
+            else:
+                sizes = np.asarray([len(sample) for sample in data], dtype=np.int64)
+            self._data_sizes[id(data)] = sizes
+
+        sizes = self._data_sizes[id(data)]
+        if self.data_order is not None:
+            sizes = sizes[self.data_order]
+        return sizes
+
+    def get_items(self, data, ids):
+        """
+        :param data: source, target or language data
+        :param ids: indices of the sentences in the dataset
+        :return: list of the sentences (get_batch is used for memory indexed data)
+        """
+        if self.data_order is not None:
+            ids = self.data_order[ids]
+
+        if hasattr(data, 'get_batch'):
+            return data.get_batch(ids)
+
+        return [data[i] for i in ids]
+
+    def get_lengths(self):
+        """
+        :return: the source and target lengths (0 if there is no such side) and the length used for batching
+        (the longest side; the target without <s>) of each sentence
+        """
+        n = self.fullSize
+        src_sizes = self.get_sizes(self.src) if self.src is not None else np.zeros(n, dtype=np.int64)
+        tgt_sizes = self.get_sizes(self.tgt) if self.tgt is not None else np.zeros(n, dtype=np.int64)
+
+        if self.tgt is not None and self.src is not None:
+            lengths = np.maximum(tgt_sizes - 1, src_sizes)
+        elif self.tgt is not None:
+            lengths = tgt_sizes - 1
+        else:
+            lengths = src_sizes
+
+        return src_sizes, tgt_sizes, lengths
+
     # This function allocates the mini-batches (grouping sentences with the same size)
-    def allocate_batch(self):
+    def allocate_batch(self, seed=None):
+        """
+        Pack the sentences (in the sorted order) into mini-batches.
+        With pad_count, a batch is closed when its padded size (number of sentences x the longest sentence)
+        would exceed batch_size_words.
+        :param seed: if given, the sentences with the same source and target lengths are shuffled
+        (bucketed shuffling) so that the batches are different but exactly as dense as the sorted ones
+        """
+        self.batches = []
 
         cur_batch = []
         cur_batch_size = 0
         cur_batch_sizes = []
+        cur_max = 0
 
         def oversize_(cur_batch, sent_size):
 
@@ -355,20 +539,20 @@ class Dataset(torch.utils.data.Dataset):
                 if len(cur_batch_sizes) == 0:
                     return False
 
-                if (max(max(cur_batch_sizes), sent_size)) * (len(cur_batch) + 1) > self.batch_size_words:
+                if max(cur_max, sent_size) * (len(cur_batch) + 1) > self.batch_size_words:
                     return True
             return False
 
-        i = 0
-        while i < self.fullSize:
+        src_sizes, tgt_sizes, lengths = self.get_lengths()
 
-            if self.tgt is not None and self.src is not None:
-                sentence_length = max(self.tgt[i].size(0) - 1, self.src[i].size(0))
-                # print(sentence_length)
-            elif self.tgt is not None:
-                sentence_length = self.tgt[i].size(0) - 1
-            else:
-                sentence_length = self.src[i].size(0)
+        if seed is not None:
+            # sort by length (as in __init__) with random ties
+            rng = np.random.RandomState(seed)
+            positions = np.lexsort((rng.permutation(len(lengths)), src_sizes, tgt_sizes, lengths))
+        else:
+            positions = np.arange(len(lengths))
+
+        for i, sentence_length in zip(positions.tolist(), lengths[positions].tolist()):
 
             oversized = oversize_(cur_batch, sentence_length)
             # if the current item makes the batch exceed max size
@@ -386,12 +570,12 @@ class Dataset(torch.utils.data.Dataset):
                 cur_batch = cur_batch[scaled_size:]  # reset the current batch
                 cur_batch_sizes = cur_batch_sizes[scaled_size:]
                 cur_batch_size = sum(cur_batch_sizes)
+                cur_max = max(cur_batch_sizes) if len(cur_batch_sizes) > 0 else 0
 
             cur_batch.append(i)
             cur_batch_size += sentence_length
             cur_batch_sizes.append(sentence_length)
-
-            i = i + 1
+            cur_max = max(cur_max, sentence_length)
 
         # catch the last batch
         if len(cur_batch) > 0:
@@ -399,6 +583,22 @@ class Dataset(torch.utils.data.Dataset):
 
         self.num_batches = len(self.batches)
 
+    def packing_efficiency(self):
+        """
+        :return: the ratio of real tokens over the tokens in the padded batches (source and target)
+        """
+        real, padded = 0, 0
+        for data, offset in [(self.src, 0), (self.tgt, 1)]:
+            if data is None or (data is self.src and self._type != 'text'):
+                continue
+            sizes = self.get_sizes(data) - offset
+            for batch in self.batches:
+                batch_sizes = sizes[batch]
+                real += batch_sizes.sum()
+                padded += batch_sizes.max() * len(batch)
+
+        return real / max(padded, 1)
+
     def __len__(self):
         return self.num_batches
 
@@ -411,12 +611,12 @@ class Dataset(torch.utils.data.Dataset):
 
         batch_ids = self.batches[index]
         if self.src:
-            src_data = [self.src[i] for i in batch_ids]
+            src_data = self.get_items(self.src, batch_ids)
         else:
             src_data = None
 
         if self.tgt:
-            tgt_data = [self.tgt[i] for i in batch_ids]
+            tgt_data = self.get_items(self.tgt, batch_ids)
         else:
             tgt_data = None
 
@@ -430,9 +630,9 @@ class Dataset(torch.utils.data.Dataset):
                 tgt_lang_data = [self.tgt_langs[0]]  # should be a tensor [1]
         else:
             if self.src_langs is not None:
-                src_lang_data = [self.src_langs[i] for i in batch_ids]
+                src_lang_data = self.get_items(self.src_langs, batch_ids)
             if self.tgt_langs is not None:
-                tgt_lang_data = [self.tgt_langs[i] for i in batch_ids]
+                tgt_lang_data = self.get_items(self.tgt_langs, batch_ids)
 
         batch = Batch(src_data, tgt_data=tgt_data,
                       src_lang_data=src_lang_data, tgt_lang_data=tgt_lang_data,
@@ -449,14 +649,56 @@ class Dataset(torch.utils.data.Dataset):
     def create_order(self, random=True):
 
         if random:
+            if self.bucket_shuffle:
+                self.order_seed = torch.randint(0, 2 ** 31 - 1, (1,)).item()
+                self.allocate_batch(seed=self.order_seed)
+                print("* Packed %d batches (padding efficiency %.2f%%)" %
+                      (self.num_batches, 100 * self.packing_efficiency()))
             self.batchOrder = torch.randperm(self.num_batches)
         else:
             self.batchOrder = torch.arange(self.num_batches).long()
 
         self.cur_index = 0
+        self.prefetch_index = 0
 
         return self.batchOrder
 
+    def restore_order(self, batch_order, seed=None):
+        """
+        Restore the order of the batches (from a checkpoint)
+        :param batch_order: the order returned by create_order
+        :param seed: the seed of the bucketed shuffling for this order
+        """
+        if seed is not None:
+            self.order_seed = seed
+            self.allocate_batch(seed=seed)
+
+        self.batchOrder = batch_order
+
+    def prefetch(self, curriculum=False):
+        """
+        Start reading (asynchronously) the data of the next prefetch_batches batches following the batch order
+        """
+        if self.prefetch_batches <= 0 or len(self.prefetch_data) == 0:
+            return
+
+        self.prefetch_index = max(self.prefetch_index, self.cur_index)
+        end = min(self.cur_index + self.prefetch_batches, self.num_batches)
+
+        while self.prefetch_index < end:
+            if curriculum or self.batchOrder is None:
+                batch_index = self.prefetch_index
+            else:
+                batch_index = int(self.batchOrder[self.prefetch_index])
+
+            ids = self.batches[batch_index]
+            if self.data_order is not None:
+                ids = self.data_order[ids]
+            for data in self.prefetch_data:
+                data.prefetch(ids)
+
+            self.prefetch_index += 1
+
     # return the next batch according to the iterator
     def next(self, curriculum=False, reset=True, split_sizes=1):
 
@@ -464,6 +706,7 @@ class Dataset(torch.utils.data.Dataset):
         if self.cur_index >= self.num_batches:
             if reset:
                 self.cur_index = 0
+                self.prefetch_index = 0
             else:
                 return None
 
@@ -472,6 +715,7 @@ class Dataset(torch.utils.data.Dataset):
         else:
             batch_index = self.batchOrder[self.cur_index]
 
+        self.prefetch(curriculum=curriculum)
         batch = self[batch_index]
 
         # move the iterator one step
@@ -480,99 +724,212 @@ class Dataset(torch.utils.data.Dataset):
         return [batch]
 
     def shuffle(self):
-        data = list(zip(self.src, self.tgt))
-        self.src, self.tgt = zip(*[data[i] for i in torch.randperm(len(data))])
+        """
+        Shuffle the sentences: only the index (data_order) is permuted, the data (and languages) stay in place.
+        The batches are allocated again from the permuted lengths.
+        """
+        permutation = torch.randperm(self.fullSize).numpy()
+        self.data_order = permutation if self.data_order is None else self.data_order[permutation]
+        self.allocate_batch()
 
     def set_index(self, iteration):
 
         assert (0 <= iteration < self.num_batches)
         self.cur_index = iteration
+        self.prefetch_index = iteration
+
+# LANGUAGE MODEL DATASET AND DATAHOLDER
+class LMBatch(Batch):
+
+    def __init__(self, input, target=None, positions=None, documents=None):
+        """
+        :param input: T x B
+        :param target: T x B or None
+        :param positions: T x B positions of the tokens within their documents (None: 0 ... T-1)
+        :param documents: T x B document index of the tokens (None: the rows are continuous text)
+        """
+        self.tensors = defaultdict(lambda: None)
+
+        self.tensors['target_input'] = input  # T x B
+        self.tensors['target_output'] = target  # T x B or None
+        self.tensors['target_pos'] = positions
+        self.tensors['target_doc'] = documents
+        self.has_target = target is not None
+        if self.has_target:
+            self.tensors['tgt_mask'] = target.ne(onmt.constants.PAD)
+
+        # batch size
+        self.size = input.size(1)
+        self.length = input.size(0)
+
+        self.tgt_size = self.tensors['tgt_mask'].sum().item() if self.has_target else self.size * self.length
+        self.src_size = 0
+
+    def collate(self, **kwargs):
+        raise NotImplementedError
+
+
+class LanguageModelDataset(Dataset):
+    """
+    Packed language model data: the sentences (each one ending with </s>) are concatenated
+    and cut into blocks of seq_length tokens, so there is no padding except at the end of the data.
+    With doc_mask, a </s> starts a new document: the batches contain the document index and the position
+    of each token so that the attention does not cross the sentence boundaries
+    """
+
+    def __init__(self, data, batch_size_sents=128, seq_length=128, doc_mask=False):
+        """
+        :param data: a flat stream of tokens (LongTensor or numpy array)
+        or the memory indexed sentences (MMapIndexedDataset, the data is not loaded into memory)
+        :param batch_size_sents: (maximum) number of blocks per batch
+        :param seq_length: number of tokens per block
+        :param doc_mask: mask the attention between documents
+        """
+        if hasattr(data, 'tokens'):
+            # the sentences of the memory indexed data are stored contiguously
+            # add the </s> in front of the first sentence, as in the raw data
+            self.data = data.tokens
+            self.offset = 1
+        else:
+            self.data = data
+            self.offset = 0
 
-#
-# # LANGUAGE MODEL DATASET AND DATAHOLDER
-# class LMBatch(Batch):
-#
-#     def __init__(self, input, target=None):
-#         self.tensors = defaultdict(lambda: None)
-#
-#         self.tensors['target_input'] = input  # T x B
-#         self.tensors['target_output'] = target  # T x B or None
-#
-#         # batch size
-#         self.size = input.size(1)
-#         self.length = input.size(0)
-#
-#         self.tgt_size = self.size * self.length
-#         self.src_size = 0
-#
-#     def collate(self, **kwargs):
-#         raise NotImplementedError
-#
-#
-# class LanguageModelDataset(Dataset):
-#
-#     def __init__(self, data, batch_size_sents=128, seq_length=128):
-#
-#         self.data = data
-#
-#         self.batch_size_sents = batch_size_sents
-#
-#         self.seq_length = seq_length
-#
-#         # group samples into mini batches
-#         self.num_batches = 0
-#         self.allocate_batch()
-#
-#         self.fullSize = self.num_batches
-#         # self.cur_index = 0
-#         # self.batchOrder = None
-#
-#     def allocate_batch(self):
-#
-#         nsequence = self.data.size(0) // self.batch_size_sents
-#
-#         self.data = self.data.narrow(0, 0, nsequence * self.batch_size_sents)
-#
-#         # Evenly divide the data across the bsz batches.
-#         self.data = self.data.view(self.batch_size_sents, -1).t().contiguous()
-#
-#         # self.num_steps = nbatch - 1
-#
-#         self.num_batches = math.ceil((self.data.size(0) - 1) / self.seq_length)
-#
-#     # genereate a new batch - order (static)
-#     def create_order(self, random=False):
-#
-#         # For language model order shouldn't be random
-#         if random:
-#             self.batchOrder = torch.randperm(self.num_batches)
-#         else:
-#             self.batchOrder = torch.arange(self.num_batches).long()
-#
-#         self.cur_index = 0
-#
-#         return self.batchOrder
-#
-#     # return the next batch according to the iterator
-#     # for language model
-#     def next(self, curriculum=True, reset=True, split_sizes=1):
-#
-#         # reset iterator if reach data size limit
-#         if self.cur_index >= self.num_batches:
-#             if reset:
-#                 self.cur_index = 0
-#             else:
-#                 return None
-#
-#         batch_index = self.cur_index
-#
-#         seq_len = self.seq_length
-#
-#         top_index = min(batch_index + seq_len, self.data.size(0) - 1)
-#
-#         batch = LMBatch(self.data[batch_index:top_index], target=self.data[batch_index + 1:top_index + 1])
-#
-#         # move the iterator one step
-#         self.cur_index += seq_len
-#
-#         return [batch]
+        self.batch_size_sents = batch_size_sents
+        self.seq_length = seq_length
+        self.doc_mask = doc_mask
+
+        # group samples into mini batches
+        self.num_batches = 0
+        self.allocate_batch()
+
+        self.fullSize = self.num_blocks
+        self.cur_index = 0
+        self.batchOrder = None
+        self.order_seed = None
+
+    def size(self):
+
+        return self.fullSize
+
+    def num_tokens(self):
+        return len(self.data) + self.offset
+
+    def allocate_batch(self):
+
+        # each block predicts seq_length tokens, so the input needs all but the last token
+        self.num_blocks = math.ceil((self.num_tokens() - 1) / self.seq_length)
+        self.num_batches = math.ceil(self.num_blocks / self.batch_size_sents)
+        # all the batches have the same number of rows (the recurrent state is carried from batch to batch)
+        self.rows_per_batch = math.ceil(self.num_blocks / max(self.num_batches, 1))
+
+    def packing_efficiency(self):
+        """
+        :return: the ratio of real tokens over the tokens in the batches
+        """
+        return (self.num_tokens() - 1) / max(self.num_batches * self.rows_per_batch * self.seq_length, 1)
+
+    def get_tokens(self, start, end):
+        """
+        :return: the tokens [start, end) of the stream as a LongTensor
+        """
+        if self.offset > 0:
+            if start == 0:
+                return torch.cat([torch.LongTensor([onmt.constants.EOS]), self.get_tokens(1, end)])
+            start, end = start - self.offset, end - self.offset
+
+        tokens = self.data[start:end]
+        if isinstance(tokens, np.ndarray):
+            tokens = torch.from_numpy(tokens.astype(np.int64))
+
+        return tokens.long()
+
+    def __getitem__(self, index):
+        """
+        :param index: the index of the mini-batch
+        :return: LMBatch
+        """
+        assert index < self.num_batches, "%d > %d" % (index, self.num_batches)
+
+        # the row j of the batch i is the block j * num_batches + i,
+        # so that each row continues the same row of the previous batch
+        # (the rows after the last block are padding: their targets are ignored by the loss,
+        # the input starts with </s> so that the attention of every position has a key)
+        n_tokens = self.num_tokens()
+        rows = list()
+        for row in range(self.rows_per_batch):
+            block = row * self.num_batches + index
+            if block >= self.num_blocks:
+                padding = torch.LongTensor(self.seq_length + 1).fill_(onmt.constants.PAD)
+                padding[0] = onmt.constants.EOS
+                rows.append(padding)
+                continue
+
+            # the target of a block is shifted by one token
+            start = block * self.seq_length
+            tokens = self.get_tokens(start, min(start + self.seq_length + 1, n_tokens))
+            if tokens.size(0) < self.seq_length + 1:
+                tokens = torch.cat([tokens, tokens.new(self.seq_length + 1 - tokens.size(0)).fill_(onmt.constants.PAD)])
+            rows.append(tokens)
+
+        blocks = torch.stack(rows, dim=1)  # (T+1) x B
+        input = blocks[:-1]
+        target = blocks[1:]
+
+        positions, documents = None, None
+        if self.doc_mask:
+            # each </s> in the input starts a new document
+            documents = input.eq(onmt.constants.EOS).long().cumsum(0)
+            time = torch.arange(self.seq_length).unsqueeze(1).expand_as(input)
+            starts = torch.zeros_like(input)
+            starts[1:].masked_fill_(input[1:].eq(onmt.constants.EOS), 1)
+            starts = time * starts
+            # the position of each token is the distance to the last document start in the block
+            positions = time - starts.cummax(0)[0]
+
+        return LMBatch(input, target=target, positions=positions, documents=documents)
+
+    # return the next batch according to the iterator
+    def next(self, curriculum=False, reset=True, split_sizes=1):
+
+        # reset iterator if reach data size limit
+        if self.cur_index >= self.num_batches:
+            if reset:
+                self.cur_index = 0
+            else:
+                return None
+
+        if curriculum or self.batchOrder is None:
+            batch_index = self.cur_index
+        else:
+            batch_index = self.batchOrder[self.cur_index]
+
+        batch = self[batch_index]
+
+        # move the iterator one step
+        self.cur_index += 1
+
+        return [batch]
+
+    # genereate a new batch - order (static)
+    def create_order(self, random=True):
+
+        # the blocks are independent only when the documents are masked
+        if random and self.doc_mask:
+            self.batchOrder = torch.randperm(self.num_batches)
+        else:
+            self.batchOrder = torch.arange(self.num_batches).long()
+
+        self.cur_index = 0
+
+        return self.batchOrder
+
+    def restore_order(self, batch_order, seed=None):
+        self.batchOrder = batch_order
+
+    def shuffle(self):
+        pass
+
+    def set_index(self, iteration):
+
+        assert (0 <= iteration < self.num_batches)
+        self.cur_index = iteration
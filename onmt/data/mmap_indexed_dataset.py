@@ -1,10 +1,12 @@
+import mmap
 import os
+import shutil
 import struct
+import threading
 
 import numpy as np
 import torch
 import torch.utils.data
-from functools import lru_cache
 
 def read_longs(f, n):
     a = np.empty(n, dtype=np.int64)
@@ -24,10 +26,22 @@ dtypes = {
     5: np.int64,
     6: np.float,
     7: np.double,
-    8: np.uint16
+    8: np.uint16,
+    9: np.float32,
+    10: np.float16
 }
 
 
+def best_fitting_dtype(vocab_size=None):
+    """
+    The smallest type which can store the indices of a vocabulary with this size
+    """
+    if vocab_size is not None and vocab_size < 65500:
+        return np.uint16
+    else:
+        return np.int32
+
+
 def code(dtype):
     for k in dtypes.keys():
         if dtypes[k] == dtype:
@@ -46,25 +60,48 @@ def _warmup_mmap_file(path):
         while stream.read(100 * 1024 * 1024):
             pass
 
+
+# policies to bring the data file into the page cache when opening a dataset:
+# none: nothing (the pages are read on demand)
+# thread: read the whole file in a background thread
+# madvise: no warmup, the ranges of the upcoming batches are prefetched with madvise(WILLNEED) (see prefetch)
+# full: read the whole file before returning (blocking)
+WARMUP_POLICIES = ['none', 'thread', 'madvise', 'full']
+
+
+def _warmup_mmap_file_async(path):
+    thread = threading.Thread(target=_warmup_mmap_file, args=(path,), daemon=True)
+    thread.start()
+
+    return thread
+
 class MMapIndexedDataset(torch.utils.data.Dataset):
+    """
+    Sequences stored back to back in a flat data file (.bin) with an index of their sizes and offsets (.idx).
+    The sequences are either 1D (text) or 2D (e.g. audio features: frames x feature_size),
+    the sizes are the number of rows (tokens or frames).
+    """
     class Index(object):
         _HDR_MAGIC = b'MMIDIDX\x00\x00'
 
         @classmethod
-        def writer(cls, path, dtype):
+        def writer(cls, path, dtype, feature_size=1):
             class _Writer(object):
                 def __enter__(self):
                     self._file = open(path, 'wb')
 
+                    # version 1: 1D sequences, version 2: the feature size follows the type
                     self._file.write(cls._HDR_MAGIC)
-                    self._file.write(struct.pack('<Q', 1))
+                    self._file.write(struct.pack('<Q', 1 if feature_size == 1 else 2))
                     self._file.write(struct.pack('<B', code(dtype)))
+                    if feature_size != 1:
+                        self._file.write(struct.pack('<Q', feature_size))
 
                     return self
 
                 @staticmethod
                 def _get_pointers(sizes):
-                    dtype_size = dtype().itemsize
+                    dtype_size = dtype().itemsize * feature_size
                     address = 0
                     pointers = []
 
@@ -100,18 +137,17 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
                     'Index file doesn\'t match expected format. '
                     'Make sure that --dataset-impl is configured properly.'
                 )
-                version = struct.unpack('<Q', stream.read(8))
-                assert (1,) == version
+                version, = struct.unpack('<Q', stream.read(8))
+                assert version in [1, 2]
 
                 dtype_code, = struct.unpack('<B', stream.read(1))
                 self._dtype = dtypes[dtype_code]
                 self._dtype_size = self._dtype().itemsize
+                self._feature_size = struct.unpack('<Q', stream.read(8))[0] if version == 2 else 1
 
                 self._len = struct.unpack('<Q', stream.read(8))[0]
                 offset = stream.tell()
 
-            _warmup_mmap_file(path)
-
             self._bin_buffer_mmap = np.memmap(path, mode='r', order='C')
 
             self._bin_buffer = memoryview(self._bin_buffer_mmap)
@@ -120,71 +156,156 @@ class MMapIndexedDataset(torch.utils.data.Dataset):
                                            offset=offset + self._sizes.nbytes)
 
         def __del__(self):
-            self._bin_buffer_mmap._mmap.close()
+            # the file is unmapped when the last view on it (e.g. sizes) is released
             del self._bin_buffer_mmap
 
         @property
         def dtype(self):
             return self._dtype
 
+        @property
+        def feature_size(self):
+            return self._feature_size
+
         @property
         def sizes(self):
             return self._sizes
 
-        @lru_cache(maxsize=8)
+        @property
+        def pointers(self):
+            return self._pointers
+
         def __getitem__(self, i):
             return self._pointers[i], self._sizes[i]
 
         def __len__(self):
             return self._len
 
-    def __init__(self, path):
+    def __init__(self, path, warmup='none'):
+        """
+        :param path: prefix of the .bin and .idx files
+        :param warmup: policy to bring the data into the page cache (none|thread|madvise|full)
+        """
         super().__init__()
 
         self._path = None
         self._index = None
         self._bin_buffer = None
+        self._warmup = None
 
-        self._do_init(path)
+        self._do_init(path, warmup)
 
     def __getstate__(self):
-        return self._path
+        return self._path, self._warmup
 
     def __setstate__(self, state):
-        self._do_init(state)
+        self._do_init(*state)
+
+    def _do_init(self, path, warmup='none'):
+        if warmup not in WARMUP_POLICIES:
+            raise NotImplementedError("Unknown warmup policy %s" % warmup)
 
-    def _do_init(self, path):
         self._path = path
         self._index = self.Index(index_file_path(self._path))
 
-        _warmup_mmap_file(data_file_path(self._path))
+        if warmup == 'madvise' and not hasattr(mmap.mmap, 'madvise'):
+            print("[WARNING] madvise is not available on this platform, the data is read on demand.")
+            warmup = 'none'
+        self._warmup = warmup
+
+        if warmup == 'full':
+            _warmup_mmap_file(data_file_path(self._path))
+        elif warmup == 'thread':
+            _warmup_mmap_file_async(data_file_path(self._path))
+
         self._bin_buffer_mmap = np.memmap(data_file_path(self._path), mode='r', order='C')
         self._bin_buffer = memoryview(self._bin_buffer_mmap)
+        # the whole data file as one array (one row per token or frame), the sequences are slices of it
+        self._data = np.frombuffer(self._bin_buffer, dtype=self._index.dtype)
+        if self._index.feature_size != 1:
+            self._data = self._data.reshape(-1, self._index.feature_size)
 
     def __del__(self):
-        self._bin_buffer_mmap._mmap.close()
+        # the file is not closed explicitly: the items returned by __getitem__ and get_batch are views on it,
+        # it is unmapped when the last of them is released
+        del self._data
+        del self._bin_buffer
         del self._bin_buffer_mmap
         del self._index
 
     def __len__(self):
         return len(self._index)
 
-    @lru_cache(maxsize=8)
     def __getitem__(self, i):
         ptr, size = self._index[i]
-        np_array = np.frombuffer(self._bin_buffer, dtype=self._index.dtype, count=size, offset=ptr)
-        if self._index.dtype != np.int64:
-            np_array = np_array.astype(np.int64)
-
-        return torch.from_numpy(np_array)
+        # a read-only view on the memory mapped file (no copy)
+        # the conversion to tensors is done once per batch (see onmt.data.dataset.to_tensors)
+        feature_size = self._index.feature_size
+        data = np.frombuffer(self._bin_buffer, dtype=self._index.dtype, count=size * feature_size, offset=ptr)
+
+        return data if feature_size == 1 else data.reshape(size, feature_size)
+
+    def get_batch(self, indices):
+        """
+        Read many sequences at once (one vectorized lookup of the pointers and sizes)
+        :param indices: list or array of sequence indices
+        :return: list of read-only numpy views on the memory mapped file
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = self._index.pointers[indices] // (self._index.dtype().itemsize * self._index.feature_size)
+        ends = starts + self._index.sizes[indices]
+        data = self._data
+
+        return [data[start:end] for start, end in zip(starts.tolist(), ends.tolist())]
 
     @property
     def sizes(self):
         return self._index.sizes
 
+    @property
+    def dtype(self):
+        return self._index.dtype
+
+    @property
+    def feature_size(self):
+        return self._index.feature_size
+
+    @property
+    def tokens(self):
+        """
+        All the sequences concatenated (a read-only view on the data file, rows x feature_size for 2D data)
+        """
+        return self._data
+
     @property
     def supports_prefetch(self):
-        return False
+        return self._warmup == 'madvise'
+
+    def prefetch(self, indices):
+        """
+        Ask the kernel to read the pages of these sequences in the background (madvise WILLNEED).
+        Returns immediately. Only active with the madvise warmup policy.
+        :param indices: indices of the sequences (e.g. the ones of the next batches)
+        """
+        if not self.supports_prefetch or len(indices) == 0:
+            return
+
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = self._index.pointers[indices]
+        ends = starts + self._index.sizes[indices].astype(np.int64) * self._index.dtype().itemsize * \
+            self._index.feature_size
+
+        # madvise needs page aligned addresses; the sorted ranges are merged when they overlap
+        starts = starts - starts % mmap.PAGESIZE
+        order = np.argsort(starts, kind='stable')
+        starts, ends = starts[order], np.maximum.accumulate(ends[order])
+        first = np.ones(len(starts), dtype=bool)
+        first[1:] = starts[1:] > ends[:-1]
+        last = np.ones(len(starts), dtype=bool)
+        last[:-1] = first[1:]
+
+        for start, end in zip(starts[first].tolist(), ends[last].tolist()):
+            self._bin_buffer_mmap._mmap.madvise(mmap.MADV_WILLNEED, start, end - start)
 
     @staticmethod
     def exists(path):
@@ -198,6 +319,15 @@ class MMapIndexedDatasetBuilder(object):
         self._data_file = open(out_file, 'wb')
         self._dtype = dtype
         self._sizes = []
+        # the size of the rows of 2D items (set by the first item)
+        self._feature_size = None
+
+    def _check_feature_size(self, np_array):
+        feature_size = 1 if np_array.ndim == 1 else np_array.shape[1]
+        if self._feature_size is None:
+            self._feature_size = feature_size
+        assert self._feature_size == feature_size, \
+            "All the items must have the same feature size (%d != %d)" % (feature_size, self._feature_size)
 
     def add_item(self, tensor):
 
@@ -205,23 +335,78 @@ class MMapIndexedDatasetBuilder(object):
             np_array = np.array(tensor.numpy(), dtype=self._dtype)
         else:
             np_array = tensor.astype(self._dtype)
+        self._check_feature_size(np_array)
+        self._data_file.write(np_array.tobytes(order='C'))
+        self._sizes.append(np_array.shape[0])
+
+    def add_items(self, np_array, offsets):
+        """
+        Add many sequences stored in one flat array (sequence i is np_array[offsets[i]:offsets[i+1]])
+        """
+        np_array = np_array.astype(self._dtype, copy=False)
+        self._check_feature_size(np_array)
         self._data_file.write(np_array.tobytes(order='C'))
-        self._sizes.append(np_array.size)
+        self._sizes.extend(np.diff(offsets).tolist())
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def feature_size(self):
+        return self._feature_size or 1
 
     def merge_file_(self, another_file):
         # Concatenate index
         index = MMapIndexedDataset.Index(index_file_path(another_file))
         assert index.dtype == self._dtype
+        if len(index) > 0:
+            if self._feature_size is None:
+                self._feature_size = index.feature_size
+            assert index.feature_size == self._feature_size
 
-        for size in index.sizes:
-            self._sizes.append(size)
+        self._sizes.extend(index.sizes.tolist())
+        del index
 
         # Concatenate data
         with open(data_file_path(another_file), 'rb') as f:
             shutil.copyfileobj(f, self._data_file)
 
+    def merge_ranges_(self, ranges):
+        """
+        Concatenate ranges of sequences of other files, in the given order
+        :param ranges: list of (prefix, start, stop): the sequences start ... stop - 1 of the file prefix
+        """
+        indices, files = dict(), dict()
+        try:
+            for prefix, start, stop in ranges:
+                if prefix not in indices:
+                    index = MMapIndexedDataset.Index(index_file_path(prefix))
+                    assert index.dtype == self._dtype
+                    if len(index) > 0:
+                        if self._feature_size is None:
+                            self._feature_size = index.feature_size
+                        assert index.feature_size == self._feature_size
+                    indices[prefix] = (index.sizes.copy(), index.pointers.copy())
+                    del index
+                    files[prefix] = open(data_file_path(prefix), 'rb')
+
+                if stop <= start:
+                    continue
+
+                sizes, pointers = indices[prefix]
+                self._sizes.extend(sizes[start:stop].tolist())
+
+                row_bytes = np.dtype(self._dtype).itemsize * (self._feature_size or 1)
+                f = files[prefix]
+                f.seek(int(pointers[start]))
+                self._data_file.write(f.read(int(sizes[start:stop].sum()) * row_bytes))
+        finally:
+            for f in files.values():
+                f.close()
+
     def finalize(self, index_file):
         self._data_file.close()
 
-        with MMapIndexedDataset.Index.writer(index_file, self._dtype) as index:
+        with MMapIndexedDataset.Index.writer(index_file, self._dtype, feature_size=self.feature_size) as index:
             index.write(self._sizes)
\ No newline at end of file
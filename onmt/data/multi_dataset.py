@@ -0,0 +1,172 @@
+from __future__ import division
+
+import math
+import numpy as np
+import torch
+
+
+"""
+Mixing several datasets (corpora or language pairs) for training.
+Every batch comes from one dataset, which is sampled with the probabilities:
+    p_i ~ (n_i / n) ^ (1 / temperature)
+where n_i is the number of sentences in the dataset i.
+temperature = 1 samples proportionally to the data size, larger temperatures upsample the small datasets
+(and temperature -> inf samples uniformly).
+"""
+
+
+def split_language_pairs(src_langs, tgt_langs):
+    """
+    Group the sentences of a multilingual corpus by language pair
+    :param src_langs: memory indexed source languages (one id per sentence)
+    :param tgt_langs: memory indexed target languages
+    :return: list of ((src_lang_id, tgt_lang_id), indices of the sentences)
+    """
+    src_ids = np.asarray(src_langs.tokens, dtype=np.int64)
+    tgt_ids = np.asarray(tgt_langs.tokens, dtype=np.int64)
+    assert len(src_ids) == len(src_langs) and len(tgt_ids) == len(tgt_langs)
+
+    pairs, inverse = np.unique(src_ids * (tgt_ids.max() + 1) + tgt_ids, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.cumsum(np.bincount(inverse, minlength=len(pairs)))
+
+    groups = list()
+    for indices in np.split(order, bounds[:-1]):
+        pair = (int(src_ids[indices[0]]), int(tgt_ids[indices[0]]))
+        groups.append((pair, indices))
+
+    return groups
+
+
+class MultiDataset(object):
+    """
+    Sample the batches of several datasets with temperature based probabilities.
+    The datasets keep their own batches; one epoch has as many batches as all datasets together.
+    The order of an epoch is generated from a single seed, so it is restored from (order_seed, iteration).
+    """
+
+    def __init__(self, datasets, temperature=1.0, names=None):
+        """
+        :param datasets: list of onmt.Dataset
+        :param temperature: sampling temperature
+        :param names: names of the datasets (for printing)
+        """
+        self.datasets = datasets
+        self.temperature = temperature
+        self.names = names if names is not None else [str(i) for i in range(len(datasets))]
+
+        sizes = np.asarray([dataset.size() for dataset in datasets], dtype=np.float64)
+        probs = (sizes / sizes.sum()) ** (1.0 / temperature)
+        self.probs = probs / probs.sum()
+
+        self.fullSize = int(sizes.sum())
+        self.num_batches = sum(len(dataset) for dataset in datasets)
+
+        self.schedule = None
+        self.orders = None
+        self.positions = None
+        self.batchOrder = None
+        self.order_seed = None
+        self.cur_index = 0
+
+        for name, size, prob in zip(self.names, sizes, self.probs):
+            print(" * dataset %s: %d sentences, sampling probability %.4f (data ratio %.4f)" %
+                  (name, size, prob, size / sizes.sum()))
+
+    # the alignment (e.g. set by the trainer for relative models) applies to every dataset
+    @property
+    def src_align_right(self):
+        return self.datasets[0].src_align_right
+
+    @src_align_right.setter
+    def src_align_right(self, value):
+        for dataset in self.datasets:
+            dataset.src_align_right = value
+
+    @property
+    def tgt_align_right(self):
+        return self.datasets[0].tgt_align_right
+
+    @tgt_align_right.setter
+    def tgt_align_right(self, value):
+        for dataset in self.datasets:
+            dataset.tgt_align_right = value
+
+    def size(self):
+
+        return self.fullSize
+
+    def __len__(self):
+        return self.num_batches
+
+    def packing_efficiency(self):
+        efficiency = sum(dataset.packing_efficiency() * len(dataset) for dataset in self.datasets)
+        return efficiency / max(self.num_batches, 1)
+
+    def build_order(self, seed, random=True):
+        """
+        Generate the dataset of every step and the batches taken from each dataset
+        """
+        rng = np.random.RandomState(seed)
+        self.schedule = rng.choice(len(self.datasets), size=self.num_batches, p=self.probs)
+        counts = np.bincount(self.schedule, minlength=len(self.datasets))
+
+        # the datasets sampled more often than their size are repeated (with a new order for each pass)
+        self.orders = list()
+        for dataset, count in zip(self.datasets, counts.tolist()):
+            n_passes = max(math.ceil(count / len(dataset)), 1)
+            if random:
+                order = np.concatenate([rng.permutation(len(dataset)) for _ in range(n_passes)])
+            else:
+                order = np.tile(np.arange(len(dataset)), n_passes)
+            self.orders.append(order[:count])
+
+        # the position of every step in the order of its dataset
+        self.positions = np.zeros(self.num_batches, dtype=np.int64)
+        for i in range(len(self.datasets)):
+            steps = self.schedule == i
+            self.positions[steps] = np.arange(steps.sum())
+
+        self.batchOrder = torch.from_numpy(self.schedule)
+
+    # genereate a new batch - order (static)
+    def create_order(self, random=True):
+
+        self.order_seed = torch.randint(0, 2 ** 31 - 1, (1,)).item() if random else 0
+        self.build_order(self.order_seed, random=random)
+        self.cur_index = 0
+
+        return self.batchOrder
+
+    def restore_order(self, batch_order, seed=None):
+        assert seed is not None, "The order of the datasets can only be restored from its seed"
+        self.order_seed = seed
+        self.build_order(seed)
+        assert torch.equal(self.batchOrder, batch_order.long())
+
+    def set_index(self, iteration):
+
+        assert (0 <= iteration < self.num_batches)
+        self.cur_index = iteration
+
+    # return the next batch according to the iterator
+    def next(self, curriculum=False, reset=True, split_sizes=1):
+
+        if self.schedule is None:
+            self.create_order()
+
+        # reset iterator if reach data size limit
+        if self.cur_index >= self.num_batches:
+            if reset:
+                self.cur_index = 0
+            else:
+                return None
+
+        dataset_id = self.schedule[self.cur_index]
+        batch_index = self.orders[dataset_id][self.positions[self.cur_index]]
+        batch = self.datasets[dataset_id][int(batch_index)]
+
+        # move the iterator one step
+        self.cur_index += 1
+
+        return [batch]
@@ -0,0 +1,386 @@
+from __future__ import division
+
+import os
+import queue
+import time
+import traceback
+from collections import defaultdict
+
+import numpy as np
+import torch.multiprocessing as mp
+
+import onmt
+from onmt.data.mmap_indexed_dataset import MMapIndexedDatasetBuilder, data_file_path, index_file_path
+
+"""
+Streaming preprocessing pipeline for text data (MT and LM)
+
+The data goes through the stages:
+    read -> tokenize -> length filter -> lookup -> write
+Every stage is a generator over chunks of lines. The reader runs in the main process and puts the numbered
+chunks into a bounded queue shared by the workers. Each worker runs the remaining stages
+and writes its own memory indexed shards, so only the raw lines and the final sizes cross the process boundaries.
+At the end, the ranges of the chunks are copied from the shards into the final files in the order of the chunks,
+so the sentences keep the order of the input files.
+"""
+
+
+class Side(object):
+    """
+    Settings for one side of the data (source or target)
+    """
+
+    def __init__(self, name, vocab, bos_word=None, eos_word=None, max_length=-1, trunc=0, dtype=None):
+        self.name = name
+        self.vocab = vocab
+        self.bos_word = bos_word
+        self.eos_word = eos_word
+        self.max_length = max_length
+        self.trunc = trunc
+        # numpy type to store the indices (None: the type given to binarize_parallel)
+        self.dtype = dtype
+
+
+class StageStats(object):
+    """
+    Accumulate the processing time, the number of lines and tokens for each stage
+    """
+
+    def __init__(self):
+        self.time = defaultdict(float)
+        self.lines = defaultdict(int)
+        self.tokens = defaultdict(int)
+        self.order = []
+
+    def add(self, stage, elapsed, n_lines, n_tokens=0):
+        if stage not in self.order:
+            self.order.append(stage)
+        self.time[stage] += elapsed
+        self.lines[stage] += n_lines
+        self.tokens[stage] += n_tokens
+
+    def update(self, other):
+        for stage in other.order:
+            self.add(stage, other.time[stage], other.lines[stage], other.tokens[stage])
+
+    def report(self, n_workers=1):
+        """
+        :param n_workers: the worker stages run in parallel, so their throughput is multiplied
+        """
+        for stage in self.order:
+            parallel = 1 if stage in ['read', 'merge'] else n_workers
+            elapsed = max(self.time[stage], 1e-6)
+            print("[INFO] Stage %-9s %8.2f s busy; %10.0f lines/s; %12.0f tokens/s" %
+                  (stage, self.time[stage],
+                   self.lines[stage] * parallel / elapsed,
+                   self.tokens[stage] * parallel / elapsed))
+
+
+def read_stage(file_groups, chunk_size, stats):
+    """
+    :param file_groups: list of (files, src_lang_id, tgt_lang_id). files contains one file per side,
+    and the files of a group must have the same number of lines
+    :return: generator of chunks (dict) containing their number and the lines of every side
+    """
+    chunk_id = 0
+    for files, src_lang, tgt_lang in file_groups:
+        readers = [open(f, 'r', encoding='utf-8') for f in files]
+
+        eof = False
+        while not eof:
+            start = time.time()
+            lines = [list() for _ in readers]
+            for _ in range(chunk_size):
+                current = [reader.readline() for reader in readers]
+
+                # normal end of file
+                if all(line == "" for line in current):
+                    eof = True
+                    break
+
+                # files do not have the same number of lines
+                if any(line == "" for line in current):
+                    print('WARNING: %s do not have the same # of sentences' % " and ".join(files))
+                    eof = True
+                    break
+
+                for i, line in enumerate(current):
+                    lines[i].append(line)
+
+            if len(lines[0]) > 0:
+                stats.add('read', time.time() - start, len(lines[0]))
+                yield {'id': chunk_id, 'lines': lines, 'src_lang': src_lang, 'tgt_lang': tgt_lang}
+                chunk_id += 1
+
+        for reader in readers:
+            reader.close()
+
+
+def tokenize_stage(chunks, tokenizer, stats):
+    for chunk in chunks:
+        start = time.time()
+        chunk['tokens'] = [[tokenizer.tokenize(line) for line in lines] for lines in chunk.pop('lines')]
+        n_tokens = sum(len(tokens) for side in chunk['tokens'] for tokens in side)
+        stats.add('tokenize', time.time() - start, len(chunk['tokens'][0]), n_tokens)
+        yield chunk
+
+
+def filter_stage(chunks, sides, stats):
+    """
+    Remove the empty lines and the sentences which are too long, then truncate the remaining sentences
+    """
+    for chunk in chunks:
+        start = time.time()
+        tokens = chunk['tokens']
+        n_lines = len(tokens[0])
+        keep = list()
+        empty, ignored = 0, 0
+
+        for j in range(n_lines):
+            sentences = [side_tokens[j] for side_tokens in tokens]
+            if any(len(sent) == 0 for sent in sentences):
+                empty += 1
+            elif any(side.max_length > 0 and len(sent) > side.max_length for side, sent in zip(sides, sentences)):
+                ignored += 1
+            else:
+                keep.append(j)
+
+        filtered = list()
+        for side, side_tokens in zip(sides, tokens):
+            if side.trunc > 0:
+                filtered.append([side_tokens[j][:side.trunc] for j in keep])
+            else:
+                filtered.append([side_tokens[j] for j in keep])
+
+        chunk['tokens'] = filtered
+        chunk['empty'] = empty
+        chunk['ignored'] = ignored
+        stats.add('filter', time.time() - start, n_lines)
+        yield chunk
+
+
+def lookup_stage(chunks, sides, stats):
+    unk_word = onmt.constants.UNK_WORD
+    for chunk in chunks:
+        start = time.time()
+        chunk['data'] = [side.vocab.convertToIdxBatch(side_tokens, unk_word,
+                                                      bos_word=side.bos_word, eos_word=side.eos_word)
+                         for side, side_tokens in zip(sides, chunk.pop('tokens'))]
+        n_tokens = sum(data.shape[0] for data, _ in chunk['data'])
+        stats.add('lookup', time.time() - start, len(chunk['data'][0][1]) - 1, n_tokens)
+        yield chunk
+
+
+def write_stage(chunks, sides, builders, lang_builders, stats):
+    """
+    Consume the chunks and write them into the builders
+    :return: number of written sentences, empty lines and ignored sentences,
+    and the list of the written chunks (number of the chunk, number of sentences)
+    """
+    n_written, n_empty, n_ignored = 0, 0, 0
+    written_chunks = []
+
+    for chunk in chunks:
+        start = time.time()
+        n_sents = len(chunk['data'][0][1]) - 1
+        n_tokens = 0
+        for side, (data, offsets) in zip(sides, chunk['data']):
+            builders[side.name].add_items(data, offsets)
+            n_tokens += data.shape[0]
+
+        # language data is only written (per sentence) in the multilingual case
+        if lang_builders is not None:
+            for key in ['src_lang', 'tgt_lang']:
+                lang = np.full(n_sents, chunk[key], dtype=lang_builders[key].dtype)
+                lang_builders[key].add_items(lang, np.arange(n_sents + 1))
+
+        n_written += n_sents
+        written_chunks.append((chunk['id'], n_sents))
+        n_empty += chunk['empty']
+        n_ignored += chunk['ignored']
+        stats.add('write', time.time() - start, n_sents, n_tokens)
+
+    return n_written, n_empty, n_ignored, written_chunks
+
+
+def shard_prefix(output_prefix, name, worker_id):
+    return output_prefix + ".%s.shard%d" % (name, worker_id)
+
+
+def _queue_reader(queue):
+    while True:
+        chunk = queue.get()
+        if chunk is None:
+            break
+        yield chunk
+
+
+def _run_worker(worker_id, chunks, sides, tokenizer, output_prefix, dtype, multilingual):
+    """
+    Run the stages tokenize -> filter -> lookup -> write on the chunks and write into the worker shards
+    """
+    stats = StageStats()
+
+    builders = {side.name: MMapIndexedDatasetBuilder(data_file_path(shard_prefix(output_prefix, side.name, worker_id)),
+                                                     dtype=side.dtype or dtype)
+                for side in sides}
+    lang_builders = None
+    if multilingual:
+        lang_builders = {key: MMapIndexedDatasetBuilder(data_file_path(shard_prefix(output_prefix, key, worker_id)),
+                                                        dtype=dtype)
+                         for key in ['src_lang', 'tgt_lang']}
+
+    stream = tokenize_stage(chunks, tokenizer, stats)
+    stream = filter_stage(stream, sides, stats)
+    stream = lookup_stage(stream, sides, stats)
+    n_written, n_empty, n_ignored, written_chunks = write_stage(stream, sides, builders, lang_builders, stats)
+
+    all_builders = dict(builders)
+    if lang_builders is not None:
+        all_builders.update(lang_builders)
+    for name, builder in all_builders.items():
+        builder.finalize(index_file_path(shard_prefix(output_prefix, name, worker_id)))
+
+    return {'id': worker_id, 'written': n_written, 'empty': n_empty, 'ignored': n_ignored, 'stats': stats,
+            'chunks': written_chunks}
+
+
+def _worker_process(worker_id, chunk_queue, result_queue, sides, tokenizer, output_prefix, dtype, multilingual):
+    try:
+        result = _run_worker(worker_id, _queue_reader(chunk_queue), sides, tokenizer, output_prefix, dtype,
+                             multilingual)
+    except Exception:
+        # the exception is raised again in the main process
+        result = {'id': worker_id, 'error': traceback.format_exc()}
+    result_queue.put(result)
+
+
+def _poll_workers(workers, result_queue, results, timeout):
+    """
+    Wait at most timeout seconds for a result of the workers
+    Raise an error if a worker failed (an exception or a process which died)
+    """
+    try:
+        result = result_queue.get(timeout=timeout)
+    except queue.Empty:
+        result = None
+
+    if result is not None:
+        if 'error' in result:
+            raise RuntimeError("Binarization worker %d failed:\n%s" % (result['id'], result['error']))
+        results[result['id']] = result
+
+    for worker_id, worker in enumerate(workers):
+        if worker.exitcode is not None and worker.exitcode != 0:
+            raise RuntimeError("Binarization worker %d died (exit code %d)" % (worker_id, worker.exitcode))
+
+
+def _put_chunk(chunk_queue, chunk, workers, result_queue, results, timeout=1.0):
+    """
+    Put a chunk into the bounded queue of the workers (waits while it is full and the workers are alive)
+    """
+    while True:
+        try:
+            chunk_queue.put(chunk, timeout=timeout)
+            return
+        except queue.Full:
+            _poll_workers(workers, result_queue, results, timeout=0.01)
+
+
+def binarize_parallel(file_groups, sides, tokenizer, output_prefix, dtype=np.int64,
+                      num_workers=1, chunk_size=10000, queue_size=4, write_langs=True, verbose=False):
+    """
+    Binarize (parallel) text files into memory indexed files output_prefix.<side>.bin/idx
+    :param file_groups: list of (files, src_lang_id, tgt_lang_id), one file per side in each group
+    :param sides: list of Side (same order as the files)
+    :param tokenizer: onmt.Tokenizer
+    :param output_prefix: prefix of the output files
+    :param dtype: numpy type to store the indices (for the sides without their own type and the languages)
+    :param num_workers: number of worker processes
+    :param chunk_size: number of lines per chunk
+    :param queue_size: maximum number of chunks waiting for each worker
+    (the workers take the chunks from one queue of num_workers * queue_size chunks)
+    :param write_langs: write the language of each sentence if there are several file groups
+    :param verbose: report the stage throughput
+    :return: dictionary with the number of written sentences, empty lines and ignored sentences
+    """
+    start = time.time()
+    stats = StageStats()
+    multilingual = write_langs and len(file_groups) > 1
+    chunks = read_stage(file_groups, chunk_size, stats)
+
+    if num_workers > 1:
+        result_queue = mp.Queue()
+        chunk_queue = mp.Queue(maxsize=num_workers * queue_size)
+        workers = [mp.Process(target=_worker_process,
+                              args=(worker_id, chunk_queue, result_queue, sides, tokenizer,
+                                    output_prefix, dtype, multilingual))
+                   for worker_id in range(num_workers)]
+        for worker in workers:
+            worker.start()
+
+        results = dict()
+        try:
+            # the reader waits when the queue is full, which bounds the memory
+            for chunk in chunks:
+                _put_chunk(chunk_queue, chunk, workers, result_queue, results)
+
+            for _ in workers:
+                _put_chunk(chunk_queue, None, workers, result_queue, results)
+
+            while len(results) < num_workers:
+                _poll_workers(workers, result_queue, results, timeout=1.0)
+        except BaseException:
+            for worker in workers:
+                worker.terminate()
+            raise
+
+        for worker in workers:
+            worker.join()
+
+        results = [results[worker_id] for worker_id in range(num_workers)]
+    else:
+        results = [_run_worker(0, chunks, sides, tokenizer, output_prefix, dtype, multilingual)]
+
+    summary = defaultdict(int)
+    for result in results:
+        for key in ['written', 'empty', 'ignored']:
+            summary[key] += result[key]
+        stats.update(result['stats'])
+
+    # the range of sentences of every chunk in the shard of its worker
+    chunk_ranges = []
+    for result in results:
+        offset = 0
+        for chunk_id, n_sents in result['chunks']:
+            chunk_ranges.append((chunk_id, result['id'], offset, offset + n_sents))
+            offset += n_sents
+    chunk_ranges.sort()
+
+    # merge the shards in the order of the chunks
+    names = [(side.name, side.dtype or dtype) for side in sides]
+    if multilingual:
+        names += [('src_lang', dtype), ('tgt_lang', dtype)]
+
+    merge_start = time.time()
+    for name, name_dtype in names:
+        builder = MMapIndexedDatasetBuilder(data_file_path(output_prefix + ".%s" % name), dtype=name_dtype)
+        builder.merge_ranges_([(shard_prefix(output_prefix, name, worker_id), first, last)
+                               for _, worker_id, first, last in chunk_ranges])
+        builder.finalize(index_file_path(output_prefix + ".%s" % name))
+
+        for worker_id in range(num_workers):
+            prefix = shard_prefix(output_prefix, name, worker_id)
+            os.remove(data_file_path(prefix))
+            os.remove(index_file_path(prefix))
+    stats.add('merge', time.time() - merge_start, summary['written'])
+
+    if verbose:
+        stats.report(n_workers=num_workers)
+
+    elapse = time.time() - start
+    print("[INFO] Wrote %d sentences to %s.* (%d empty lines, %d ignored due to length) "
+          "in %.1f s (%.0f sentences/s)" % (summary['written'], output_prefix, summary['empty'], summary['ignored'],
+                                             elapse, summary['written'] / max(elapse, 1e-6)))
+
+    return summary
@@ -1,12 +1,14 @@
 from __future__ import division
 
 import math
+import numpy as np
 import torch
 import torch.utils.data
 from collections import defaultdict
 import onmt
 from onmt.speech.Augmenter import Augmenter
 from onmt.modules.dropout import switchout
+from onmt.data.dataset import to_tensors
 
 """
 Data management for stream-to-stream models
@@ -43,6 +45,7 @@ class Stream(object):
         self.length_mutliplier = length_multiplier
 
         if src_data is not None:
+            src_data = to_tensors(src_data, dtype=np.int64 if self.src_type == 'text' else np.float32)
             self.tensors['source'], self.tensors['source_pos'], self.src_lengths = \
                 self.collate(src_data,
                              type=self.src_type,
@@ -54,6 +57,7 @@ class Stream(object):
             self.src_size = 0
 
         if tgt_data is not None:
+            tgt_data = to_tensors(tgt_data)
             target_full, target_pos, self.tgt_lengths = self.collate(tgt_data)
             # self.tensors['target'] = target_full
             # self.tensors['target_input'] = target_full[:-1]
@@ -73,9 +77,9 @@ class Stream(object):
         self.size = len(src_data) if src_data is not None else len(tgt_data)
 
         if src_lang_data is not None:
-            self.tensors['source_lang'] = torch.cat(src_lang_data).long()
+            self.tensors['source_lang'] = torch.cat(to_tensors(src_lang_data)).long()
         if tgt_lang_data is not None:
-            self.tensors['target_lang'] = torch.cat(tgt_lang_data).long()
+            self.tensors['target_lang'] = torch.cat(to_tensors(tgt_lang_data)).long()
 
     def switchout(self, swrate, src_vocab_size, tgt_vocab_size):
         # Switch out function ... currently works with only source text data
@@ -289,6 +293,8 @@ class StreamDataset(torch.utils.data.Dataset):
             self.tgt = None
 
         # in stream dataset we don't sort data
+        # data_order maps the sentences to their indices in the data after shuffle() (None: same order)
+        self.data_order = None
 
         self.src_langs = src_langs
         self.tgt_langs = tgt_langs
@@ -337,9 +343,30 @@ class StreamDataset(torch.utils.data.Dataset):
 
         pass
 
+    def get_sizes(self, data):
+        if hasattr(data, 'sizes'):
+            sizes = np.asarray(data.sizes)
+        else:
+            sizes = np.asarray([len(sample) for sample in data])
+
+        if self.data_order is not None:
+            sizes = sizes[self.data_order]
+        return sizes.tolist()
+
+    def get_items(self, data, ids):
+        if self.data_order is not None:
+            ids = self.data_order[ids]
+
+        # memory indexed data reads the whole batch at once
+        if hasattr(data, 'get_batch'):
+            return data.get_batch(ids)
+
+        return [data[i] for i in ids]
+
     # This function allocates the mini-batches (grouping sentences with the same size)
     def allocate_batch(self):
 
+        self.batches = []
         cur_batch = []
         cur_batch_size = 0
         cur_batch_sizes = []
@@ -357,16 +384,19 @@ class StreamDataset(torch.utils.data.Dataset):
 
             return False
 
+        src_sizes = self.get_sizes(self.src) if self.src is not None else None
+        tgt_sizes = self.get_sizes(self.tgt) if self.tgt is not None else None
+
         i = 0
         while i < self.fullSize:
 
             if self.tgt is not None and self.src is not None:
-                sentence_length = max(self.tgt[i].size(0) - 1, self.src[i].size(0))
+                sentence_length = max(tgt_sizes[i] - 1, src_sizes[i])
                 # print(sentence_length)
             elif self.tgt is not None:
-                sentence_length = self.tgt[i].size(0) - 1
+                sentence_length = tgt_sizes[i] - 1
             else:
-                sentence_length = self.src[i].size(0)
+                sentence_length = src_sizes[i]
 
             oversized = oversize_(cur_batch, sentence_length)
             # if the current item makes the batch exceed max size
@@ -409,12 +439,12 @@ class StreamDataset(torch.utils.data.Dataset):
 
         batch_ids = self.batches[index]
         if self.src:
-            src_data = [self.src[i] for i in batch_ids]
+            src_data = self.get_items(self.src, batch_ids)
         else:
             src_data = None
 
         if self.tgt:
-            tgt_data = [self.tgt[i] for i in batch_ids]
+            tgt_data = self.get_items(self.tgt, batch_ids)
         else:
             tgt_data = None
 
@@ -428,9 +458,9 @@ class StreamDataset(torch.utils.data.Dataset):
                 tgt_lang_data = [self.tgt_langs[0]]  # should be a tensor [1]
         else:
             if self.src_langs is not None:
-                src_lang_data = [self.src_langs[i] for i in batch_ids]
+                src_lang_data = self.get_items(self.src_langs, batch_ids)
             if self.tgt_langs is not None:
-                tgt_lang_data = [self.tgt_langs[i] for i in batch_ids]
+                tgt_lang_data = self.get_items(self.tgt_langs, batch_ids)
 
         batch = Stream(src_data, tgt_data=tgt_data,
                        src_lang_data=src_lang_data, tgt_lang_data=tgt_lang_data,
@@ -452,6 +482,9 @@ class StreamDataset(torch.utils.data.Dataset):
 
         return self.batchOrder
 
+    def restore_order(self, batch_order, seed=None):
+        self.batchOrder = batch_order
+
     # return the next batch according to the iterator
     def next(self, curriculum=False, reset=True, split_sizes=1):
 
@@ -475,8 +508,10 @@ class StreamDataset(torch.utils.data.Dataset):
         return [batch]
 
     def shuffle(self):
-        data = list(zip(self.src, self.tgt))
-        self.src, self.tgt = zip(*[data[i] for i in torch.randperm(len(data))])
+        # permute the index only and group the sentences into batches again
+        permutation = torch.randperm(self.fullSize).numpy()
+        self.data_order = permutation if self.data_order is None else self.data_order[permutation]
+        self.allocate_batch()
 
     def set_index(self, iteration):
 
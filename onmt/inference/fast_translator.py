@@ -3,11 +3,13 @@ import onmt.modules
 import torch.nn as nn
 import torch
 import math
+import contextlib
 from torch.autograd import Variable
 from onmt.model_factory import build_model
 import torch.nn.functional as F
 from onmt.inference.search import BeamSearch, DiverseBeamSearch
 from onmt.inference.translator import Translator
+from onmt.modules.adaptive_softmax import AdaptiveGenerator
 
 model_list = ['transformer', 'stochastic_transformer']
 
@@ -44,6 +46,14 @@ class FastTranslator(Translator):
         else:
             self.dynamic_max_len_scale = 1.2
 
+        # the adaptive softmax skips the clusters which cannot contain a candidate of the beam search:
+        # the search takes 2 x beam_size candidates and pad / eos can be removed from them
+        # (not with ensembles or banned n-grams, which change the candidates of a hypothesis)
+        if self.n_models == 1 and self.no_repeat_ngram_size == 0:
+            self.cluster_topk = 2 * opt.beam_size + 2
+        else:
+            self.cluster_topk = 0
+
         if opt.verbose:
             print('* Current bos id: %d' % self.bos_id, onmt.constants.BOS)
             print('* Using fast beam search implementation')
@@ -452,7 +462,14 @@ class FastTranslator(Translator):
         attns = dict()
 
         for i in range(self.n_models):
-            decoder_output = self.models[i].step(tokens, decoder_states[i])
+            generator = self.models[i].generator[0]
+            if isinstance(generator, AdaptiveGenerator):
+                pruning = generator.pruning(self.cluster_topk)
+            else:
+                pruning = contextlib.nullcontext()
+
+            with pruning:
+                decoder_output = self.models[i].step(tokens, decoder_states[i])
 
             # take the last decoder state
             # decoder_hidden = decoder_hidden.squeeze(1)
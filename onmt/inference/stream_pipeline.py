@@ -0,0 +1,112 @@
+from __future__ import division
+
+import queue
+import threading
+import time
+
+"""
+Asynchronous pipeline to translate a stream (e.g. stdin)
+
+The lines go through the stages:
+    read + tokenize (thread) -> batch + decode (main thread) -> detokenize + write (thread)
+The stages are connected by bounded queues, so reading and writing overlap with the decoding
+and the memory stays bounded when a large file is piped in.
+A batch is decoded when it has batch_size lines or when its first line has waited max_latency seconds,
+so piped files get full batches and interactive input is answered after at most max_latency seconds.
+The batches are decoded and written in the order of the input.
+"""
+
+_END = None
+
+
+def _read_stage(lines, tokenize, out_queue, errors):
+    try:
+        for line in lines:
+            out_queue.put(tokenize(line))
+    except Exception as e:
+        errors.append(e)
+    finally:
+        out_queue.put(_END)
+
+
+def _write_stage(in_queue, write, errors):
+    while True:
+        item = in_queue.get()
+        if item is _END:
+            break
+        # after an error the remaining batches are consumed (so the decoder never blocks) but not written
+        if len(errors) > 0:
+            continue
+        try:
+            write(*item)
+        except Exception as e:
+            errors.append(e)
+
+
+def batches(in_queue, batch_size, max_latency):
+    """
+    Group the items of the queue into lists of at most batch_size items
+    :param max_latency: maximum time (seconds) between the arrival of the first item of a batch and its release
+    (<= 0: only full batches and the last one)
+    """
+    batch = list()
+    deadline = None
+
+    while True:
+        if len(batch) == 0:
+            item = in_queue.get()
+            deadline = time.time() + max_latency
+        else:
+            try:
+                if max_latency > 0:
+                    item = in_queue.get(timeout=max(deadline - time.time(), 0))
+                else:
+                    item = in_queue.get()
+            except queue.Empty:
+                yield batch
+                batch = list()
+                continue
+
+        if item is _END:
+            break
+
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = list()
+
+    if len(batch) > 0:
+        yield batch
+
+
+def translate_stream(lines, tokenize, translate, write, batch_size=30, max_latency=0.1, queue_size=4):
+    """
+    Translate the lines with a reader thread, the decoder in the calling thread and a writer thread
+    :param lines: iterable over the input lines (e.g. sys.stdin)
+    :param tokenize: function line -> item (runs in the reader thread)
+    :param translate: function list of items -> result (runs in the calling thread)
+    :param write: function (list of items, result) -> None (runs in the writer thread)
+    :param queue_size: capacity of the queues (in batches)
+    """
+    read_queue = queue.Queue(maxsize=queue_size * batch_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+    read_errors, write_errors = list(), list()
+
+    # daemon threads: an error in the decoder does not wait for the end of the input
+    reader = threading.Thread(target=_read_stage, args=(lines, tokenize, read_queue, read_errors), daemon=True)
+    writer = threading.Thread(target=_write_stage, args=(write_queue, write, write_errors), daemon=True)
+    reader.start()
+    writer.start()
+
+    for batch in batches(read_queue, batch_size, max_latency):
+        if len(write_errors) > 0:
+            break
+        write_queue.put((batch, translate(batch)))
+
+    write_queue.put(_END)
+    writer.join()
+
+    # the errors of the threads are raised in the calling thread
+    for errors in [read_errors, write_errors]:
+        if len(errors) > 0:
+            raise errors[0]
@@ -224,14 +224,12 @@ class Translator(object):
 
         if type == 'mt':
             if self.start_with_bos:
-                src_data = [self.src_dict.convertToIdx(b,
-                                                       onmt.constants.UNK_WORD,
-                                                       onmt.constants.BOS_WORD)
-                            for b in src_sents]
+                src_data = self.src_dict.convertToIdxTensors(src_sents,
+                                                             onmt.constants.UNK_WORD,
+                                                             onmt.constants.BOS_WORD)
             else:
-                src_data = [self.src_dict.convertToIdx(b,
-                                                       onmt.constants.UNK_WORD)
-                            for b in src_sents]
+                src_data = self.src_dict.convertToIdxTensors(src_sents,
+                                                             onmt.constants.UNK_WORD)
         elif type == 'asr':
             # no need to deal with this
             src_data = src_sents
@@ -243,10 +241,10 @@ class Translator(object):
             tgt_bos_word = None
         tgt_data = None
         if tgt_sents:
-            tgt_data = [self.tgt_dict.convertToIdx(b,
-                                                   onmt.constants.UNK_WORD,
-                                                   tgt_bos_word,
-                                                   onmt.constants.EOS_WORD) for b in tgt_sents]
+            tgt_data = self.tgt_dict.convertToIdxTensors(tgt_sents,
+                                                         onmt.constants.UNK_WORD,
+                                                         tgt_bos_word,
+                                                         onmt.constants.EOS_WORD)
 
         src_lang_data = [torch.Tensor([self.lang_dict[self.src_lang]])]
         tgt_lang_data = [torch.Tensor([self.lang_dict[self.tgt_lang]])]
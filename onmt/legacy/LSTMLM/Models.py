@@ -41,7 +41,7 @@ class LSTMLMDecoder(nn.Module):
         self.time = opt.time
         self.encoder_type = opt.encoder_type
 
-        self.preprocess_layer = PrePostProcessing(self.model_size, self.emb_dropout, sequence='d', static=False)
+        self.preprocess_layer = PrePostProcessing(self.model_size, self.emb_dropout, sequence='d')
 
         self.word_lut = nn.Embedding(dicts.size(),
                                      self.model_size,
@@ -50,7 +50,7 @@ class LSTMLMDecoder(nn.Module):
 
         self.rnn = nn.LSTM(self.model_size, self.model_size, num_layers=3, dropout=self.dropout)
 
-        self.postprocess_layer = PrePostProcessing(self.model_size, self.emb_dropout, sequence='d', static=False)
+        self.postprocess_layer = PrePostProcessing(self.model_size, self.emb_dropout, sequence='d')
 
         self.h = None
         self.c = None
@@ -162,7 +162,7 @@ class LSTMLM(NMTModel):
         super().__init__( encoder, decoder, generator)
         self.model_size = self.decoder.model_size
 
-    def forward(self, batch):
+    def forward(self, batch, **kwargs):
         """
         Inputs Shapes:
             src: len_src x batch_size
@@ -181,6 +181,8 @@ class LSTMLM(NMTModel):
 
         output_dict = defaultdict(lambda: None)
         output_dict['hidden'] = decoder_output['hidden']
+        output_dict['target_mask'] = kwargs.get('target_mask', None)
+        output_dict['logprobs'] = self.generator[0](output_dict)
 
         return output_dict
 
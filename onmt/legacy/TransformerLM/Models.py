@@ -8,8 +8,7 @@ from onmt.modules.dropout import embedded_dropout
 #~ from onmt.modules.Checkpoint import checkpoint
 from torch.utils.checkpoint import checkpoint
 from collections import defaultdict
-from onmt.models.transformer_layers import PositionalEncoding, PrePostProcessing
-from onmt.legacy.TransformerLM.Layers import LMDecoderLayer
+from onmt.models.transformer_layers import PositionalEncoding, PrePostProcessing, DecoderLayer
 
 
 def custom_layer(module):
@@ -48,7 +47,7 @@ class TransformerLMDecoder(nn.Module):
         else:
             raise NotImplementedError
 
-        self.preprocess_layer = PrePostProcessing(self.model_size, self.emb_dropout, sequence='d', static=False)
+        self.preprocess_layer = PrePostProcessing(self.model_size, self.emb_dropout, sequence='d')
 
         self.postprocess_layer = PrePostProcessing(self.model_size, 0, sequence='n')
 
@@ -65,9 +64,10 @@ class TransformerLMDecoder(nn.Module):
         self.build_modules()
 
     def build_modules(self):
-        self.layer_modules = nn.ModuleList([LMDecoderLayer(self.n_heads, self.model_size,
+        # decoder layers without the source attention (as in the UnifiedTransformer)
+        self.layer_modules = nn.ModuleList([DecoderLayer(self.n_heads, self.model_size,
                                                          self.dropout, self.inner_size,
-                                                         self.attn_dropout,
+                                                         self.attn_dropout, ignore_source=True
                                                          ) for _ in range(self.layers)])
 
     def renew_buffer(self, new_len):
@@ -77,12 +77,12 @@ class TransformerLMDecoder(nn.Module):
         mask = torch.ByteTensor(np.triu(np.ones((new_len,new_len)), k=1).astype('uint8'))
         self.register_buffer('mask', mask)
 
-    def forward(self, input,  **kwargs):
+    def forward(self, input, positions=None, documents=None, **kwargs):
         """
         Inputs Shapes:
             input: (Variable) batch_size x len_tgt (wanna tranpose)
-            context: (Variable) batch_size x len_src x d_model
-            mask_src (Tensor) batch_size x len_src
+            positions: (optional) batch_size x len_tgt positions of the tokens (packed sequences)
+            documents: (optional) batch_size x len_tgt document index of the tokens (packed sequences)
         Outputs Shapes:
             out: batch_size x len_tgt x d_model
             coverage: batch_size x len_tgt x len_src
@@ -96,19 +96,26 @@ class TransformerLMDecoder(nn.Module):
         if self.time == 'positional_encoding':
             emb = emb * math.sqrt(self.model_size)
         """ Adding positional encoding """
-        emb = self.time_transformer(emb)
+        if positions is not None:
+            # the positions restart at each document
+            emb = emb + self.time_transformer.pos_emb[positions].type_as(emb)
+        else:
+            emb = self.time_transformer(emb)
         if isinstance(emb, tuple):
             emb = emb[0]
         emb = self.preprocess_layer(emb)
 
         len_tgt = input.size(1)
         mask_tgt = input.data.eq(onmt.constants.PAD).unsqueeze(1) + self.mask[:len_tgt, :len_tgt]
+        if documents is not None:
+            # no attention to the other documents in the sequence
+            mask_tgt = mask_tgt + documents.unsqueeze(2).ne(documents.unsqueeze(1)).type_as(mask_tgt)
         mask_tgt = torch.gt(mask_tgt, 0)
 
         output = emb.transpose(0, 1).contiguous()
 
         for i, layer in enumerate(self.layer_modules):
-            output, coverage = layer(output, mask_tgt)  # batch_size x len_src x d_model
+            output, coverage, _ = layer(output, None, mask_tgt, None)  # len_tgt x batch_size x d_model
 
         # From Google T2T
         # if normalization is done in layer_preprocess, then it should also be done
@@ -185,7 +192,7 @@ class TransformerLMDecoder(nn.Module):
             buffer = buffers[i] if i in buffers else None
             assert(output.size(0) == 1)
 
-            output, coverage, buffer = layer.step(output, mask_tgt,buffer=buffer)
+            output, coverage, buffer = layer.step(output, None, mask_tgt, None, buffer=buffer)
 
             decoder_state.update_attention_buffer(buffer, i)
 
@@ -205,7 +212,7 @@ class TransformerLM(NMTModel):
         super().__init__( encoder, decoder, generator)
         self.model_size = self.decoder.model_size
 
-    def forward(self, batch):
+    def forward(self, batch, **kwargs):
         """
         Inputs Shapes:
             src: len_src x batch_size
@@ -219,15 +226,26 @@ class TransformerLM(NMTModel):
         # we only need target for language model
         tgt = batch.get('target_input')
         tgt_out = batch.get('target_output')
+        positions = batch.get('target_pos')
+        documents = batch.get('target_doc')
 
         tgt = tgt.transpose(0, 1)
-        decoder_output = self.decoder(tgt)
+        if positions is not None:
+            positions = positions.transpose(0, 1)
+        if documents is not None:
+            documents = documents.transpose(0, 1)
+        decoder_output = self.decoder(tgt, positions=positions, documents=documents)
 
         output_dict = defaultdict(lambda: None)
         output_dict['hidden'] = decoder_output['hidden']
+        output_dict['target_mask'] = kwargs.get('target_mask', None)
+        output_dict['logprobs'] = self.generator[0](output_dict)
 
         return output_dict
 
+    def reset_states(self):
+        return
+
     def step(self, input_t, decoder_state):
         """
         Decoding function:
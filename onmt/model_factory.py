@@ -5,6 +5,7 @@ from onmt.models.transformers import TransformerEncoder, TransformerDecoder, Tra
 from onmt.models.transformer_layers import PositionalEncoding
 from onmt.models.relative_transformer import SinusoidalPositionalEmbedding, RelativeTransformer
 from onmt.modules.copy_generator import CopyGenerator
+from onmt.modules.adaptive_softmax import AdaptiveGenerator
 from options import backward_compatible
 
 init = torch.nn.init
@@ -44,6 +45,11 @@ def build_tm_model(opt, dicts):
     if opt.copy_generator:
         generators = [CopyGenerator(opt.model_size, dicts['tgt'].size(),
                                     fix_norm=opt.fix_norm_output_embedding)]
+    elif len(opt.adaptive_softmax_cutoffs) > 0:
+        print("* Adaptive softmax with clusters starting at the ranks %s" % opt.adaptive_softmax_cutoffs)
+        generators = [AdaptiveGenerator(opt.model_size, dicts['tgt'].size(), opt.adaptive_softmax_cutoffs,
+                                        order=dicts['tgt'].frequency_order(),
+                                        div_value=opt.adaptive_softmax_div_value)]
     else:
         generators = [onmt.modules.base_seq2seq.Generator(opt.model_size, dicts['tgt'].size(),
                                                           fix_norm=opt.fix_norm_output_embedding)]
@@ -206,6 +212,7 @@ def init_model_parameters(model, opt):
 
 
 def build_language_model(opt, dicts):
+    opt = backward_compatible(opt)
 
     onmt.constants.layer_norm = opt.layer_norm
     onmt.constants.weight_norm = opt.weight_norm
@@ -214,13 +221,22 @@ def build_language_model(opt, dicts):
     onmt.constants.attention_out = opt.attention_out
     onmt.constants.residual_type = opt.residual_type
 
-    from onmt.legacy.LSTMLM.Models import LSTMLMDecoder, LSTMLM
+    generators = [onmt.modules.base_seq2seq.Generator(opt.model_size, dicts['tgt'].size())]
 
-    decoder = LSTMLMDecoder(opt, dicts['tgt'])
+    if opt.lm_model == 'transformer':
+        from onmt.legacy.TransformerLM.Models import TransformerLMDecoder, TransformerLM
 
-    generators = [onmt.modules.base_seq2seq.Generator(opt.model_size, dicts['tgt'].size())]
+        positional_encoder = PositionalEncoding(opt.model_size, len_max=max(opt.max_position_length,
+                                                                             getattr(opt, 'lm_seq_length', 0)))
+        decoder = TransformerLMDecoder(opt, dicts['tgt'], positional_encoder)
+
+        model = TransformerLM(None, decoder, nn.ModuleList(generators))
+    else:
+        from onmt.legacy.LSTMLM.Models import LSTMLMDecoder, LSTMLM
+
+        decoder = LSTMLMDecoder(opt, dicts['tgt'])
 
-    model = LSTMLM(None, decoder, nn.ModuleList(generators))
+        model = LSTMLM(None, decoder, nn.ModuleList(generators))
 
     if opt.tie_weights:
         print("* Joining the weights of decoder input and output embeddings")
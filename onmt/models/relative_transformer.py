@@ -6,6 +6,7 @@ from onmt.models.transformers import TransformerEncoder, TransformerDecoder, Tra
 import onmt
 from onmt.modules.base_seq2seq import NMTModel, Reconstructor, DecoderState
 from onmt.modules.dropout import embedded_dropout
+from onmt.modules.checkpoint import checkpoint_layer
 from onmt.models.transformer_layers import XavierLinear, MultiHeadAttention, FeedForward, PrePostProcessing
 from onmt.models.relative_transformer_layers import RelativeTransformerEncoderLayer, RelativeTransformerDecoderLayer
 from onmt.utils import flip, expected_length
@@ -315,7 +316,10 @@ class RelativeTransformerEncoder(TransformerEncoder):
 
         for i, layer in enumerate(self.layer_modules):
             # src_len x batch_size x d_model
-            context = layer(context, pos_emb, mask_src)
+            if i in self.checkpointed:
+                context = checkpoint_layer(layer, context, pos_emb, mask_src)
+            else:
+                context = layer(context, pos_emb, mask_src)
 
         # From Google T2T
         # if normalization is done in layer_preprocess, then it should also be done
@@ -601,7 +605,10 @@ class RelativeTransformerDecoder(TransformerDecoder):
         for i, layer in enumerate(self.layer_modules):
             # batch_size x src_len x d_model
             # output, coverage = layer(output, context, pos_emb, self.r_w_bias, self.r_r_bias, dec_attn_mask, mask_src)
-            output, coverage, _ = layer(output, context, pos_emb, dec_attn_mask, mask_src)
+            if i in self.checkpointed:
+                output, coverage, _ = checkpoint_layer(layer, output, context, pos_emb, dec_attn_mask, mask_src)
+            else:
+                output, coverage, _ = layer(output, context, pos_emb, dec_attn_mask, mask_src)
 
         # From Google T2T
         # if normalization is done in layer_preprocess, then it should also be done
@@ -10,6 +10,7 @@ from torch.utils.checkpoint import checkpoint
 from collections import defaultdict
 from onmt.utils import flip, expected_length
 from onmt.modules.linear import FeedForward, FeedForwardSwish
+from onmt.modules.checkpoint import checkpointed_layers, checkpoint_layer
 import copy
 
 torch_version = float(torch.__version__[:3])
@@ -76,6 +77,10 @@ class TransformerEncoder(nn.Module):
 
         self.time = opt.time
 
+        # the layers recomputed in the backward pass (activation checkpointing)
+        self.checkpointed = checkpointed_layers(self.layers, getattr(opt, 'checkpointing', 0),
+                                                getattr(opt, 'checkpointing_interval', 1))
+
         # disable word dropout when switch out is in action
         if self.switchout > 0.0:
             self.word_dropout = 0.0
@@ -212,6 +217,9 @@ class TransformerEncoder(nn.Module):
 
         for i, layer in enumerate(self.layer_modules):
 
+            if i in self.checkpointed:
+                context = checkpoint_layer(layer, context, mask_src)
+            else:
                 context = layer(context, mask_src)  # batch_size x len_src x d_model
 
         # From Google T2T
@@ -258,6 +266,10 @@ class TransformerDecoder(nn.Module):
         self.use_language_embedding = opt.use_language_embedding
         self.language_embedding_type = opt.language_embedding_type
 
+        # the layers recomputed in the backward pass (activation checkpointing)
+        self.checkpointed = checkpointed_layers(self.layers, getattr(opt, 'checkpointing', 0),
+                                                getattr(opt, 'checkpointing_interval', 1))
+
         if self.switchout > 0:
             self.word_dropout = 0
 
@@ -386,7 +398,10 @@ class TransformerDecoder(nn.Module):
 
         for i, layer in enumerate(self.layer_modules):
 
-            output, coverage, _ = layer(output, context, mask_tgt, mask_src)  # batch_size x len_src x d_model
+            if i in self.checkpointed:
+                output, coverage, _ = checkpoint_layer(layer, output, context, mask_tgt, mask_src)
+            else:
+                output, coverage, _ = layer(output, context, mask_tgt, mask_src)  # batch_size x len_src x d_model
 
         # From Google T2T
         # if normalization is done in layer_preprocess, then it should also be done
@@ -532,8 +547,9 @@ class Transformer(NMTModel):
         return
 
     def forward(self, batch, target_mask=None, streaming=False, zero_encoder=False,
-                mirror=False, streaming_state=None):
+                mirror=False, streaming_state=None, compute_logprobs=True):
         """
+        :param compute_logprobs: apply the generator (False: the loss is computed from the hidden states)
         :param streaming_state:
         :param streaming:
         :param mirror: if using mirror network for future anticipation
@@ -587,8 +603,9 @@ class Transformer(NMTModel):
         output_dict['streaming_state'] = streaming_state
 
         # final layer: computing softmax
-        logprobs = self.generator[0](output_dict)
-        output_dict['logprobs'] = logprobs
+        if compute_logprobs:
+            logprobs = self.generator[0](output_dict)
+            output_dict['logprobs'] = logprobs
 
         # Mirror network: reverse the target sequence and perform backward language model
         if mirror:
@@ -0,0 +1,95 @@
+import contextlib
+import math
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class AdaptiveGenerator(nn.Module):
+    """
+    Adaptive softmax output layer (Grave et al., 2017) for large target vocabularies
+    The words are ranked by frequency and split by the cutoffs into the shortlist and the clusters.
+    The head predicts the words of the shortlist and one entry per cluster, the words of a cluster are predicted
+    from a projection of the hidden state divided by div_value (per cluster), so rare words cost less.
+    """
+
+    def __init__(self, hidden_size, output_size, cutoffs, order=None, div_value=4.0):
+        """
+        :param cutoffs: increasing ranks where the clusters start (e.g. [20000, 60000])
+        :param order: the word indices sorted by decreasing frequency (Dict.frequency_order)
+        """
+        super(AdaptiveGenerator, self).__init__()
+        self.hidden_size = hidden_size
+        self.output_size = output_size
+        self.softmax = nn.AdaptiveLogSoftmaxWithLoss(hidden_size, output_size, list(cutoffs),
+                                                     div_value=div_value, head_bias=True)
+
+        # order[r] is the word with the rank r, rank[w] the rank of the word w
+        order = torch.arange(output_size) if order is None else torch.as_tensor(order).long()
+        self.register_buffer('order', order)
+        self.register_buffer('rank', torch.argsort(order))
+
+        # number of candidates taken from each hypothesis by the beam search (0: compute all clusters)
+        self.topk = 0
+
+    @contextlib.contextmanager
+    def pruning(self, topk):
+        """
+        Only compute the clusters which can contain one of the topk best words of a token (decoding steps)
+        """
+        self.topk = topk
+        try:
+            yield
+        finally:
+            self.topk = 0
+
+    def nll(self, input, targets):
+        """
+        :param input: tokens x hidden_size
+        :param targets: word indices (tokens)
+        :return: - log p(target) of every token, only the clusters of the targets are computed
+        """
+        return -self.softmax(input, self.rank.index_select(0, targets)).output.float()
+
+    def log_prob(self, input):
+        """
+        :param input: tokens x hidden_size
+        :return: tokens x vocabulary log probabilities (in the order of the word indices)
+        With topk > 0, the clusters whose probability is below the topk-th best word of the shortlist are
+        not computed (-inf): none of their words can be among the topk best words of the token
+        """
+        softmax = self.softmax
+        shortlist = softmax.shortlist_size
+
+        head_logprob = F.log_softmax(softmax.head(input).float(), dim=-1)
+        output = head_logprob.new_full((input.size(0), self.output_size), -math.inf)
+        output[:, :shortlist] = head_logprob[:, :shortlist]
+
+        threshold = None
+        if 0 < self.topk <= shortlist:
+            threshold = head_logprob[:, :shortlist].topk(self.topk, dim=-1)[0][:, -1]
+
+        for i in range(softmax.n_clusters):
+            start, stop = softmax.cutoffs[i], softmax.cutoffs[i + 1]
+            cluster_logprob = head_logprob[:, shortlist + i]
+
+            if threshold is None:
+                tail_logprob = F.log_softmax(softmax.tail[i](input).float(), dim=-1)
+                output[:, start:stop] = tail_logprob + cluster_logprob.unsqueeze(1)
+            else:
+                rows = torch.nonzero(cluster_logprob > threshold).squeeze(1)
+                if rows.numel() == 0:
+                    continue
+                tail_logprob = F.log_softmax(softmax.tail[i](input.index_select(0, rows)).float(), dim=-1)
+                output[rows, start:stop] = tail_logprob + cluster_logprob.index_select(0, rows).unsqueeze(1)
+
+        return output.index_select(1, self.rank)
+
+    def forward(self, output_dicts):
+
+        input = output_dicts['hidden']
+        size = input.size()
+
+        output = self.log_prob(input.contiguous().view(-1, size[-1]))
+
+        return output.view(*size[:-1], self.output_size)
@@ -0,0 +1,39 @@
+import torch
+from torch.utils.checkpoint import checkpoint
+
+"""
+Activation checkpointing of the layers of a stack
+
+The activations inside a checkpointed layer are not kept for the backward pass: only the input of the layer
+is stored and the layer is run again during the backward pass.
+The random state (CPU and GPU) is saved before the forward pass and restored before the recomputation,
+so dropout and the layer drop of stochastic depth draw the same masks twice.
+"""
+
+
+def checkpointed_layers(n_layers, n_checkpointed=0, interval=1):
+    """
+    Choose the layers of a stack which are recomputed in the backward pass
+    :param n_layers: number of layers of the stack
+    :param n_checkpointed: maximum number of checkpointed layers (-1: no maximum, 0: no checkpointing)
+    :param interval: checkpoint every interval-th layer, counted from the top of the stack
+    :return: set of the indices of the checkpointed layers
+    """
+    if n_checkpointed == 0:
+        return set()
+
+    layers = list(range(n_layers - 1, -1, -max(interval, 1)))
+    if n_checkpointed > 0:
+        layers = layers[:n_checkpointed]
+
+    return set(layers)
+
+
+def checkpoint_layer(layer, *args, **kwargs):
+    """
+    Run the layer without keeping its activations (only in training mode and when gradients are computed)
+    """
+    if layer.training and torch.is_grad_enabled():
+        return checkpoint(layer, *args, use_reentrant=False, **kwargs)
+
+    return layer(*args, **kwargs)
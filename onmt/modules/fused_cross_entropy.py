@@ -0,0 +1,92 @@
+import torch
+import torch.nn.functional as F
+from torch.autograd import Function
+
+
+class FusedCrossEntropyFunction(Function):
+    """
+    Output projection + log softmax + label smoothed cross entropy, computed in chunks of tokens
+    Only the log normalizer of every token is kept for the backward pass, where the logits of each chunk
+    are computed again. The tensor of the log probabilities (tokens x vocabulary) never exists:
+    the memory is bounded by chunk_size x vocabulary.
+    """
+
+    @staticmethod
+    def forward(ctx, hidden, weight, bias, targets, confidence, smoothing_value, chunk_size):
+        """
+        :param hidden: tokens x hidden_size (without the padded positions)
+        :param weight: vocabulary x hidden_size
+        :param bias: vocabulary (or None)
+        :param targets: tokens
+        :return: the label smoothed loss and the nll loss (summed over the tokens)
+        """
+        vocab_size = weight.size(0)
+        weight_ = weight.to(hidden.dtype)
+        bias_ = bias.to(hidden.dtype) if bias is not None else None
+        # the logits are (at least) in single precision
+        dtype = torch.promote_types(hidden.dtype, torch.float)
+
+        lse = hidden.new_empty(hidden.size(0), dtype=dtype)
+        nll_loss = hidden.new_zeros((), dtype=dtype)
+        smooth_loss = hidden.new_zeros((), dtype=dtype)
+
+        for start in range(0, hidden.size(0), chunk_size):
+            end = min(start + chunk_size, hidden.size(0))
+            logits = F.linear(hidden[start:end], weight_, bias_).to(dtype)
+            chunk_lse = torch.logsumexp(logits, dim=-1)
+            lse[start:end] = chunk_lse
+
+            # - log p(target) and - sum_v log p(v)
+            nll_loss += (chunk_lse - logits.gather(1, targets[start:end].unsqueeze(1)).squeeze(1)).sum()
+            smooth_loss += (chunk_lse * vocab_size - logits.sum(dim=-1)).sum()
+
+        loss = confidence * nll_loss + smoothing_value * smooth_loss
+
+        ctx.save_for_backward(hidden, weight, bias, targets, lse)
+        ctx.confidence, ctx.smoothing_value, ctx.chunk_size = confidence, smoothing_value, chunk_size
+        ctx.mark_non_differentiable(nll_loss)
+
+        return loss, nll_loss
+
+    @staticmethod
+    def backward(ctx, grad_loss, grad_nll_loss):
+        hidden, weight, bias, targets, lse = ctx.saved_tensors
+        confidence, smoothing_value, chunk_size = ctx.confidence, ctx.smoothing_value, ctx.chunk_size
+        vocab_size = weight.size(0)
+        weight_ = weight.to(hidden.dtype)
+        bias_ = bias.to(hidden.dtype) if bias is not None else None
+        dtype = lse.dtype
+
+        grad_hidden = torch.empty_like(hidden)
+        grad_weight = torch.zeros_like(weight, dtype=dtype)
+        grad_bias = torch.zeros_like(bias, dtype=dtype) if bias is not None else None
+
+        for start in range(0, hidden.size(0), chunk_size):
+            end = min(start + chunk_size, hidden.size(0))
+            logits = F.linear(hidden[start:end], weight_, bias_).to(dtype)
+
+            # d loss / d logits = p * (confidence + smoothing * V) - smoothing - confidence * onehot(target)
+            grad_logits = logits.sub_(lse[start:end].unsqueeze(1)).exp_()
+            grad_logits.mul_(confidence + smoothing_value * vocab_size).sub_(smoothing_value)
+            grad_logits.scatter_add_(1, targets[start:end].unsqueeze(1),
+                                     grad_logits.new_full((end - start, 1), -confidence))
+            grad_logits.mul_(grad_loss)
+
+            grad_hidden[start:end] = torch.mm(grad_logits, weight_.to(dtype)).to(hidden.dtype)
+            grad_weight.addmm_(grad_logits.t(), hidden[start:end].to(dtype))
+            if grad_bias is not None:
+                grad_bias += grad_logits.sum(dim=0)
+
+        grad_weight = grad_weight.to(weight.dtype)
+        grad_bias = grad_bias.to(bias.dtype) if grad_bias is not None else None
+
+        return grad_hidden, grad_weight, grad_bias, None, None, None, None
+
+
+def fused_cross_entropy(hidden, weight, bias, targets, label_smoothing=0.0, smoothing_value=0.0, chunk_size=1024):
+    """
+    Label smoothed cross entropy of the tokens (without materializing their log probabilities)
+    :return: loss and nll loss, summed over the tokens
+    """
+    return FusedCrossEntropyFunction.apply(hidden, weight, bias, targets, 1.0 - label_smoothing,
+                                           smoothing_value, chunk_size)
@@ -5,6 +5,8 @@ import torch, math
 import torch.nn.functional as F
 from torch.nn.modules.loss import _Loss
 from onmt.utils import flip
+from onmt.modules.fused_cross_entropy import fused_cross_entropy
+from onmt.modules.adaptive_softmax import AdaptiveGenerator
 
 import numpy
 
@@ -41,10 +43,36 @@ class CrossEntropyLossBase(_Loss):
 
         eps_i = self.smoothing_value
         loss = (1. - self.label_smoothing) * nll_loss + eps_i * smooth_loss
-        loss_data = nll_loss.data.item()
+        # kept on the device (reading it would synchronize with the device at every batch)
+        loss_data = nll_loss.detach()
 
         return loss, loss_data
 
+    def _compute_fused_loss(self, hidden, targets, generator, chunk_size=1024):
+        """
+        The same loss computed from the decoder states: the padded positions are removed first
+        and the output layer is computed together with the loss in chunks of tokens
+        """
+        gtruth = targets.view(-1)
+        non_pad_indices = torch.nonzero(gtruth.ne(self.padding_idx)).squeeze(1)
+        hidden = hidden.contiguous().view(-1, hidden.size(-1)).index_select(0, non_pad_indices)
+        gtruth = gtruth.index_select(0, non_pad_indices)
+
+        # the adaptive softmax only computes the clusters of the targets (no label smoothing)
+        if isinstance(generator, AdaptiveGenerator):
+            nll_loss = generator.nll(hidden, gtruth).sum()
+            return nll_loss, nll_loss.detach()
+
+        weight = generator.linear.weight
+        if generator.fix_norm:
+            weight = F.normalize(weight, dim=-1)
+
+        loss, nll_loss = fused_cross_entropy(hidden, weight, generator.linear.bias, gtruth,
+                                             label_smoothing=self.label_smoothing,
+                                             smoothing_value=self.smoothing_value, chunk_size=chunk_size)
+
+        return loss, nll_loss.detach()
+
     def forward(self, model_outputs, targets, hiddens, **kwargs):
 
         return NotImplementedError
@@ -54,7 +82,7 @@ class NMTLossFunc(CrossEntropyLossBase):
     """
     Standard NMT Loss Computation.
     """
-    def __init__(self, hidden_size, output_size, label_smoothing, mirror=False):
+    def __init__(self, hidden_size, output_size, label_smoothing, mirror=False, fused=False, chunk_size=1024):
         super(NMTLossFunc, self).__init__(output_size, label_smoothing)
         self.output_size = output_size
         self.padding_idx = onmt.constants.PAD
@@ -62,6 +90,9 @@ class NMTLossFunc(CrossEntropyLossBase):
         self.confidence = 1.0 - label_smoothing
         self.label_smoothing = label_smoothing
         self.mirror = mirror
+        # the log probabilities are not computed by the model (see Transformer.forward)
+        self.fused = fused
+        self.chunk_size = chunk_size
 
     def forward(self, model_outputs, targets, model=None, backward=False, normalizer=1, **kwargs):
         """
@@ -89,7 +120,11 @@ class NMTLossFunc(CrossEntropyLossBase):
 
             alpha = 1.0
 
-        loss, loss_data = self._compute_loss(logprobs, targets)
+        if self.fused:
+            loss, loss_data = self._compute_fused_loss(outputs, targets, model.generator[0],
+                                                       chunk_size=self.chunk_size)
+        else:
+            loss, loss_data = self._compute_loss(logprobs, targets)
 
         total_loss = loss
 
@@ -251,7 +286,7 @@ class NMTAndCTCLossFunc(_Loss):
         loss = self.ctc_weight * ctc_loss['loss'] + (1-self.ctc_weight) * ce_loss['loss']
         loss_data = self.ctc_weight * ctc_loss['data'] + (1-self.ctc_weight) * ce_loss['data']
 
-        if not numpy.isfinite(ctc_loss['data']):
+        if not numpy.isfinite(float(ctc_loss['data'])):
             print("CTC_Loss:",ctc_loss['data'])
             print("NMT_Loss:",ce_loss['data'])
             print("Loss:",loss_data)
@@ -0,0 +1,110 @@
+from __future__ import division
+
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+
+"""
+Data parallel training with torch.distributed
+
+One process per GPU (or per CPU worker with the gloo backend), on one or several nodes.
+Every process has a full copy of the model and trains on its own shard of the batch order:
+the batch order is the same in all processes (it is generated from a common seed) and the process
+with rank r takes the batches r, r + world_size, r + 2 * world_size ...
+The gradients are averaged with DistributedDataParallel, which all-reduces them in buckets
+while the backward pass is still running. Only the process with rank 0 writes the checkpoints.
+"""
+
+
+def init_distributed(opt, local_rank):
+    """
+    Join the process group of the training
+    :param local_rank: index of the process on this node (the GPU is opt.gpus[local_rank])
+    """
+    procs_per_node = len(opt.gpus) if len(opt.gpus) > 0 else opt.cpu_workers
+    opt.rank = opt.node_rank * procs_per_node + local_rank
+    opt.world_size = opt.num_nodes * procs_per_node
+
+    if len(opt.gpus) > 0:
+        opt.gpus = [opt.gpus[local_rank]]
+        torch.cuda.set_device(opt.gpus[0])
+
+    backend = opt.dist_backend if len(opt.gpus) > 0 else 'gloo'
+    dist.init_process_group(backend=backend, init_method=opt.dist_url,
+                            world_size=opt.world_size, rank=opt.rank)
+
+    if opt.rank == 0:
+        print("* Distributed training with %d processes (%s backend)" % (opt.world_size, backend))
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_master():
+    return get_rank() == 0
+
+
+def wrap_model(model, opt):
+    """
+    Wrap the model to average the gradients over the processes during the backward pass
+    (the parameters of the process 0 are copied to the other processes)
+    """
+    device_ids = [opt.gpus[0]] if len(opt.gpus) > 0 else None
+
+    return DistributedDataParallel(model, device_ids=device_ids,
+                                   bucket_cap_mb=opt.bucket_cap_mb,
+                                   find_unused_parameters=opt.find_unused_parameters)
+
+
+def shard_steps(start, end):
+    """
+    The steps of this process in the batch order [start, end)
+    Every process makes the same number of steps (the last batches which can't be shared are skipped)
+    :return: range of the index of the first batch of each step (the batch of the process is index + rank)
+    """
+    world_size = get_world_size()
+
+    return range(start, end - world_size + 1, world_size)
+
+
+def all_reduce_scalars(values):
+    """
+    Sum numbers over all processes (with a single all-reduce)
+    :return: list of floats
+    """
+    if not is_distributed():
+        return [float(value) for value in values]
+
+    device = torch.device('cuda') if dist.get_backend() == 'nccl' else torch.device('cpu')
+    tensor = torch.tensor([float(value) for value in values], dtype=torch.float64, device=device)
+    dist.all_reduce(tensor)
+
+    return tensor.tolist()
+
+
+class common_random_state(object):
+    """
+    Context manager: draw random numbers which are the same in all processes (e.g. the order of the batches),
+    without changing the random state of the process (dropout etc.)
+    """
+
+    def __init__(self, seed):
+        self.seed = seed
+        self.state = None
+
+    def __enter__(self):
+        self.state = torch.get_rng_state()
+        # only the CPU generator (which draws the batch orders) is seeded
+        torch.default_generator.manual_seed(self.seed)
+
+    def __exit__(self, *args):
+        torch.set_rng_state(self.state)
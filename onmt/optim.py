@@ -116,12 +116,23 @@ class Optim(object):
         self.max_steps = opt.max_steps
 
     def step(self, grad_denom=None):
+        """
+        Normalize the gradients by grad_denom (e.g. the batch size), clip them and update the parameters.
+        The gradients are those of the parameters held by the optimizer (the fp32 master copies with amp)
+        :return: the norm of the normalized gradients (a tensor on the device, None without clipping)
+        """
+
+        grads = [p.grad for group in self.optimizer.param_groups for p in group['params'] if p.grad is not None]
 
-        "Normalize gradients by batch size"
-        self.normalize_grad(denom=grad_denom)
+        "Normalize gradients by batch size (one pass over the gradients, no synchronization with the device)"
+        if grad_denom is not None and grad_denom != 1 and len(grads) > 0:
+            torch._foreach_mul_(grads, 1. / float(grad_denom))
 
-        "Compute gradients norm."
-        grad_norm = clip_grad_norm(self.params, self.max_grad_norm).item()
+        "Clip the gradients norm."
+        grad_norm = None
+        if self.max_grad_norm > 0 and len(grads) > 0:
+            grad_norm = torch.nn.utils.clip_grad_norm_(
+                [p for group in self.optimizer.param_groups for p in group['params']], self.max_grad_norm)
 
         "Automatically scale learning rate over learning period"
         self._step += 1
@@ -2,58 +2,93 @@ import math
 import torch
 from collections import defaultdict
 import onmt
-import random
+
 
 class Augmenter(object):
     """
     Implementation of the "Spec Augmentation" method
     (Only vertical and horizontal masking)
+    The masks are drawn for the whole (padded) batch at once and applied on the device of the batch,
+    so it can run on the GPU after the transfer.
     """
 
-    def __init__(self, F=27, mf=2, T=70, max_t=0.2, mt=2):
-
+    def __init__(self, F=27, mf=2, T=70, max_t=0.2, mt=2, input_size=40, on_gpu=False):
+        """
+        :param F: maximum width of the frequency masks
+        :param mf: number of frequency masks
+        :param T: maximum width of the time masks (in frames)
+        :param max_t: maximum width of the time masks relative to the length of the utterance
+        :param mt: number of time masks
+        :param input_size: number of features of one frame (log mel has 40 features),
+        the frames concatenated during preprocessing are masked as separate frames
+        :param on_gpu: apply the masks after the batch is sent to the GPU (see Batch.cuda)
+        """
         self.F = F
         self.mf = mf
         self.T = T
         self.max_t = max_t
         self.mt = mt
+        self.input_size = input_size
+        self.on_gpu = on_gpu
+
+    @staticmethod
+    def bands(n_masks, max_width, length, size, offset=0):
+        """
+        Draw n_masks random bands [start, start + width) for each sequence, with width < max_width
+        and the bands inside the sequence
+        :param max_width: number or tensor B x 1
+        :param length: tensor (B) with the length of each sequence
+        :param size: the length of the masks
+        :param offset: number or tensor B x 1, the position of the first element of each sequence
+        :return: B x size boolean mask (True inside the bands)
+        """
+        batch_size, device = length.size(0), length.device
+        length = length.float().unsqueeze(1)
+
+        width = torch.min((torch.rand(batch_size, n_masks, device=device) * max_width).floor(), length)
+        start = (torch.rand(batch_size, n_masks, device=device) * (length - width)).floor() + offset
+
+        positions = torch.arange(size, device=device).float().view(1, 1, size)
+        inside = (positions >= start.unsqueeze(2)) & (positions < (start + width).unsqueeze(2))
+
+        return inside.any(dim=1)
+
+    def augment_batch(self, tensor, lengths, align_right=False):
+        """
+        Mask the features of a padded batch (in place)
+        :param tensor: B x T x (1 + feature_size) batch from Batch.collate (the first feature is the padding mask)
+        :param lengths: the lengths of the utterances (number of rows in the batch)
+        :param align_right: the utterances are aligned to the right side
+        :return: tensor
+        """
+        batch_size, max_length = tensor.size(0), tensor.size(1)
+        features = tensor.narrow(2, 1, tensor.size(2) - 1)
+
+        # the frames concatenated during preprocessing (k per row) are masked in their original resolution
+        input_size = self.input_size if features.size(2) % self.input_size == 0 else features.size(2)
+        k = features.size(2) // input_size
+        n_frames = max_length * k
+        lengths = torch.as_tensor(lengths, device=tensor.device).long() * k
+
+        freq_mask = self.bands(self.mf, self.F, torch.full_like(lengths, input_size), input_size)
+
+        max_width = torch.clamp((lengths.float() * self.max_t).floor(), max=self.T).unsqueeze(1)
+        offset = (n_frames - lengths).float().unsqueeze(1) if align_right else 0
+        time_mask = self.bands(self.mt, max_width, lengths, n_frames, offset=offset)
+
+        # B x T x k x input_size: every row is split into its k frames
+        # (multiplying with the broadcast masks is faster than masked_fill_)
+        frames = features.view(batch_size, max_length, k, input_size)
+        frames.mul_((~time_mask).to(frames.dtype).view(batch_size, max_length, k, 1))
+        frames.mul_((~freq_mask).to(frames.dtype).view(batch_size, 1, 1, input_size))
+
+        return tensor
 
     def augment(self, tensor):
+        """
+        Mask one utterance (T x feature_size), the result is a new tensor
+        """
+        batch = tensor.float().new_zeros(1, tensor.size(0), tensor.size(1) + 1)
+        batch[0, :, 1:].copy_(tensor)
 
-        feat_size = tensor.size(1)
-        original_len = tensor.size(0)
-        # because log mel has 40 features
-        reshape_size = feat_size / 40
-
-        tensor = tensor.float()
-        # First we have to upsample the tensor (if it was downsampled during preprocessing)
-        # Copy to a new storage because otherwise it is zeroed permanently`
-        tensor_ = tensor.view(-1, 40).new(*tensor.size()).copy_(tensor)
-
-        for _ in range(self.mf):
-
-            # frequency masking (second dimension)
-            # 40 is the number of features (logmel)
-            f = int(random.uniform(0.0, self.F))
-            f_0 = int(random.uniform(0.0, 40 - f))
-
-            tensor_[:, f_0:f_0 + f].zero_()
-
-        for _ in range(self.mt):
-            # time masking (first dimension)
-            t = int(random.uniform(0.0, self.F))
-
-            t = min(t, int(self.max_t * original_len))
-
-            t_0 = int(random.uniform(0.0, original_len - t - 1))
-
-            tensor_[t_0: t_0 + t].zero_()
-
-        # reshaping back to downsampling
-        tensor__ = tensor_.view(original_len, feat_size)
-
-        return tensor__
-
-
-
-
+        return self.augment_batch(batch, [tensor.size(0)])[0, :, 1:]
@@ -0,0 +1,116 @@
+import os
+import threading
+import torch
+from onmt.utils import checkpoint_paths
+
+
+class CheckpointSaver(object):
+    """
+    Writes the checkpoints in a background thread
+    The training thread only copies the tensors of the checkpoint to CPU memory (pinned buffers which are
+    reused from one save to the next, the copies from the GPU are asynchronous). The writer thread waits for
+    the copies, writes the checkpoint to a temporary file, renames it to its final name (a checkpoint is
+    either complete or absent) and deletes the old checkpoints.
+    At most one checkpoint is written at a time: a new save first waits for the previous one.
+    """
+
+    def __init__(self, keep_save_files=None):
+        """
+        :param keep_save_files: number of checkpoints kept in the directory (None: keep all)
+        """
+        self.keep_save_files = keep_save_files
+        self.buffers = []
+        self.thread = None
+        self.error = None
+
+    def _snapshot(self, obj, counter):
+        """
+        Copy of the containers of obj where every tensor is replaced by its copy in CPU memory
+        The other objects are not copied (they are not modified while the checkpoint is written)
+        """
+        if torch.is_tensor(obj):
+            return self._copy_tensor(obj, counter)
+        elif isinstance(obj, dict):
+            copy = obj.copy()
+            for key, value in obj.items():
+                copy[key] = self._snapshot(value, counter)
+            return copy
+        elif isinstance(obj, (list, tuple)) and any(torch.is_tensor(x) or isinstance(x, (dict, list, tuple))
+                                                    for x in obj):
+            copy = [self._snapshot(value, counter) for value in obj]
+            return copy if isinstance(obj, list) else type(obj)(copy)
+
+        return obj
+
+    def _copy_tensor(self, tensor, counter):
+
+        tensor = tensor.detach()
+        if not tensor.is_cuda:
+            return tensor.clone()
+
+        # the buffers are identified by the position of the tensor in the checkpoint
+        i = counter[0]
+        counter[0] += 1
+        if i == len(self.buffers):
+            self.buffers.append(None)
+
+        buffer = self.buffers[i]
+        if buffer is None or buffer.size() != tensor.size() or buffer.dtype != tensor.dtype:
+            buffer = torch.empty(tensor.size(), dtype=tensor.dtype, pin_memory=True)
+            self.buffers[i] = buffer
+
+        buffer.copy_(tensor, non_blocking=True)
+        return buffer
+
+    def save(self, checkpoint, file_name):
+        """
+        Snapshot the checkpoint and write it to file_name in the background
+        The tensors of the checkpoint can be modified as soon as this function returns
+        """
+        # the previous checkpoint is written from the buffers which are about to be overwritten
+        self.wait()
+
+        counter = [0]
+        snapshot = self._snapshot(checkpoint, counter)
+        del self.buffers[counter[0]:]
+
+        event = None
+        if counter[0] > 0:
+            event = torch.cuda.Event()
+            event.record()
+
+        # not a daemon: the last checkpoint is written even if the training ends
+        self.thread = threading.Thread(target=self._write, args=(snapshot, file_name, event))
+        self.thread.start()
+
+    def _write(self, snapshot, file_name, event):
+
+        try:
+            if event is not None:
+                event.synchronize()
+
+            tmp_file = file_name + '.tmp'
+            torch.save(snapshot, tmp_file)
+            os.replace(tmp_file, file_name)
+            print('Checkpoint written to %s' % file_name, flush=True)
+
+            if self.keep_save_files is not None:
+                checkpoint_dir = os.path.dirname(file_name) or '.'
+                existed_save_files = checkpoint_paths(checkpoint_dir)
+                for save_file in existed_save_files[self.keep_save_files:]:
+                    print(" * Deleting old save file %s ...." % save_file, flush=True)
+                    os.remove(save_file)
+        except Exception as e:
+            self.error = e
+
+    def wait(self):
+        """
+        Wait until the last checkpoint is written (the errors of the writer thread are raised here)
+        """
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('Writing the checkpoint failed') from error
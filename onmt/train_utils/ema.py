@@ -0,0 +1,80 @@
+import contextlib
+import torch
+
+
+class ExponentialMovingAverage(object):
+    """
+    Exponential moving average of the parameters of a model, kept during the training
+    The averages are kept in single precision (on the device of the parameters or on the given device)
+    and updated with one multi-tensor operation for all parameters.
+    The decay is warmed up as in tf.train.ExponentialMovingAverage: min(decay, (1 + n) / (10 + n))
+    after n updates, so that the first updates do not stay close to the initialization.
+    """
+
+    def __init__(self, model, decay, device=None):
+        """
+        :param decay: weight of the average at each update
+        :param device: device of the averages (default: the device of the parameters)
+        """
+        self.decay = decay
+        self.device = device
+        self.num_updates = 0
+        self.parameters = [p for p in model.parameters() if p.requires_grad]
+        self.shadow = [p.detach().to(device=device or p.device, dtype=torch.float, copy=True)
+                       for p in self.parameters]
+
+    def _sources(self):
+        """
+        The parameters on the device and in the type of the averages
+        """
+        return [p.detach().to(device=s.device, dtype=s.dtype, non_blocking=True)
+                for p, s in zip(self.parameters, self.shadow)]
+
+    @torch.no_grad()
+    def update(self):
+        self.num_updates += 1
+        decay = min(self.decay, (1 + self.num_updates) / (10 + self.num_updates))
+
+        # shadow <- shadow + (1 - decay) * (parameter - shadow)
+        torch._foreach_lerp_(self.shadow, self._sources(), 1 - decay)
+
+    @contextlib.contextmanager
+    @torch.no_grad()
+    def average_parameters(self):
+        """
+        Temporarily replace the parameters of the model by their averages (e.g. for the validation)
+        """
+        backup = [p.detach().clone() for p in self.parameters]
+        for p, s in zip(self.parameters, self.shadow):
+            p.copy_(s)
+        try:
+            yield
+        finally:
+            for p, b in zip(self.parameters, backup):
+                p.copy_(b)
+
+    def model_state_dict(self, model):
+        """
+        The state dict of the model with the averaged parameters (in the type of the parameters)
+        """
+        shadow = {id(p): s for p, s in zip(self.parameters, self.shadow)}
+        state_dict = model.state_dict(keep_vars=True)
+
+        for name, tensor in state_dict.items():
+            if id(tensor) in shadow:
+                state_dict[name] = shadow[id(tensor)].to(dtype=tensor.dtype)
+            else:
+                state_dict[name] = tensor.detach()
+
+        return state_dict
+
+    def state_dict(self):
+        return {'shadow': self.shadow, 'num_updates': self.num_updates}
+
+    def load_state_dict(self, state_dict):
+        if len(state_dict['shadow']) != len(self.shadow):
+            raise ValueError("The moving average does not have the parameters of the model")
+
+        self.num_updates = state_dict['num_updates']
+        for s, saved in zip(self.shadow, state_dict['shadow']):
+            s.copy_(saved)
@@ -5,13 +5,28 @@ import onmt.markdown
 import onmt.modules
 import torch
 from torch.autograd import Variable
+import contextlib
 import math
 import time, datetime
 import os
 from onmt.model_factory import init_model_parameters
-from onmt.utils import checkpoint_paths, normalize_gradients
 from apex import amp
 from onmt.train_utils.stats import Logger
+from onmt.train_utils.checkpoint_saver import CheckpointSaver
+from onmt.train_utils.ema import ExponentialMovingAverage
+from onmt.train_utils.validator import BackgroundValidator
+from onmt.multiprocessing.distributed import get_rank, get_world_size, is_master, wrap_model, shard_steps, \
+    all_reduce_scalars, common_random_state
+
+
+def batch_shape(batch):
+    """
+    :return: number of sequences, source length and target length of a batch
+    """
+    source, target = batch.get('source'), batch.get('target_output')
+
+    return (batch.size, source.size(0) if source is not None else 0,
+            target.size(0) if target is not None else 0)
 
 
 class BaseTrainer(object):
@@ -27,6 +42,24 @@ class BaseTrainer(object):
         
         self.loss_function = loss_function
         self.start_time = 0
+        # the fused losses compute the output layer themselves
+        self.compute_logprobs = not getattr(loss_function, 'fused', False)
+
+        # data parallel training: the model used for the training steps is wrapped in run()
+        self.rank = get_rank()
+        self.world_size = get_world_size()
+        self.train_model = model
+
+        # exponential moving average of the parameters (created in run(), after the initialization)
+        self.ema = None
+
+        # the validation batches of the intermediate validations and their background validator (see run())
+        self.valid_subset = None
+        self.validator = None
+
+        # the shapes of the batches which ran out of memory and the number of parts to train on them
+        self.oom_shapes = []
+        self.in_backward = False
 
         self.additional_data = []
 
@@ -87,6 +120,9 @@ class XETrainer(BaseTrainer):
     def __init__(self, model, loss_function, train_data, valid_data, dicts, opt, setup_optimizer=True):
         super().__init__(model, loss_function, train_data, valid_data, dicts, opt)
 
+        self.saver = CheckpointSaver(keep_save_files=opt.keep_save_files)
+        self.ema_saver = CheckpointSaver()
+
         if self.cuda:
             torch.cuda.set_device(self.opt.gpus[0])
             torch.manual_seed(self.opt.seed)
@@ -115,7 +151,11 @@ class XETrainer(BaseTrainer):
                 self.valid_data.tgt_align_right = False
 
     def save(self, epoch, valid_ppl, batch_order=None, iteration=-1):
-        
+
+        # the processes have the same model: only the first one writes the checkpoints
+        if not is_master():
+            return
+
         opt = self.opt
         model = self.model
         dicts = self.dicts
@@ -131,42 +171,69 @@ class XETrainer(BaseTrainer):
                 'epoch': epoch,
                 'iteration' : iteration,
                 'batch_order' : batch_order,
+                'order_seed' : getattr(self.train_data, 'order_seed', None),
                 'optim': optim_state_dict,
                 'additional_batch_order' : getattr(self, 'additional_batch_order', None),
                 'additional_data_iteration' : getattr(self, 'additional_data_iteration', None),
-                'amp': amp.state_dict()
+                'amp': amp.state_dict(),
+                'ema': self.ema.state_dict() if self.ema is not None else None
         }
         
         file_name = '%s_ppl_%.6f_e%.2f.pt' % (opt.save_model, valid_ppl, epoch)
         print('Writing to %s' % file_name)
-        torch.save(checkpoint, file_name)
-        
-        # check the save directory here
-        checkpoint_dir = os.path.dirname(opt.save_model)
-        existed_save_files = checkpoint_paths(checkpoint_dir)
-        for save_file in existed_save_files[opt.keep_save_files:]:
-            print (" * Deleting old save file %s ...." % save_file)
-            os.remove(save_file)
+        # written (and the old save files deleted) in the background
+        self.saver.save(checkpoint, file_name)
 
-    def eval(self, data):
+        if self.ema is not None:
+            # the averaged model, ready for the inference (only the last one is kept)
+            ema_checkpoint = {
+                'model': self.ema.model_state_dict(model),
+                'dicts': dicts,
+                'opt': opt,
+                'epoch': epoch,
+                'iteration': -1,
+                'batchOrder': None,
+                'optim': None
+            }
+            ema_file_name = '%s_ema.pt' % opt.save_model
+            print('Writing to %s' % ema_file_name)
+            self.ema_saver.save(ema_checkpoint, ema_file_name)
+
+    def eval(self, data, batch_indices=None):
+        """
+        Validation loss (per target word) of the model
+        :param batch_indices: the indices of the evaluated batches (default: all the batches, in order)
+        """
+        self.model.eval()
+        self.model.reset_states()
+
+        valid_loss = self.eval_model(self.model, data, batch_indices=batch_indices)
+
+        self.model.train()
+        return valid_loss
+
+    def eval_model(self, model, data, batch_indices=None):
+        """
+        Validation loss of a model in evaluation mode (the loss is summed on the device)
+        """
         total_loss = 0
         total_words = 0
         opt = self.opt
-                
-        batch_order = data.create_order(random=False)
-        self.model.eval()
-        self.model.reset_states()
+
+        if batch_indices is None:
+            data.create_order(random=False)
+            batches = (data.next()[0] for i in range(len(data)))
+        else:
+            batches = (data[int(i)] for i in batch_indices)
 
         if opt.streaming:
-            streaming_state = self.model.init_stream()
+            streaming_state = model.init_stream()
         else:
             streaming_state = None
 
         """ PyTorch semantics: save space by not creating gradients """
         with torch.no_grad():
-            for i in range(len(data)):
-
-                batch = data.next()[0]
+            for batch in batches:
 
                 if self.cuda:
                     batch.cuda(fp16=self.opt.fp16)
@@ -177,25 +244,146 @@ class XETrainer(BaseTrainer):
                 """
                 targets = batch.get('target_output')
                 tgt_mask = targets.ne(onmt.constants.PAD)
-                outputs = self.model(batch, streaming=opt.streaming, target_mask=tgt_mask,
-                                     mirror=opt.mirror_loss, streaming_state=streaming_state)
+                outputs = model(batch, streaming=opt.streaming, target_mask=tgt_mask,
+                                mirror=opt.mirror_loss, streaming_state=streaming_state,
+                                compute_logprobs=self.compute_logprobs)
 
                 if opt.streaming:
                     streaming_state = outputs['streaming_state']
 
                 outputs['tgt_mask'] = tgt_mask
 
-                loss_dict = self.loss_function(outputs, targets, model=self.model)
+                loss_dict = self.loss_function(outputs, targets, model=model)
 
                 loss_data = loss_dict['data']
 
                 total_loss += loss_data
                 total_words += batch.tgt_size
 
-        self.model.train()
-        return total_loss / total_words
+        return float(total_loss) / total_words
+
+    def eval_ema(self, data):
+        """
+        Validation perplexity of the moving average of the parameters (None without moving average)
+        """
+        if self.ema is None:
+            return None
+
+        with self.ema.average_parameters():
+            valid_loss = self.eval(data)
+        valid_ppl = math.exp(min(valid_loss, 100))
+        print('EMA validation perplexity: %g' % valid_ppl)
+
+        return valid_ppl
+
+    def validate_subset(self, num_updates):
+        """
+        Intermediate validation between the checkpoints (on the validation subset, in the background with
+        -valid_async)
+        """
+        n_batches = len(self.valid_subset)
+
+        def report(valid_loss):
+            print('Validation perplexity after %d updates (%d batches): %g' %
+                  (num_updates, n_batches, math.exp(min(valid_loss, 100))), flush=True)
+
+        if self.validator is not None:
+            self.validator.start(self.model, report)
+        else:
+            report(self.eval(self.valid_data, batch_indices=self.valid_subset))
         
-    def train_epoch(self, epoch, resume=False, batch_order=None, iteration=0):
+    def forward_backward(self, batch, denom, sync=True, streaming_state=None):
+        """
+        Forward and backward passes (the gradients are added to the gradients of the parameters)
+        :param denom: the loss is divided by denom before the backward pass
+        :param sync: all-reduce the gradients of the processes (data parallel training)
+        :return: the loss (on the device)
+        """
+        opt = self.opt
+        sync_context = self.train_model.no_sync() if self.world_size > 1 and not sync else contextlib.nullcontext()
+
+        with sync_context:
+            # outputs is a dictionary containing keys/values necessary for loss function
+            # can be flexibly controlled within models for easier extensibility
+            targets = batch.get('target_output')
+            tgt_mask = targets.data.ne(onmt.constants.PAD)
+            outputs = self.train_model(batch, streaming=opt.streaming, target_mask=tgt_mask,
+                                       zero_encoder=opt.zero_encoder,
+                                       mirror=opt.mirror_loss, streaming_state=streaming_state,
+                                       compute_logprobs=self.compute_logprobs)
+
+            outputs['tgt_mask'] = tgt_mask
+
+            loss_dict = self.loss_function(outputs, targets, model=self.model)
+            loss_data = loss_dict['data']
+            loss = loss_dict['loss'].div(denom)  # a little trick to avoid gradient overflow with fp16
+
+            optimizer = self.optim.optimizer
+
+            self.in_backward = True
+            if self.cuda:
+                with amp.scale_loss(loss, optimizer) as scaled_loss:
+                    scaled_loss.backward()
+            else:
+                loss.backward()
+            self.in_backward = False
+
+        return loss_data
+
+    def oom_parts(self, batch):
+        """
+        :return: the number of parts for a batch at least as large as a batch which ran out of memory
+        """
+        shape = batch_shape(batch)
+        n_parts = 1
+        for oom_shape, parts in self.oom_shapes:
+            if all(x >= y for x, y in zip(shape, oom_shape)):
+                n_parts = max(n_parts, parts)
+
+        return min(n_parts, batch.size)
+
+    def train_batch(self, batch, denom, sync=True, streaming_state=None):
+        """
+        Forward and backward passes on a batch. When it runs out of memory, the batch is split into
+        2, 4 ... parts whose gradients are accumulated. The shape of the batch is kept so that the batches
+        which are at least as large are split before their first pass (in the following epochs).
+        :return: the loss (on the device) and whether the gradients accumulated before this batch were dropped
+        """
+        n_parts = self.oom_parts(batch)
+        grads_dropped = False
+
+        while True:
+            parts = batch.split(n_parts) if n_parts > 1 else [batch]
+            oom = False
+            try:
+                loss_data = 0
+                for k, part in enumerate(parts):
+                    # the gradients are all-reduced with the last part
+                    loss_data = loss_data + self.forward_backward(part, denom, sync=sync and k == len(parts) - 1,
+                                                                  streaming_state=streaming_state)
+                return loss_data, grads_dropped
+
+            except RuntimeError as e:
+                # with data parallel training, the other processes wait for the gradients of this batch
+                if 'out of memory' not in str(e) or self.world_size > 1 or n_parts >= batch.size:
+                    raise e
+                oom = True
+
+            # (outside of the except block: the tensors referenced by the error are released)
+            if oom:
+                # the gradients are incomplete if the error happened during a backward pass
+                if self.in_backward or n_parts > 1:
+                    self.optim.zero_grad()
+                    grads_dropped = True
+                self.in_backward = False
+                torch.cuda.empty_cache()
+
+                n_parts = min(n_parts * 2, batch.size)
+                self.oom_shapes.append((batch_shape(batch), n_parts))
+                print('| WARNING: ran out of memory on GPU, splitting the batch of %d sentences into %d parts'
+                      % (batch.size, n_parts))
+
+    def train_epoch(self, epoch, resume=False, batch_order=None, iteration=0, order_seed=None):
         
         opt = self.opt
         train_data = self.train_data
@@ -206,10 +394,15 @@ class XETrainer(BaseTrainer):
         self.model.zero_grad()
         self.model.reset_states()
 
-        if resume:
-            train_data.batch_order = batch_order
+        if resume and batch_order is not None:
+            train_data.restore_order(batch_order, seed=order_seed)
             train_data.set_index(iteration)
             print("Resuming from iteration: %d" % iteration)
+        elif self.world_size > 1:
+            # all processes need the same order (each one takes its shard of it)
+            with common_random_state(opt.seed + epoch):
+                batch_order = train_data.create_order()
+            iteration = 0
         else:
             batch_order = train_data.create_order()
             iteration = 0
@@ -220,22 +413,30 @@ class XETrainer(BaseTrainer):
         report_src_words = 0
         start = time.time()
         n_samples = len(train_data)
-        
+
         counter = 0
         num_accumulated_words = 0
         num_accumulated_sents = 0
+        # the words of the accumulated batches in all processes (to decide the updates)
+        num_update_words = 0
+        # the statistics of the accumulated batches: the loss stays on the device and is read once per update
+        # (to detect NaN / inf) before being added to the reported statistics
+        update_loss, update_src_words = 0, 0
         denom = 3584
-        nan = False
 
         if opt.streaming:
             streaming_state = self.model.init_stream()
         else:
             streaming_state = None
-        
-        for i in range(iteration, n_samples):
+
+        # the step i trains on the batch i + rank (the processes take the batches i ... i + world_size - 1)
+        steps = shard_steps(iteration, n_samples)
+        for step, i in enumerate(steps):
 
             curriculum = (epoch < opt.curriculum)
 
+            if self.world_size > 1:
+                train_data.set_index(i + self.rank)
             batches = [train_data.next(curriculum=curriculum)[0]]
 
             if(len(self.additional_data) > 0 and
@@ -254,113 +455,121 @@ class XETrainer(BaseTrainer):
                 batch = batches[b]
                 if self.cuda:
                     batch.cuda(fp16=self.opt.fp16)
-            
-                oom = False
-                try:
-                    # outputs is a dictionary containing keys/values necessary for loss function
-                    # can be flexibly controlled within models for easier extensibility
-                    targets = batch.get('target_output')
-                    tgt_mask = targets.data.ne(onmt.constants.PAD)
-                    outputs = self.model(batch, streaming=opt.streaming, target_mask=tgt_mask, zero_encoder=opt.zero_encoder,
-                                         mirror=opt.mirror_loss, streaming_state=streaming_state)
-
-                    batch_size = batch.size
-
-                    outputs['tgt_mask'] = tgt_mask
 
-                    loss_dict = self.loss_function(outputs, targets, model=self.model)
-                    loss_data = loss_dict['data']
-                    loss = loss_dict['loss'].div(denom)  # a little trick to avoid gradient overflow with fp16
-
-                    optimizer = self.optim.optimizer
-
-                    if self.cuda:
-                        with amp.scale_loss(loss, optimizer) as scaled_loss:
-                            scaled_loss.backward()
-                    else:
-                        loss.backward()
-
-                except RuntimeError as e:
-                    if 'out of memory' in str(e):
-                        print('| WARNING: ran out of memory on GPU , skipping batch')
-                        oom = True
-                        torch.cuda.empty_cache()
-                        loss = 0
-                    else:
-                        raise e
-
-                if loss != loss:
-                    # catching NAN problem
-                    oom = True
-                    self.model.zero_grad()
-                    self.optim.zero_grad()
+                # the sizes of the batch are known on the host: the update is decided before the backward pass
+                src_size, tgt_size, batch_size = batch.src_size, batch.tgt_size, batch.size
+                if self.world_size > 1 and opt.batch_size_update > 0:
+                    # the updates must be the same in all processes
+                    step_words = all_reduce_scalars([tgt_size])[0]
+                else:
+                    step_words = tgt_size
+
+                #   We only update the parameters after getting gradients from n mini-batches
+                update_flag = False
+                if 0 < opt.batch_size_update <= num_update_words + step_words:
+                    update_flag = True
+                elif counter + 1 >= opt.update_frequency and 0 >= opt.batch_size_update:
+                    update_flag = True
+                elif i == steps[-1]:  # update for the last minibatch
+                    update_flag = True
+
+                # the gradients of the processes are only all-reduced in the backward pass before an update
+                loss_data, grads_dropped = self.train_batch(batch, denom, sync=update_flag,
+                                                            streaming_state=streaming_state)
+
+                if grads_dropped:
+                    # the gradients of the previous batches were lost with the out of memory error
+                    counter = 0
                     num_accumulated_words = 0
                     num_accumulated_sents = 0
-                
-                if not oom:
-                    src_size = batch.src_size
-                    tgt_size = batch.tgt_size
-                
-                    counter = counter + 1
-                    num_accumulated_words += tgt_size
-                    num_accumulated_sents += batch_size
-
-                    #   We only update the parameters after getting gradients from n mini-batches
-                    update_flag = False
-                    if 0 < opt.batch_size_update <= num_accumulated_words:
-                        update_flag = True
-                    elif counter >= opt.update_frequency and 0 >= opt.batch_size_update:
-                        update_flag = True
-                    elif i == n_samples - 1:  # update for the last minibatch
-                        update_flag = True
-
-                    if update_flag:
-                        grad_denom = 1 / denom
+                    num_update_words = 0
+                    update_loss, update_src_words = 0, 0
+
+                counter = counter + 1
+                num_accumulated_words += tgt_size
+                num_accumulated_sents += batch_size
+                num_update_words += step_words
+                update_loss = update_loss + loss_data
+                update_src_words += src_size
+                total_tokens += batch.get('target_output').nelement()
+                total_non_pads += tgt_size
+
+                if update_flag:
+                    # deferred check of the losses since the last update (catching NAN problem)
+                    finite = math.isfinite(float(update_loss))
+                    grad_words = num_accumulated_words
+                    if self.world_size > 1:
+                        grad_words, n_not_finite = all_reduce_scalars([num_accumulated_words, not finite])
+                        finite = n_not_finite == 0
+
+                    if finite:
+                        # the gradients are averaged over the processes: the sum over the processes is restored
+                        grad_denom = 1 / denom / self.world_size
                         if self.opt.normalize_gradient:
-                            grad_denom = num_accumulated_words / denom
-                        normalize_gradients(amp.master_params(optimizer), grad_denom)
-                        # Update the parameters.
+                            grad_denom = grad_words / denom / self.world_size
+                        # Update the parameters (the gradients are normalized by grad_denom in the step)
                         self.optim.step(grad_denom=grad_denom)
-                        self.optim.zero_grad()
-                        self.model.zero_grad()
-                        counter = 0
-                        num_accumulated_words = 0
-                        num_accumulated_sents = 0
-                        num_updates = self.optim._step
-                        if opt.save_every > 0 and num_updates % opt.save_every == -1 % opt.save_every :
+                        if self.ema is not None and self.optim._step % opt.ema_update_interval == 0:
+                            self.ema.update()
+
+                        report_loss += update_loss
+                        report_tgt_words += num_accumulated_words
+                        report_src_words += update_src_words
+                        total_loss += update_loss
+                        total_words += num_accumulated_words
+                    elif is_master():
+                        print('| WARNING: non-finite loss, skipping the update of %d batches' % counter)
+
+                    # the optimizer holds all the parameters which receive gradients
+                    self.optim.zero_grad()
+                    counter = 0
+                    num_accumulated_words = 0
+                    num_accumulated_sents = 0
+                    num_update_words = 0
+                    update_loss, update_src_words = 0, 0
+                    num_updates = self.optim._step
+                    # the processes have the same model: only the first one validates and writes the checkpoints
+                    if finite and is_master():
+                        if opt.save_every > 0 and num_updates % opt.save_every == -1 % opt.save_every:
                             valid_loss = self.eval(self.valid_data)
                             valid_ppl = math.exp(min(valid_loss, 100))
                             print('Validation perplexity: %g' % valid_ppl)
-                        
+                            self.eval_ema(self.valid_data)
+
                             ep = float(epoch) - 1. + ((float(i) + 1.) / n_samples)
-                        
-                            self.save(ep, valid_ppl, batch_order=batch_order, iteration=i)
-
-                    num_words = tgt_size
-                    report_loss += loss_data
-                    report_tgt_words += num_words
-                    report_src_words += src_size
-                    total_loss += loss_data
-                    total_words += num_words
-                    total_tokens += batch.get('target_output').nelement()
-                    total_non_pads += batch.get('target_output').ne(onmt.constants.PAD).sum().item()
-                    optim = self.optim
-                    batch_efficiency = total_non_pads / total_tokens
-
-                    if b == 0 and (i == 0 or (i % opt.log_interval == -1 % opt.log_interval)):
+
+                            # the next step of the process 0 starts at the batch i + world_size
+                            self.save(ep, valid_ppl, batch_order=batch_order, iteration=i + self.world_size - 1)
+                        elif opt.valid_every > 0 and num_updates % opt.valid_every == -1 % opt.valid_every:
+                            self.validate_subset(num_updates)
+
+                optim = self.optim
+                batch_efficiency = total_non_pads / total_tokens
+
+                log_step = i // self.world_size
+                if b == 0 and (log_step == 0 or (log_step % opt.log_interval == -1 % opt.log_interval)):
+                    # the statistics are read from the device (and summed over the processes) only here
+                    report_loss, report_tgt_words, report_src_words = \
+                        all_reduce_scalars([report_loss, report_tgt_words, report_src_words])
+                    if is_master() and report_tgt_words > 0:
                         print(("Epoch %2d, %5d/%5d; ; ppl: %6.2f ; lr: %.7f ; num updates: %7d " +
+                               "; pad efficiency: %5.2f%% ; " +
                                "%5.0f src tok/s; %5.0f tgt tok/s; %s elapsed") %
                               (epoch, i+1, len(train_data),
                                math.exp(report_loss / report_tgt_words),
                                optim.getLearningRate(),
                                optim._step,
+                               batch_efficiency * 100,
                                report_src_words/(time.time()-start),
                                report_tgt_words/(time.time()-start),
                                str(datetime.timedelta(seconds=int(time.time() - self.start_time)))))
 
-                        report_loss, report_tgt_words = 0, 0
-                        report_src_words = 0
-                        start = time.time()
+                    report_loss, report_tgt_words = 0, 0
+                    report_src_words = 0
+                    start = time.time()
+
+        # the loss of the epoch over all processes
+        total_loss, total_words = all_reduce_scalars([total_loss, total_words])
 
         return total_loss / total_words
 
@@ -386,9 +595,11 @@ class XETrainer(BaseTrainer):
                 if 'batch_order' in checkpoint:
                     batch_order = checkpoint['batch_order']
                     iteration = checkpoint['iteration'] + 1
+                    order_seed = checkpoint.get('order_seed', None)
                 else:
                     batch_order = None
                     iteration = 0
+                    order_seed = None
                 opt.start_epoch = int(math.floor(float(checkpoint['epoch'] + 1)))
 
                 resume=True
@@ -401,23 +612,54 @@ class XETrainer(BaseTrainer):
             else:
                 batch_order = None
                 iteration = 0
+                order_seed = None
                 resume=False
                 self.init_additional_data()
 
+            ema_state = checkpoint.get('ema', None)
+
             del checkpoint['model']
             del checkpoint['optim']
             del checkpoint
         else:
             batch_order = None
             iteration = 0
+            order_seed = None
             print('Initializing model parameters')
             init_model_parameters(model, opt)
             resume=False
             self.init_additional_data()
+            ema_state = None
+
+        if self.world_size > 1:
+            # after the initialization: the parameters of the process 0 are sent to the other processes
+            self.train_model = wrap_model(self.model, opt)
+
+        # after wrap_model: the average starts from the same parameters in all processes
+        if opt.ema_decay > 0:
+            self.ema = ExponentialMovingAverage(self.model, opt.ema_decay,
+                                                device='cpu' if opt.ema_on_cpu else None)
+            if ema_state is not None:
+                self.ema.load_state_dict(ema_state)
+
+        if opt.valid_every > 0:
+            n_valid = len(self.valid_data)
+            if 0 < opt.valid_subset < n_valid:
+                # a fixed sample of the validation batches (the same at every intermediate validation)
+                generator = torch.Generator().manual_seed(opt.seed)
+                self.valid_subset = torch.randperm(n_valid, generator=generator)[:opt.valid_subset].sort()[0].tolist()
+            else:
+                self.valid_subset = list(range(n_valid))
 
-        valid_loss = self.eval(self.valid_data)
-        valid_ppl = math.exp(min(valid_loss, 100))
-        print('Validation perplexity: %g' % valid_ppl)
+            if opt.valid_async and is_master():
+                self.validator = BackgroundValidator(
+                    self.model, lambda model: self.eval_model(model, self.valid_data, batch_indices=self.valid_subset))
+
+        # only the first process validates the model
+        if is_master():
+            valid_loss = self.eval(self.valid_data)
+            valid_ppl = math.exp(min(valid_loss, 100))
+            print('Validation perplexity: %g' % valid_ppl)
         
         self.start_time = time.time()
         
@@ -427,20 +669,30 @@ class XETrainer(BaseTrainer):
             #  (1) train for one epoch on the training set
             train_loss = self.train_epoch(epoch, resume=resume,
                                                  batch_order=batch_order,
+                                                 order_seed=order_seed,
                                                  iteration=iteration)
             train_ppl = math.exp(min(train_loss, 100))
-            print('Train perplexity: %g' % train_ppl)
 
-            #  (2) evaluate on the validation set
-            valid_loss = self.eval(self.valid_data)
-            valid_ppl = math.exp(min(valid_loss, 100))
-            print('Validation perplexity: %g' % valid_ppl)
+            #  (2) evaluate on the validation set (only the first process)
+            if is_master():
+                print('Train perplexity: %g' % train_ppl)
 
-            self.save(epoch, valid_ppl)
+                valid_loss = self.eval(self.valid_data)
+                valid_ppl = math.exp(min(valid_loss, 100))
+                print('Validation perplexity: %g' % valid_ppl)
+                self.eval_ema(self.valid_data)
+
+                self.save(epoch, valid_ppl)
             batch_order = None
             iteration = None
             resume = False
 
+        # the last checkpoints are complete when the training returns
+        self.saver.wait()
+        self.ema_saver.wait()
+        if self.validator is not None:
+            self.validator.wait()
+
     def init_additional_data(self):
         self.additional_batch_order = []
         self.additional_data_iteration = []
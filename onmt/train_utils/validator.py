@@ -0,0 +1,68 @@
+import copy
+import threading
+import torch
+
+
+class BackgroundValidator(object):
+    """
+    Validates a snapshot of the model in a background thread while the training continues
+    The parameters and buffers of the model are copied (on the training stream) to a second model, which is
+    validated on its own CUDA stream: the kernels of the validation overlap with the ones of the training.
+    At most one validation runs at a time: a new validation first waits for the previous one.
+    """
+
+    def __init__(self, model, evaluate):
+        """
+        :param model: the trained model (the snapshot model is a copy of it)
+        :param evaluate: function(model) returning the validation loss (called in the background thread)
+        """
+        self.model = copy.deepcopy(model)
+        # apex replaces the forward function of the model by a closure over the original model
+        self.model.__dict__.pop('forward', None)
+        self.model.eval()
+        for p in self.model.parameters():
+            p.requires_grad_(False)
+            p.grad = None
+
+        self.evaluate = evaluate
+        self.stream = torch.cuda.Stream() if next(self.model.parameters()).is_cuda else None
+        self.thread = None
+        self.error = None
+
+    @torch.no_grad()
+    def start(self, model, callback):
+        """
+        Snapshot the model and validate the snapshot in the background
+        :param callback: function(loss) called with the validation loss (in the background thread)
+        """
+        self.wait()
+
+        for snapshot, tensor in zip(self.model.state_dict().values(), model.state_dict().values()):
+            snapshot.copy_(tensor)
+
+        if self.stream is not None:
+            self.stream.wait_stream(torch.cuda.current_stream())
+
+        self.thread = threading.Thread(target=self._run, args=(callback,))
+        self.thread.start()
+
+    def _run(self, callback):
+
+        try:
+            with torch.cuda.stream(self.stream):
+                self.model.reset_states()
+                callback(self.evaluate(self.model))
+        except Exception as e:
+            self.error = e
+
+    def wait(self):
+        """
+        Wait until the last validation is done (the errors of the background thread are raised here)
+        """
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('The background validation failed') from error
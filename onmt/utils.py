@@ -47,6 +47,94 @@ def checkpoint_paths(path, pattern=r'model_ppl_(\d+).(\d+)\_e(\d+).(\d+).pt'):
     return [os.path.join(path, x[1]) for x in entries]
 
 
+def checkpoint_epoch(path):
+    """
+    The epoch in the file name of a checkpoint (model_ppl_<ppl>_e<epoch>.pt), None if there is no epoch
+    """
+    m = re.search(r'_e(\d+\.\d+)\.pt$', path)
+
+    return float(m.group(1)) if m is not None else None
+
+
+def ema_weights(n, decay):
+    """
+    Normalized weights of n checkpoints ordered from the oldest to the most recent
+    (exponential moving average: each checkpoint weighs decay times the next one)
+    """
+    weights = [decay ** (n - 1 - i) for i in range(n)]
+    total = sum(weights)
+
+    return [w / total for w in weights]
+
+
+def average_checkpoints(paths, weights=None, method='mean', mmap=False, device='cpu'):
+    """
+    Average the models of the checkpoints directly on their state dicts (parameters and buffers)
+    The checkpoints are loaded one at a time and summed into an accumulator (at least in single precision),
+    the models are not built. The tensors which are not floating point are taken from the first checkpoint.
+    :param weights: weight of every checkpoint (mean only, default: uniform)
+    :param method: mean (weighted arithmetic mean) or gmean (geometric mean of the absolute values,
+                   with the signs of the first checkpoint)
+    :param mmap: memory-map the checkpoints: only the model tensors are read, not the optimizer states
+    :return: the averaged state dict and the first checkpoint (without its model and optimizer states)
+    """
+    if method not in ['mean', 'gmean']:
+        raise NotImplementedError
+
+    n_models = len(paths)
+    if weights is None:
+        weights = [1.0 / n_models] * n_models
+
+    first_checkpoint = None
+    average = dict()
+    dtypes = dict()
+
+    for path, weight in zip(paths, weights):
+        print("Loading model from %s ..." % path)
+        if mmap:
+            checkpoint = torch.load(path, map_location='cpu', mmap=True)
+        else:
+            checkpoint = torch.load(path, map_location=lambda storage, loc: storage)
+        state_dict = checkpoint.pop('model')
+        checkpoint.pop('optim', None)
+
+        if first_checkpoint is None:
+            first_checkpoint = checkpoint
+
+            for name, tensor in state_dict.items():
+                dtypes[name] = tensor.dtype
+                if not tensor.is_floating_point():
+                    average[name] = tensor.clone()
+                    continue
+
+                dtype = torch.promote_types(tensor.dtype, torch.float)
+                average[name] = tensor.to(device=device, dtype=dtype, copy=True)
+                if method == 'mean':
+                    average[name].mul_(weight)
+        else:
+            if state_dict.keys() != average.keys():
+                raise ValueError("The model of %s does not have the parameters of %s" % (path, paths[0]))
+
+            for name, total in average.items():
+                if not total.is_floating_point():
+                    continue
+
+                tensor = state_dict[name].to(device=device, dtype=total.dtype)
+                if method == 'mean':
+                    total.add_(tensor, alpha=weight)
+                else:
+                    total.mul_(tensor.abs())
+
+        del checkpoint, state_dict
+
+    for name, total in average.items():
+        if method == 'gmean' and total.is_floating_point():
+            total = total.sign() * total.abs().pow(1. / n_models)
+        average[name] = total.to(device='cpu', dtype=dtypes[name])
+
+    return average, first_checkpoint
+
+
 def normalize_gradients(parameters, denom=1.0):
     if isinstance(parameters, torch.Tensor):
         parameters = [parameters]
@@ -7,12 +7,27 @@ def make_parser(parser):
                         help='Path to the *-train.pt file from preprocess.py')
     parser.add_argument('-data_format', required=False, default='raw',
                         help='Default data format: raw')
+    parser.add_argument('-mmap_warmup', default='thread', choices=['none', 'thread', 'madvise', 'full'],
+                        help="""How the memory indexed data (-data_format mmem) is brought into memory:
+                        none (read on demand), thread (read the files in background threads),
+                        madvise (prefetch the data of the upcoming batches, see -prefetch_batches)
+                        or full (read the files before training). Default: thread""")
+    parser.add_argument('-bucket_shuffle', action='store_true',
+                        help="""Pack the training batches again every epoch, shuffling the sentences
+                        with the same length (the batches are different in every epoch with the same padding)""")
+    parser.add_argument('-prefetch_batches', type=int, default=8,
+                        help="""Number of upcoming batches to prefetch with -mmap_warmup madvise""")
     parser.add_argument('-additional_data', required=False, default='none',
                         help='Path to the *-train.pt file from preprocess.py for addtional data; sepeated by semi-colon')
     parser.add_argument('-additional_data_format', required=False, default='bin',
                         help='Default data format: raw')
     parser.add_argument('-data_ratio', required=False, default='1',
                         help='ratio how to use the data and additiona data  e.g. 1;2;2; default 1;1;1;1;...')
+    parser.add_argument('-sampling_temperature', type=float, default=0,
+                        help="""Mix the training corpora (-data and the memory indexed -additional_data) and the
+                        language pairs of multilingual data: every batch comes from one of them, sampled with the
+                        probability (n_i / n) ^ (1 / T). T = 1 follows the data sizes, larger T upsample the
+                        small datasets. Default: 0 (disabled)""")
     parser.add_argument('-patch_vocab_multiplier', type=int, default=1,
                         help='Pad vocab so that the size divides by this multiplier')
     parser.add_argument('-src_align_right', action="store_true",
@@ -45,6 +60,11 @@ def make_parser(parser):
                         help="""Use embeddings as learnable position encoding.""")
     parser.add_argument('-fix_norm_output_embedding', action='store_true',
                         help="""Normalize the output embedding""")
+    parser.add_argument('-adaptive_softmax_cutoffs', type=int, nargs='*', default=[],
+                        help="""Use an adaptive softmax output layer: the frequency ranks where
+                        the clusters of rarer target words start (e.g. 20000 60000)""")
+    parser.add_argument('-adaptive_softmax_div_value', type=float, default=4.0,
+                        help="""The hidden size is divided by this value for every cluster of the adaptive softmax""")
 
     parser.add_argument('-double_position', action='store_true',
                         help="""Using double position encodings (absolute and relative)""")
@@ -65,7 +85,10 @@ def make_parser(parser):
     parser.add_argument('-n_heads', type=int, default=8,
                         help='Number of heads for multi-head attention')
     parser.add_argument('-checkpointing', type=int, default=0,
-                        help='Number of checkpointed layers in the Transformer')
+                        help='Number of checkpointed layers in each stack of the Transformer (-1: all). '
+                             'Their activations are recomputed in the backward pass instead of being stored')
+    parser.add_argument('-checkpointing_interval', type=int, default=1,
+                        help='Checkpoint every k-th layer of the stacks, counted from the top (with -checkpointing)')
     parser.add_argument('-attn_dropout', type=float, default=0.1,
                         help='Dropout probability; applied on multi-head attention.')
     parser.add_argument('-emb_dropout', type=float, default=0.1,
@@ -131,6 +154,11 @@ def make_parser(parser):
                         help='Switchout algorithm')
     parser.add_argument('-label_smoothing', type=float, default=0.0,
                         help='Label smoothing value for loss functions.')
+    parser.add_argument('-fused_loss', action='store_true',
+                        help='Compute the output layer and the loss together on the non-padded tokens, in chunks, '
+                             'without storing the log probabilities of the whole batch')
+    parser.add_argument('-loss_chunk_size', type=int, default=1024,
+                        help='Number of tokens per chunk of the fused loss')
     parser.add_argument('-scheduled_sampling_rate', type=float, default=0.0,
                         help='Scheduled sampling rate.')
     parser.add_argument('-curriculum', type=int, default=-1,
@@ -190,6 +218,20 @@ def make_parser(parser):
     # GPU
     parser.add_argument('-gpus', default=[], nargs='+', type=int,
                         help="Use CUDA on the listed devices.")
+    parser.add_argument('-num_nodes', type=int, default=1,
+                        help="Number of nodes for distributed training (each one runs one process per GPU).")
+    parser.add_argument('-node_rank', type=int, default=0,
+                        help="Index of this node for distributed training.")
+    parser.add_argument('-dist_url', default='tcp://localhost:10000', type=str,
+                        help="Address of the node 0 for distributed training.")
+    parser.add_argument('-dist_backend', default='nccl', type=str,
+                        help="Backend of torch.distributed on GPU (the CPU workers use gloo).")
+    parser.add_argument('-cpu_workers', type=int, default=1,
+                        help="Number of CPU processes per node for distributed training without GPUs (gloo).")
+    parser.add_argument('-bucket_cap_mb', type=float, default=25,
+                        help="Size of the gradient buckets all-reduced during the backward pass (distributed).")
+    parser.add_argument('-find_unused_parameters', action='store_true',
+                        help="Allow parameters without gradient in the forward pass (distributed, slower).")
     parser.add_argument('-fp16', action='store_true',
                         help='Use half precision training')
     parser.add_argument('-fp16_loss_scale', type=float, default=8,
@@ -203,6 +245,23 @@ def make_parser(parser):
                         help="Save every this interval.")
     parser.add_argument('-keep_save_files', type=int, default=5,
                         help="Save every this interval.")
+    parser.add_argument('-valid_every', type=int, default=0,
+                        help="""Validate every this number of updates between the checkpoints (0: only at the
+                        checkpoints). The checkpoints are always validated on the full validation set.""")
+    parser.add_argument('-valid_subset', type=int, default=0,
+                        help="""Number of validation batches (a fixed sample) used by the -valid_every
+                        validations (0: all the batches).""")
+    parser.add_argument('-valid_async', action='store_true',
+                        help="""Run the -valid_every validations on a snapshot of the model in the background
+                        (on a separate CUDA stream) while the training continues.""")
+    parser.add_argument('-ema_decay', type=float, default=0.0,
+                        help="""Keep an exponential moving average of the parameters with this decay
+                        (0: no average). The average is validated with the parameters and written to
+                        <save_model>_ema.pt at every save.""")
+    parser.add_argument('-ema_update_interval', type=int, default=1,
+                        help="Update the moving average every this number of updates.")
+    parser.add_argument('-ema_on_cpu', action='store_true',
+                        help="Keep the moving average in CPU memory instead of the GPU memory.")
     parser.add_argument('-copy_generator', action='store_true',
                         help='Use the copy_generator')
 
@@ -214,12 +273,20 @@ def make_parser(parser):
                         help='Use fusion training with language model')
     parser.add_argument('-lm_seq_length', type=int, default=128,
                         help='Sequence length for the language model')
+    parser.add_argument('-lm_model', default='lstm',
+                        help='Language model architecture. [lstm|transformer]')
+    parser.add_argument('-lm_doc_mask', action='store_true',
+                        help="""Pack the sentences into blocks of -lm_seq_length tokens where the attention
+                        does not cross the sentence boundaries (and positions restart for each sentence).
+                        The blocks are then shuffled. Requires -lm_model transformer""")
 
     # for Speech
     parser.add_argument('-reshape_speech', type=int, default=0,
                         help="Reshaping the speech data (0 is ignored, done at preprocessing).")
     parser.add_argument('-augment_speech', action='store_true',
                         help='Use f/t augmentation for speech')
+    parser.add_argument('-augment_on_gpu', action='store_true',
+                        help='Apply the speech augmentation on the GPU (after the batch is sent to the GPU)')
     parser.add_argument('-upsampling', action='store_true',
                         help='In case the data is downsampled during preprocess. This option will upsample the samples again')
     parser.add_argument('-cnn_downsampling', action='store_true',
@@ -245,6 +312,9 @@ def backward_compatible(opt):
     if not hasattr(opt, 'residual_type'):
         opt.residual_type = 'regular'
 
+    if not hasattr(opt, 'lm_model'):
+        opt.lm_model = 'lstm'
+
     if not hasattr(opt, 'input_size'):
         opt.input_size = 40
 
@@ -302,6 +372,10 @@ def backward_compatible(opt):
     if not hasattr(opt, 'mirror_loss'):
         opt.mirror_loss = False
 
+    if not hasattr(opt, 'adaptive_softmax_cutoffs'):
+        opt.adaptive_softmax_cutoffs = []
+        opt.adaptive_softmax_div_value = 4.0
+
     if not hasattr(opt, 'max_memory_size'):
         opt.max_memory_size = 0
 
@@ -2,6 +2,10 @@ import onmt
 import onmt.markdown
 import argparse
 import torch
+import os
+import sys
+import time, datetime
+from onmt.Dict import np_types
 
 from onmt.data.indexed_dataset import IndexedDatasetBuilder
 
@@ -29,8 +33,10 @@ parser.add_argument('-previous_context', type=int, default=0,
                     help="Number of previous sentence for context")
 parser.add_argument('-input_type', default="word",
                     help="Input type: word/char")
-parser.add_argument('-data_type', default="int64",
-                    help="Input type for storing text (int64|int32|int|int16) to reduce memory load")
+parser.add_argument('-data_type', default="auto",
+                    help="Input type for storing text (auto|int64|int32|int|int16) to reduce memory load. "
+                         "auto uses the smallest type fitting the vocabulary (uint16 or int32) for the "
+                         "memory indexed format and int64 otherwise")
 parser.add_argument('-format', default="raw",
                     help="Save data format: binary or raw. Binary should be used to load faster")
 
@@ -100,35 +106,40 @@ parser.add_argument('-report_every', type=int, default=100000,
                     help="Report status every this many sentences")
 parser.add_argument('-reshape_speech', type=int, default=1,
                     help="Reshaping the speech segments here. Mostly for compatibility..")
+parser.add_argument('-num_threads', type=int, default=1,
+                    help="Number of worker processes for preprocessing")
+parser.add_argument('-chunk_size', type=int, default=10000,
+                    help="Number of lines sent to a worker at once")
+parser.add_argument('-verbose', action='store_true',
+                    help="Print out information (throughput of each stage) during preprocessing")
 
 opt = parser.parse_args()
 
 torch.manual_seed(opt.seed)
 
 
-def make_vocab(filenames, size, tokenizer):
+def make_vocab(filenames, size, tokenizer, num_workers=1):
     vocab = onmt.Dict([onmt.constants.PAD_WORD, onmt.constants.UNK_WORD,
                        onmt.constants.BOS_WORD, onmt.constants.EOS_WORD],
                       lower=opt.lower)
 
+    filenames = list(filenames)
     for filename in filenames:
         print("Reading file %s ... " % filename)
-        with open(filename) as f:
-            for sent in f.readlines():
 
-                tokens = tokenizer.tokenize(sent)
-                for token in tokens:
-                    vocab.add(token)
+    # the files are streamed in chunks, the counts are merged and only the top entries are kept
+    counter = onmt.Dict.count_files(filenames, tokenizer, num_workers=num_workers)
+    original_size = vocab.size() + len(counter)
+    vocab.add_counter(counter, size=size)
+    del counter
 
-    original_size = vocab.size()
-    vocab = vocab.prune(size)
     print('Created dictionary of size %d (pruned from %d)' %
           (vocab.size(), original_size))
 
     return vocab
 
 
-def init_vocab(name, data_files, vocab_file, vocab_size, tokenizer, join=False):
+def init_vocab(name, data_files, vocab_file, vocab_size, tokenizer, num_workers=1):
     vocab = None
     if vocab_file is not None:
         # If given, load existing word dictionary.
@@ -139,7 +150,7 @@ def init_vocab(name, data_files, vocab_file, vocab_size, tokenizer, join=False):
 
     if vocab is None:
         print('Building ' + name + ' vocabulary...')
-        gen_word_vocab = make_vocab(data_files, vocab_size, tokenizer)
+        gen_word_vocab = make_vocab(data_files, vocab_size, tokenizer, num_workers=num_workers)
 
         vocab = gen_word_vocab
 
@@ -152,169 +163,136 @@ def save_vocabulary(name, vocab, file):
     vocab.writeFile(file)
 
 
-def make_lm_data(tgt_file, tgt_dicts, max_tgt_length=1000, input_type='word', data_type='int32'):
-    tgt = []
-    sizes = []
-    count, ignored = 0, 0
-
-    print('Processing %s ...' % (tgt_file))
-    tgtf = open(tgt_file)
-
-    eos = torch.LongTensor(1).fill_(onmt.constants.EOS)
-    tensors = [eos]
-
-    # find the number of words in the sentence
-    while True:
-        tline = tgtf.readline()
-
-        # normal end of file
-        if tline == "": break
-        tline = tline.strip()
-        # source and/or target are empty
-        if tline == "":
-            print('WARNING: ignoring an empty line (' + str(count + 1) + ')')
-            continue
-
-        if input_type == 'word':
-            tgt_words = tline.split()
-        elif input_type == 'char':
-            tgt_words = split_line_by_char(tline)
-
-        tensor = tgt_dicts.convertToIdx(tgt_words,
-                                        onmt.constants.UNK_WORD,
-                                        None,
-                                        onmt.constants.EOS_WORD,
-                                        type=data_type)
-        # print(tensor.size())
-        tensors.append(tensor)
-
-        count = count + 1
-
-        if count % opt.report_every == 0:
-            print('... %d sentences prepared' % count)
-
-    tgtf.close()
-
-    # concatenate all tensors into one
-    tensor = torch.cat(tensors, dim=-1)
-
-    return tensor
-
-
-def make_translation_data(src_file, tgt_file, src_dicts, tgt_dicts, tokenizer,
-                          max_src_length=256, max_tgt_length=256,
-                          add_bos=True,
-                          data_type='int64'):
+def make_text_data(src_files, tgt_files, src_langs, tgt_langs, dicts, tokenizer, output_prefix,
+                   max_src_length=256, max_tgt_length=256, add_bos=True, lm=False):
     """
-    :param src_file: source text file (to be read)
-    :param tgt_file: target text file (to be read)
-    :param src_dicts: source vocabulary
-    :param tgt_dicts: target vocabulary
+    Binarize the text data with the preprocessing pipeline (read -> tokenize -> filter -> lookup -> write)
+    into the memory indexed files output_prefix.src/.tgt/.src_lang/.tgt_lang
+    :param src_files: source text files (None for language models)
+    :param tgt_files: target text files
+    :param src_langs: source language of each file
+    :param tgt_langs: target language of each file
+    :param dicts: vocabularies and language dictionary
+    :param tokenizer: tokenizer to tokenize sentence
+    :param output_prefix: prefix of the output files
     :param max_src_length: filter sentences longer than this
     :param max_tgt_length: filter sentences longer than this
     :param add_bos: add <bos> to the target part
-    :param tokenizer: tokenizer to tokenize sentence
-    :param data_type: data type for storage
-    :return:
+    :param lm: language model data (only the target side without <bos>)
+    :return: number of written sentences
     """
-    src, tgt = [], []
-    src_sizes = []
-    tgt_sizes = []
-    count, ignored = 0, 0
+    from onmt.data.preprocess_pipeline import Side, binarize_parallel
+    from onmt.data.mmap_indexed_dataset import MMapIndexedDatasetBuilder
 
-    print('Processing %s & %s ...' % (src_file, tgt_file))
-    srcf = open(src_file)
-    tgtf = open(tgt_file)
+    # the type of the language ids
+    dtype = text_data_type(len(dicts['langs']) if 'langs' in dicts else None)
 
-    while True:
-        sline = srcf.readline()
-        tline = tgtf.readline()
+    if lm:
+        sides = [Side('tgt', dicts['tgt'], eos_word=onmt.constants.EOS_WORD,
+                      dtype=text_data_type(dicts['tgt'].size()))]
+        # no language data for language models
+        file_groups = [([tgt_file], None, None) for tgt_file in tgt_files]
+    else:
+        assert len(src_files) == len(src_langs)
+        assert len(src_files) == len(tgt_files)
+        assert len(tgt_files) == len(tgt_langs)
+
+        tgt_bos_word = onmt.constants.BOS_WORD if add_bos else None
+        # For src text, we use BOS for possible reconstruction
+        sides = [Side('src', dicts['src'], max_length=max_src_length, trunc=opt.src_seq_length_trunc,
+                      dtype=text_data_type(dicts['src'].size())),
+                 Side('tgt', dicts['tgt'], bos_word=tgt_bos_word, eos_word=onmt.constants.EOS_WORD,
+                      max_length=max_tgt_length - 2, trunc=opt.tgt_seq_length_trunc,
+                      dtype=text_data_type(dicts['tgt'].size()))]
+        file_groups = [([src_file, tgt_file], dicts['langs'][src_lang], dicts['langs'][tgt_lang])
+                       for src_file, tgt_file, src_lang, tgt_lang in zip(src_files, tgt_files, src_langs, tgt_langs)]
+
+    print('Processing %s ...' % " & ".join(["|".join(files) for files in zip(*[g[0] for g in file_groups])]))
+    summary = binarize_parallel(file_groups, sides, tokenizer, output_prefix, dtype=dtype,
+                                num_workers=opt.num_threads, chunk_size=opt.chunk_size,
+                                write_langs=(not lm), verbose=opt.verbose)
+
+    # For single-file cases we only need to have 1 language per file which will be broadcasted
+    # (the pipeline writes one language per sentence in the multilingual case)
+    if len(file_groups) == 1 and not lm:
+        for key, lang in [('src_lang', file_groups[0][1]), ('tgt_lang', file_groups[0][2])]:
+            builder = MMapIndexedDatasetBuilder(output_prefix + ".%s.bin" % key, dtype=dtype)
+            builder.add_item(np.array([lang]))
+            builder.finalize(output_prefix + ".%s.idx" % key)
+
+    return summary['written']
+
+
+def text_data_type(vocab_size=None):
+    """
+    numpy type to store the indices of a vocabulary with this size
+    """
+    from onmt.data.mmap_indexed_dataset import best_fitting_dtype
 
-        # normal end of file
-        if sline == "" and tline == "":
-            break
+    if opt.data_type != 'auto':
+        return np_types[opt.data_type]
 
-        # source or target does not have same number of lines
-        if sline == "" or tline == "":
-            print('WARNING: src and tgt do not have the same # of sentences')
-            break
+    # the other formats are read back into int64 tensors
+    if opt.format in ['mmap', 'mmem']:
+        return best_fitting_dtype(vocab_size)
+    else:
+        return np.int64
 
-        sline = sline.strip()
-        tline = tline.strip()
 
-        # source and/or target are empty
-        if sline == "" or tline == "":
-            print('WARNING: ignoring an empty line (' + str(count + 1) + ')')
-            continue
+def load_text_data(prefix, long=False, split=True):
+    """
+    Read a memory indexed file back into a list of tensors (views of one flat tensor)
+    or into the flat tensor if split is False
+    """
+    from onmt.data.mmap_indexed_dataset import MMapIndexedDataset, data_file_path, index_file_path
 
-        # TODO: source tokenizer != target tokenizer (unlikely in practice)
-        src_words = tokenizer.tokenize(sline)
-        tgt_words = tokenizer.tokenize(tline)
+    index = MMapIndexedDataset.Index(index_file_path(prefix))
+    sizes = index.sizes.tolist()
+    data = torch.from_numpy(np.fromfile(data_file_path(prefix), dtype=index.dtype))
+    del index
 
-        if len(src_words) <= max_src_length \
-                and len(tgt_words) <= max_tgt_length - 2:
+    if long:
+        data = data.long()
 
-            # Check truncation condition.
-            if opt.src_seq_length_trunc != 0:
-                src_words = src_words[:opt.src_seq_length_trunc]
-            if opt.tgt_seq_length_trunc != 0:
-                tgt_words = tgt_words[:opt.tgt_seq_length_trunc]
+    return list(data.split(sizes)) if split else data
 
-            # For src text, we use BOS for possible reconstruction
-            src += [src_dicts.convertToIdx(src_words,
-                                           onmt.constants.UNK_WORD)]
-
-            if add_bos:
-                tgt += [tgt_dicts.convertToIdx(tgt_words,
-                                               onmt.constants.UNK_WORD,
-                                               onmt.constants.BOS_WORD,
-                                               onmt.constants.EOS_WORD, type=data_type)]
-            else:
-                tgt += [tgt_dicts.convertToIdx(tgt_words,
-                                               onmt.constants.UNK_WORD,
-                                               None,
-                                               onmt.constants.EOS_WORD, type=data_type)]
-            src_sizes += [len(src_words)]
-            tgt_sizes += [len(tgt_words)]
-        else:
-            ignored += 1
 
-        count += 1
+def remove_text_data(prefix):
+    from onmt.data.mmap_indexed_dataset import data_file_path, index_file_path
 
-        if count % opt.report_every == 0:
-            print('... %d sentences prepared' % count)
+    for set_ in ['src', 'tgt', 'src_lang', 'tgt_lang']:
+        for path in [data_file_path(prefix + "." + set_), index_file_path(prefix + "." + set_)]:
+            if os.path.exists(path):
+                os.remove(path)
 
-    srcf.close()
-    tgtf.close()
 
-    # don't sort anymore
-    # if opt.shuffle == 1:
-    #     print('... shuffling sentences')
-    #     perm = torch.randperm(len(src))
-    #     src = [src[idx] for idx in perm]
-    #     tgt = [tgt[idx] for idx in perm]
-    #     src_sizes = [src_sizes[idx] for idx in perm]
-    #     tgt_sizes = [tgt_sizes[idx] for idx in perm]
-    #
-    # print('... sorting sentences by size')
-    #
-    # z = zip(src, tgt, src_sizes, tgt_sizes)
-    #
-    # # ultimately sort by target size
-    # sorted_z = sorted(sorted(z, key=lambda x: x[2]), key=lambda x: x[3])
-    #
-    # src = [z_[0] for z_ in sorted_z]
-    # tgt = [z_[1] for z_ in sorted_z]
+def make_asr_data(src_file, tgt_file, tgt_dicts, max_src_length=64, max_tgt_length=64,
+                  input_type='word', stride=1, concat=1, prev_context=0, fp16=False, reshape=True, asr_format="h5",
+                  output_prefix=None, num_workers=1):
+    """
+    :param output_prefix: if given, the features and the targets are written into the memory indexed files
+    output_prefix.src/tgt.bin/idx by num_workers processes, without shuffling or sorting (done when training)
+    and None, None is returned
+    """
+    from onmt.data.audio_pipeline import FeatureReader, reshape_features, binarize_asr_parallel
+
+    if prev_context > 0:
+        print("Multiple ASR context isn't supported at the moment   ")
+        raise NotImplementedError
 
-    print(('Prepared %d sentences ' +
-           '(%d ignored due to length == 0 or src len > %d or tgt len > %d)') %
-          (len(src), ignored, max_src_length, max_tgt_length))
+    if not reshape:
+        concat = 1
 
-    return src, tgt
+    print('Processing %s & %s ...' % (src_file, tgt_file))
 
+    if output_prefix is not None:
+        binarize_asr_parallel(src_file, tgt_file, tgt_dicts, output_prefix, asr_format=asr_format,
+                              input_type=input_type, max_src_length=max_src_length, max_tgt_length=max_tgt_length,
+                              tgt_trunc=opt.tgt_seq_length_trunc, stride=stride, concat=concat, fp16=fp16,
+                              tgt_dtype=text_data_type(tgt_dicts.size()), num_workers=num_workers,
+                              verbose=opt.verbose)
+        return None, None
 
-def make_asr_data(src_file, tgt_file, tgt_dicts, max_src_length=64, max_tgt_length=64,
-                  input_type='word', stride=1, concat=1, prev_context=0, fp16=False, reshape=True, asr_format="h5"):
     src, tgt = [], []
     # sizes = []
     src_sizes = []
@@ -322,109 +300,45 @@ def make_asr_data(src_file, tgt_file, tgt_dicts, max_src_length=64, max_tgt_leng
     count, ignored = 0, 0
     n_unk_words = 0
 
-    print('Processing %s & %s ...' % (src_file, tgt_file))
-
-    if asr_format == "h5":
-        file_idx = -1
-        if src_file[-2:] == "h5":
-            srcf = h5.File(src_file, 'r')
-        else:
-            file_idx = 0
-            srcf = h5.File(src_file + "." + str(file_idx) + ".h5", 'r')
-    elif asr_format in ["scp", "kaldi"]:
-        import kaldiio
-        from kaldiio import ReadHelper
-        audio_data = iter(ReadHelper('scp:' + src_file))
+    reader = FeatureReader(src_file, asr_format=asr_format)
+    tokenizer = onmt.Tokenizer(input_type)
 
     tgtf = open(tgt_file)
 
     index = 0
 
-    s_prev_context = []
-    t_prev_context = []
-
     while True:
         tline = tgtf.readline()
         # normal end of file
         if tline == "":
             break
 
-        if asr_format == "h5":
-            if str(index) in srcf:
-                feature_vectors = np.array(srcf[str(index)])
-            elif file_idx != -1:
-                srcf.close()
-                file_idx += 1
-                srcf = h5.File(src_file + "." + str(file_idx) + ".h5", 'r')
-                feature_vectors = np.array(srcf[str(index)])
-            else:
-                print("No feature vector for index:", index, file=sys.stderr)
-                exit(-1)
-        elif asr_format in ["scp", "kaldi"]:
-            _, feature_vectors = next(audio_data)
-        else:
-            raise NotImplementedError
-
-        if stride == 1:
-            sline = torch.from_numpy(feature_vectors)
-        else:
-            sline = torch.from_numpy(feature_vectors[0::opt.stride])
-
-        if reshape:
-            if concat != 1:
-                # the number of frames added to make the length divisible by 4
-                add = (concat - sline.size()[0] % concat) % concat
-
-                # create the additional zero frames
-                z = torch.FloatTensor(add, sline.size()[1]).zero_()
+        feature_vectors = reader[index]
+        index += 1
 
-                # added to the original tensor (sline)
-                sline = torch.cat((sline, z), 0)
+        # stride, concat and the type conversion are done in numpy (one copy)
+        sline = torch.from_numpy(reshape_features(feature_vectors, stride=stride, concat=concat,
+                                                  dtype=np.float16 if fp16 else np.float32))
 
-                # reshape: every $concat frames into one
-                sline = sline.reshape((int(sline.size()[0] / concat), sline.size()[1] * concat))
-        index += 1;
-
-        tline = tline.strip()
-
-        if prev_context > 0:
-            print("Multiple ASR context isn't supported at the moment   ")
-            raise NotImplementedError
-
-            # s_prev_context.append(sline)
-            # t_prev_context.append(tline)
-            # for i in range(1,prev_context+1):
-            #     if i < len(s_prev_context):
-            #         sline = torch.cat((torch.cat((s_prev_context[-i-1],torch.zeros(1,sline.size()[1]))),sline))
-            #         tline = t_prev_context[-i-1]+" # "+tline
-            # if len(s_prev_context) > prev_context:
-            #     s_prev_context = s_prev_context[-1*prev_context:]
-            #     t_prev_context = t_prev_context[-1*prev_context:]
+        tgt_words = tokenizer.tokenize(tline)
 
         # source and/or target are empty
-        if tline == "":
+        if len(tgt_words) == 0:
             print('WARNING: ignoring an empty line (' + str(count + 1) + ')')
             continue
 
-        if input_type == 'word':
-            tgt_words = tline.split()
-        elif input_type == 'char':
-            tgt_words = split_line_by_char(tline)
-
         if len(tgt_words) <= max_tgt_length - 2 and sline.size(0) <= max_src_length:
 
             # Check truncation condition.
             if opt.tgt_seq_length_trunc != 0:
                 tgt_words = tgt_words[:opt.tgt_seq_length_trunc]
 
-            if fp16:
-                sline = sline.half()
-            src += [sline]
-
             tgt_tensor = tgt_dicts.convertToIdx(tgt_words,
                                                 onmt.constants.UNK_WORD,
                                                 onmt.constants.BOS_WORD,
                                                 onmt.constants.EOS_WORD)
+
+            src += [sline]
             tgt += [tgt_tensor]
             src_sizes += [len(sline)]
             tgt_sizes += [len(tgt_words)]
@@ -432,10 +346,6 @@ def make_asr_data(src_file, tgt_file, tgt_dicts, max_src_length=64, max_tgt_leng
             unks = tgt_tensor.eq(onmt.constants.UNK).sum().item()
             n_unk_words += unks
 
-            # if unks > 0:
-            #     if "<unk>" not in tline:
-            #         print("DEBUGGING: This line contains UNK: %s" % tline)
-
         else:
             ignored += 1
 
@@ -444,8 +354,7 @@ def make_asr_data(src_file, tgt_file, tgt_dicts, max_src_length=64, max_tgt_leng
         if count % opt.report_every == 0:
             print('... %d sentences prepared' % count)
 
-    if asr_format == "h5":
-        srcf.close()
+    reader.close()
     tgtf.close()
 
     print('Total number of unk words: %d' % n_unk_words)
@@ -500,34 +409,29 @@ def main():
     # for ASR and LM we only need to build vocab for the 'target' language
     if opt.asr or opt.lm:
         dicts['tgt'] = init_vocab('target', tgt_train_files, opt.tgt_vocab,
-                                  opt.tgt_vocab_size, tokenizer)
+                                  opt.tgt_vocab_size, tokenizer, num_workers=opt.num_threads)
     elif opt.join_vocab:
         dicts['src'] = init_vocab('source', set(src_train_files + tgt_train_files), opt.src_vocab,
-                                  opt.tgt_vocab_size, tokenizer)
+                                  opt.tgt_vocab_size, tokenizer, num_workers=opt.num_threads)
         dicts['tgt'] = dicts['src']
 
     # Translation model
     else:
         dicts['src'] = init_vocab('source', src_train_files, opt.src_vocab,
-                                  opt.src_vocab_size, tokenizer)
+                                  opt.src_vocab_size, tokenizer, num_workers=opt.num_threads)
 
         dicts['tgt'] = init_vocab('target', tgt_train_files, opt.tgt_vocab,
-                                  opt.tgt_vocab_size, tokenizer)
+                                  opt.tgt_vocab_size, tokenizer, num_workers=opt.num_threads)
 
-    if opt.lm:
-        print('Preparing training language model ...')
-        train = dict()
-        train['tgt'] = make_lm_data(opt.train_tgt,
-                                    dicts['tgt'])
-        train['src'] = None
+    if opt.asr:
+        print('Preparing training acoustic model ...')
 
-        valid = dict()
-        valid['tgt'] = make_lm_data(opt.valid_tgt,
-                                    dicts['tgt'])
-        valid['src'] = None
+        # the memory indexed files are written while reading the features (they are not kept in memory)
+        if opt.format in ['mmap', 'mmem']:
+            train_prefix, valid_prefix = opt.save_data + '.train', opt.save_data + '.valid'
+        else:
+            train_prefix, valid_prefix = None, None
 
-    elif opt.asr:
-        print('Preparing training acoustic model ...')
         train = dict()
         train['src'], train['tgt'] = make_asr_data(opt.train_src, opt.train_tgt,
                                                    dicts['tgt'],
@@ -537,7 +441,8 @@ def main():
                                                    stride=opt.stride, concat=opt.concat,
                                                    prev_context=opt.previous_context,
                                                    fp16=opt.fp16, reshape=(opt.reshape_speech == 1),
-                                                   asr_format=opt.asr_format)
+                                                   asr_format=opt.asr_format, output_prefix=train_prefix,
+                                                   num_workers=opt.num_threads)
 
         print('Preparing validation ...')
         valid = dict()
@@ -549,96 +454,63 @@ def main():
                                                    stride=opt.stride, concat=opt.concat,
                                                    prev_context=opt.previous_context,
                                                    fp16=opt.fp16, reshape=(opt.reshape_speech == 1),
-                                                   asr_format=opt.asr_format)
-
-    else:
-        print('Preparing training translation model...')
+                                                   asr_format=opt.asr_format, output_prefix=valid_prefix,
+                                                   num_workers=opt.num_threads)
 
-        src_input_files = opt.train_src.split("|")
-        tgt_input_files = opt.train_tgt.split("|")
+        if opt.format in ['mmap', 'mmem']:
+            train, valid = None, None
 
-        src_langs = opt.train_src_lang.split("|")
-        tgt_langs = opt.train_tgt_lang.split("|")
+    else:
+        if opt.lm:
+            print('Preparing training language model ...')
+        else:
+            print('Preparing training translation model...')
 
-        assert len(src_input_files) == len(src_langs)
-        assert len(src_input_files) == len(tgt_input_files)
-        assert len(tgt_input_files) == len(tgt_langs)
+        start = time.time()
 
-        n_input_files = len(src_input_files)
+        # the memory indexed files are written directly,
+        # for the other formats they are temporary files which are read back into tensors
+        if opt.format in ['mmap', 'mmem']:
+            train_prefix, valid_prefix = opt.save_data + '.train', opt.save_data + '.valid'
+        else:
+            train_prefix, valid_prefix = opt.save_data + '.tmp.train', opt.save_data + '.tmp.valid'
 
-        train = dict()
-        train['src'], train['tgt'] = list(), list()
-        train['src_lang'], train['tgt_lang'] = list(), list()
-
-        for (src_file, tgt_file, src_lang, tgt_lang) in zip(src_input_files, tgt_input_files, src_langs, tgt_langs):
-
-            src_data, tgt_data = make_translation_data(src_file, tgt_file,
-                                                       dicts['src'], dicts['tgt'],
-                                                       tokenizer,
-                                                       max_src_length=opt.src_seq_length,
-                                                       max_tgt_length=opt.tgt_seq_length,
-                                                       add_bos=(not opt.no_bos),
-                                                       data_type=opt.data_type)
-
-            n_samples = len(src_data)
-            if n_input_files == 1:
-                # For single-file cases we only need to have 1 language per file
-                # which will be broadcasted
-                src_lang_data = [torch.Tensor([dicts['langs'][src_lang]])]
-                tgt_lang_data = [torch.Tensor([dicts['langs'][tgt_lang]])]
-            else:
-                # each sample will have a different language id
-                src_lang_data = [torch.Tensor([dicts['langs'][src_lang]]) for _ in range(n_samples)]
-                tgt_lang_data = [torch.Tensor([dicts['langs'][tgt_lang]]) for _ in range(n_samples)]
-
-            train['src'] += src_data
-            train['tgt'] += tgt_data
-            train['src_lang'] += src_lang_data
-            train['tgt_lang'] += tgt_lang_data
+        make_text_data(src_train_files if not opt.lm else None, tgt_train_files,
+                       opt.train_src_lang.split("|"), opt.train_tgt_lang.split("|"),
+                       dicts, tokenizer, train_prefix,
+                       max_src_length=opt.src_seq_length,
+                       max_tgt_length=opt.tgt_seq_length,
+                       add_bos=(not opt.no_bos), lm=opt.lm)
 
         print('Preparing validation ...')
 
-        src_input_files = opt.valid_src.split("|")
-        tgt_input_files = opt.valid_tgt.split("|")
-
-        src_langs = opt.valid_src_lang.split("|")
-        tgt_langs = opt.valid_tgt_lang.split("|")
+        make_text_data(opt.valid_src.split("|") if not opt.lm else None, opt.valid_tgt.split("|"),
+                       opt.valid_src_lang.split("|"), opt.valid_tgt_lang.split("|"),
+                       dicts, tokenizer, valid_prefix,
+                       max_src_length=max(1024, opt.src_seq_length),
+                       max_tgt_length=max(1024, opt.tgt_seq_length),
+                       add_bos=(not opt.no_bos), lm=opt.lm)
 
-        assert len(src_input_files) == len(src_langs)
-        assert len(src_input_files) == len(tgt_input_files)
-        assert len(tgt_input_files) == len(tgt_langs)
+        elapse = str(datetime.timedelta(seconds=int(time.time() - start)))
+        print("Binarization finished after %s" % elapse)
 
-        n_input_files = len(src_input_files)
-
-        valid = dict()
-        valid['src'], valid['tgt'] = list(), list()
-        valid['src_lang'], valid['tgt_lang'] = list(), list()
-
-        for (src_file, tgt_file, src_lang, tgt_lang) in zip(src_input_files, tgt_input_files, src_langs, tgt_langs):
-
-            src_data, tgt_data = make_translation_data(src_file, tgt_file,
-                                                       dicts['src'], dicts['tgt'],
-                                                       tokenizer,
-                                                       max_src_length=max(1024, opt.src_seq_length),
-                                                       max_tgt_length=max(1024, opt.tgt_seq_length),
-                                                       add_bos=(not opt.no_bos),
-                                                       data_type=opt.data_type)
-
-            n_samples = len(src_data)
-            if n_input_files == 1:
-                # For single-file cases we only need to have 1 language per file
-                # which will be broadcasted
-                src_lang_data = [torch.Tensor([dicts['langs'][src_lang]])]
-                tgt_lang_data = [torch.Tensor([dicts['langs'][tgt_lang]])]
-            else:
-                # each sample will have a different language id
-                src_lang_data = [torch.Tensor([dicts['langs'][src_lang]]) for _ in range(n_samples)]
-                tgt_lang_data = [torch.Tensor([dicts['langs'][tgt_lang]]) for _ in range(n_samples)]
-
-            valid['src'] += src_data
-            valid['tgt'] += tgt_data
-            valid['src_lang'] += src_lang_data
-            valid['tgt_lang'] += tgt_lang_data
+        if opt.format in ['mmap', 'mmem']:
+            # the data files are already written by the pipeline
+            train, valid = None, None
+        else:
+            train, valid = dict(), dict()
+            for data, prefix in [(train, train_prefix), (valid, valid_prefix)]:
+                if opt.lm:
+                    # language model data is one stream starting with </s>
+                    eos = torch.LongTensor(1).fill_(onmt.constants.EOS)
+                    data['tgt'] = torch.cat([eos, load_text_data(prefix + '.tgt', long=True, split=False)])
+                    data['src'] = None
+                else:
+                    data['src'] = load_text_data(prefix + '.src', long=True)
+                    data['tgt'] = load_text_data(prefix + '.tgt')
+                    data['src_lang'] = [t.float() for t in load_text_data(prefix + '.src_lang')]
+                    data['tgt_lang'] = [t.float() for t in load_text_data(prefix + '.tgt_lang')]
+                remove_text_data(prefix)
 
     if opt.src_vocab is None and opt.asr == False and opt.lm == False:
         save_vocabulary('source', dicts['src'], opt.save_data + '.src.dict')
@@ -657,53 +529,11 @@ def main():
 
     elif opt.format in ['mmap', 'mmem']:
         print('Saving data to memory indexed data files')
-        from onmt.data.mmap_indexed_dataset import MMapIndexedDatasetBuilder
-
-        if opt.asr:
-            print("ASR data format isn't compatible with memory indexed format")
-            raise AssertionError
-
         # save dicts in this format
         torch.save(dicts, opt.save_data + '.dict.pt')
 
-        # binarize the training set first
-        for set_ in ['src', 'tgt', 'src_lang', 'tgt_lang']:
-            if train[set_] is None:
-                continue
-
-            if opt.data_type == 'int64':
-                dtype = np.int64
-            else:
-                dtype = np.int32
-
-            if set_ == 'src' and opt.asr:
-                dtype = np.double
-
-            train_data = MMapIndexedDatasetBuilder(opt.save_data + ".train.%s.bin" % set_, dtype=dtype)
-
-            # add item from training data to the indexed data
-            for tensor in train[set_]:
-                train_data.add_item(tensor)
-
-            train_data.finalize(opt.save_data + ".train.%s.idx" % set_)
-
-            del train_data
-
-            if valid[set_] is None:
-                continue
-
-            if set_ == 'src' and opt.asr:
-                dtype = np.double
-
-            valid_data = MMapIndexedDatasetBuilder(opt.save_data + ".valid.%s.bin" % set_, dtype=dtype)
-
-            # add item from training data to the indexed data
-            for tensor in valid[set_]:
-                valid_data.add_item(tensor)
-
-            valid_data.finalize(opt.save_data + ".valid.%s.idx" % set_)
-
-            del valid_data
+        # the text and audio data have been written into the memory indexed files while processing
+        assert train is None and valid is None
 
     else:
         raise NotImplementedError
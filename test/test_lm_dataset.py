@@ -0,0 +1,52 @@
+import argparse
+import unittest
+
+import torch
+
+import onmt
+from onmt.data.dataset import LanguageModelDataset
+from onmt.model_factory import build_language_model
+from options import make_parser
+
+
+class TestLanguageModelDataset(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.vocab_size = 20
+        # 10 blocks of 8 tokens in 4 batches: the rows do not divide evenly over the batches
+        self.stream = torch.randint(4, self.vocab_size, (10 * 8 + 1,))
+        self.dataset = LanguageModelDataset(self.stream, batch_size_sents=3, seq_length=8)
+
+    def test_batches_have_the_same_width(self):
+        dataset = self.dataset
+        self.assertEqual(dataset.num_blocks % dataset.num_batches, 2)
+
+        widths = [dataset[i].get('target_input').size(1) for i in range(len(dataset))]
+        self.assertEqual(widths, [dataset.rows_per_batch] * len(dataset))
+
+        # every token of the stream is predicted once, the padding rows have no targets
+        n_targets = sum(dataset[i].get('target_output').ne(onmt.constants.PAD).sum().item()
+                        for i in range(len(dataset)))
+        self.assertEqual(n_targets, self.stream.size(0) - 1)
+
+    def test_lstm_carries_the_state_over_ragged_blocks(self):
+        parser = make_parser(argparse.ArgumentParser())
+        opt = parser.parse_args(['-data', 'none', '-lm_model', 'lstm', '-layers', '1', '-model_size', '16'])
+        dicts = {'tgt': onmt.Dict([onmt.constants.PAD_WORD, onmt.constants.UNK_WORD,
+                                   onmt.constants.BOS_WORD, onmt.constants.EOS_WORD] +
+                                  ['w%d' % i for i in range(self.vocab_size - 4)])}
+        model = build_language_model(opt, dicts)
+        model.reset_states()
+
+        dataset = self.dataset
+        dataset.create_order(random=False)
+        for _ in range(len(dataset)):
+            batch = dataset.next()[0]
+            output = model(batch)
+            self.assertEqual(output['hidden'].size(1), dataset.rows_per_batch)
+            self.assertFalse(torch.isnan(output['hidden']).any())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,6 +11,7 @@ from onmt.modules.loss import NMTLossFunc, NMTAndCTCLossFunc
 from onmt.model_factory import build_model, optimize_model
 from options import make_parser
 from collections import defaultdict
+import numpy as np
 import os
 
 parser = argparse.ArgumentParser(description='train.py')
@@ -28,16 +29,62 @@ onmt.constants.weight_norm = opt.weight_norm
 onmt.constants.checkpointing = opt.checkpointing
 onmt.constants.max_position_length = opt.max_position_length
 
-# Use static dropout if checkpointing > 0
-if opt.checkpointing > 0:
-    onmt.constants.static = True
-
 if torch.cuda.is_available() and not opt.gpus:
     print("WARNING: You have a CUDA device, should run with -gpus 0")
 
+# the batches are only sent to the GPU when training on GPU
+if not opt.gpus:
+    opt.augment_on_gpu = False
+
 torch.manual_seed(opt.seed)
 
 
+def build_multi_dataset(opt, dicts, train_src, train_tgt, train_src_langs, train_tgt_langs):
+    """
+    Mix the memory indexed training corpora (-data and -additional_data) with temperature sampling.
+    Multilingual corpora are split into one dataset per language pair.
+    """
+    from onmt.data.mmap_indexed_dataset import MMapIndexedDataset
+    from onmt.data.multi_dataset import MultiDataset, split_language_pairs
+
+    corpora = [(opt.data, train_src, train_tgt, train_src_langs, train_tgt_langs)]
+    if opt.additional_data != "none":
+        # the additional corpora must be preprocessed with the same dictionaries
+        for prefix in opt.additional_data.split(";"):
+            train_path = prefix + '.train'
+            src = MMapIndexedDataset(train_path + '.src', warmup=opt.mmap_warmup)
+            tgt = MMapIndexedDataset(train_path + '.tgt', warmup=opt.mmap_warmup)
+            if os.path.exists(train_path + '.src_lang.bin'):
+                src_langs = MMapIndexedDataset(train_path + '.src_lang', warmup=opt.mmap_warmup)
+                tgt_langs = MMapIndexedDataset(train_path + '.tgt_lang', warmup=opt.mmap_warmup)
+            else:
+                src_langs = [torch.Tensor([dicts['langs']['src']])]
+                tgt_langs = [torch.Tensor([dicts['langs']['tgt']])]
+            corpora.append((prefix, src, tgt, src_langs, tgt_langs))
+
+    lang_names = {lang_id: lang for lang, lang_id in dicts['langs'].items()}
+
+    datasets, names = list(), list()
+    for prefix, src, tgt, src_langs, tgt_langs in corpora:
+        if len(src_langs) > 1:
+            groups = [("%s %s-%s" % (prefix, lang_names.get(src_lang, src_lang), lang_names.get(tgt_lang, tgt_lang)),
+                       indices) for (src_lang, tgt_lang), indices in split_language_pairs(src_langs, tgt_langs)]
+        else:
+            groups = [(prefix, None)]
+
+        for name, indices in groups:
+            datasets.append(onmt.Dataset(src, tgt, src_langs, tgt_langs,
+                                         batch_size_words=opt.batch_size_words,
+                                         data_type="text", sorting=True,
+                                         batch_size_sents=opt.batch_size_sents,
+                                         multiplier=opt.batch_size_multiplier,
+                                         src_align_right=opt.src_align_right,
+                                         subset=indices))
+            names.append(name)
+
+    return MultiDataset(datasets, temperature=opt.sampling_temperature, names=names)
+
+
 def main():
     if opt.data_format in ['bin', 'raw']:
         start = time.time()
@@ -79,7 +126,9 @@ def main():
                                       batch_size_sents=opt.batch_size_sents,
                                       multiplier=opt.batch_size_multiplier,
                                       augment=opt.augment_speech,
-                                      upsampling=opt.upsampling)
+                                      augment_on_gpu=opt.augment_on_gpu,
+                                      upsampling=opt.upsampling,
+                                      bucket_shuffle=opt.bucket_shuffle)
         else:
             train_data = onmt.StreamDataset(train_dict['src'], train_dict['tgt'],
                                             train_src_langs, train_tgt_langs,
@@ -135,14 +184,17 @@ def main():
             print(dicts['langs'])
 
         train_path = opt.data + '.train'
-        train_src = MMapIndexedDataset(train_path + '.src')
-        train_tgt = MMapIndexedDataset(train_path + '.tgt')
+        train_src = MMapIndexedDataset(train_path + '.src', warmup=opt.mmap_warmup)
+        train_tgt = MMapIndexedDataset(train_path + '.tgt', warmup=opt.mmap_warmup)
+
+        # the audio features are stored as floats (frames x feature size), the text as indices
+        data_type = "audio" if np.issubdtype(train_src.dtype, np.floating) else "text"
 
         # check the lang files if they exist (in the case of multi-lingual models)
         if os.path.exists(train_path + '.src_lang.bin'):
             assert 'langs' in dicts
-            train_src_langs = MMapIndexedDataset(train_path + '.src_lang')
-            train_tgt_langs = MMapIndexedDataset(train_path + '.tgt_lang')
+            train_src_langs = MMapIndexedDataset(train_path + '.src_lang', warmup=opt.mmap_warmup)
+            train_tgt_langs = MMapIndexedDataset(train_path + '.tgt_lang', warmup=opt.mmap_warmup)
         else:
             train_src_langs = list()
             train_tgt_langs = list()
@@ -150,32 +202,41 @@ def main():
             train_src_langs.append(torch.Tensor([dicts['langs']['src']]))
             train_tgt_langs.append(torch.Tensor([dicts['langs']['tgt']]))
 
-        if not opt.streaming:
+        if opt.sampling_temperature > 0 and not opt.streaming:
+            train_data = build_multi_dataset(opt, dicts, train_src, train_tgt, train_src_langs, train_tgt_langs)
+        elif not opt.streaming:
             train_data = onmt.Dataset(train_src,
                                       train_tgt,
                                       train_src_langs, train_tgt_langs,
                                       batch_size_words=opt.batch_size_words,
-                                      data_type="text", sorting=True,
+                                      data_type=data_type, sorting=True,
                                       batch_size_sents=opt.batch_size_sents,
                                       multiplier=opt.batch_size_multiplier,
-                                      src_align_right=opt.src_align_right)
+                                      augment=opt.augment_speech,
+                                      augment_on_gpu=opt.augment_on_gpu,
+                                      upsampling=opt.upsampling,
+                                      src_align_right=opt.src_align_right,
+                                      prefetch_batches=opt.prefetch_batches,
+                                      bucket_shuffle=opt.bucket_shuffle)
         else:
             train_data = onmt.StreamDataset(train_src,
                                             train_tgt,
                                             train_src_langs, train_tgt_langs,
                                             batch_size_words=opt.batch_size_words,
-                                            data_type="text", sorting=True,
+                                            data_type=data_type, sorting=True,
                                             batch_size_sents=opt.batch_size_sents,
-                                            multiplier=opt.batch_size_multiplier)
+                                            multiplier=opt.batch_size_multiplier,
+                                            augment=opt.augment_speech,
+                                            upsampling=opt.upsampling)
 
         valid_path = opt.data + '.valid'
-        valid_src = MMapIndexedDataset(valid_path + '.src')
-        valid_tgt = MMapIndexedDataset(valid_path + '.tgt')
+        valid_src = MMapIndexedDataset(valid_path + '.src', warmup=opt.mmap_warmup)
+        valid_tgt = MMapIndexedDataset(valid_path + '.tgt', warmup=opt.mmap_warmup)
 
         if os.path.exists(valid_path + '.src_lang.bin'):
             assert 'langs' in dicts
-            valid_src_langs = MMapIndexedDataset(valid_path + '.src_lang')
-            valid_tgt_langs = MMapIndexedDataset(valid_path + '.tgt_lang')
+            valid_src_langs = MMapIndexedDataset(valid_path + '.src_lang', warmup=opt.mmap_warmup)
+            valid_tgt_langs = MMapIndexedDataset(valid_path + '.tgt_lang', warmup=opt.mmap_warmup)
         else:
             valid_src_langs = list()
             valid_tgt_langs = list()
@@ -188,15 +249,17 @@ def main():
             valid_data = onmt.Dataset(valid_src, valid_tgt,
                                       valid_src_langs, valid_tgt_langs,
                                       batch_size_words=opt.batch_size_words,
-                                      data_type="text", sorting=True,
+                                      data_type=data_type, sorting=True,
                                       batch_size_sents=opt.batch_size_sents,
+                                      upsampling=opt.upsampling,
                                       src_align_right=opt.src_align_right)
         else:
             valid_data = onmt.StreamDataset(valid_src, valid_tgt,
                                             valid_src_langs, valid_tgt_langs,
                                             batch_size_words=opt.batch_size_words,
-                                            data_type="text", sorting=True,
-                                            batch_size_sents=opt.batch_size_sents)
+                                            data_type=data_type, sorting=True,
+                                            batch_size_sents=opt.batch_size_sents,
+                                            upsampling=opt.upsampling)
 
         elapse = str(datetime.timedelta(seconds=int(time.time() - start)))
         print("Done after %s" % elapse)
@@ -256,10 +319,25 @@ def main():
               (dicts['tgt'].size()))
 
     print(' * number of sentences in training data: %d' % train_data.size())
+    if not opt.streaming:
+        print(' * padding efficiency of the training batches: %.2f%%' % (100 * train_data.packing_efficiency()))
     print(' * number of sentences in validation data: %d' % valid_data.size())
 
     print('* Building model...')
 
+    if opt.fused_loss and (opt.fusion or opt.ctc_loss != 0 or opt.mirror_loss or opt.copy_generator):
+        raise NotImplementedError("The fused loss is not supported with fusion models, the CTC loss, "
+                                  "the mirror loss or the copy generator")
+
+    if opt.valid_every > 0 and opt.streaming:
+        raise NotImplementedError("The intermediate validations (-valid_every) are not supported with streaming")
+
+    adaptive_softmax = len(opt.adaptive_softmax_cutoffs) > 0
+    if adaptive_softmax and (opt.fusion or opt.ctc_loss != 0 or opt.mirror_loss or opt.copy_generator or
+                             opt.tie_weights or opt.label_smoothing > 0):
+        raise NotImplementedError("The adaptive softmax is not supported with fusion models, the CTC loss, "
+                                  "the mirror loss, the copy generator, tied weights or label smoothing")
+
     if not opt.fusion:
         model = build_model(opt, dicts)
 
@@ -271,7 +349,8 @@ def main():
         else:
             loss_function = NMTLossFunc(opt.model_size, dicts['tgt'].size(),
                                         label_smoothing=opt.label_smoothing,
-                                        mirror=opt.mirror_loss)
+                                        mirror=opt.mirror_loss, fused=opt.fused_loss or adaptive_softmax,
+                                        chunk_size=opt.loss_chunk_size)
 
         # This function replaces modules with the more optimized counterparts so that it can run faster
         # Currently exp with LayerNorm
@@ -288,9 +367,10 @@ def main():
     n_params = sum([p.nelement() for p in model.parameters()])
     print('* number of parameters: %d' % n_params)
 
-    if len(opt.gpus) > 1 or opt.virtual_gpu > 1:
-        raise NotImplementedError("Multi-GPU training is not supported at the moment.")
+    if opt.virtual_gpu > 1:
+        raise NotImplementedError("Virtual GPUs are not supported at the moment.")
     else:
+        # with several processes (see run_worker), the trainer trains on the shard of its process
         trainer = XETrainer(model, loss_function, train_data, valid_data, dicts, opt)
         # if len(additional_data) > 0:
         #     trainer.add_additional_data(additional_data, opt.data_ratio);
@@ -298,5 +378,21 @@ def main():
     trainer.run(checkpoint=checkpoint)
 
 
-if __name__ == "__main__":
+def run_worker(local_rank):
+    """
+    Data parallel training: one process per GPU (or per CPU worker) on this node
+    """
+    from onmt.multiprocessing.distributed import init_distributed
+
+    init_distributed(opt, local_rank)
+    # the processes start from the same parameters but use different dropout masks
+    torch.manual_seed(opt.seed + opt.rank)
     main()
+
+
+if __name__ == "__main__":
+    procs_per_node = len(opt.gpus) if len(opt.gpus) > 0 else opt.cpu_workers
+    if opt.num_nodes * procs_per_node > 1:
+        torch.multiprocessing.spawn(run_worker, nprocs=procs_per_node)
+    else:
+        main()
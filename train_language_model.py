@@ -31,10 +31,6 @@ onmt.constants.weight_norm = opt.weight_norm
 onmt.constants.checkpointing = opt.checkpointing
 onmt.constants.max_position_length = opt.max_position_length
 
-# Use static dropout if checkpointing > 0
-if opt.checkpointing > 0:
-    onmt.constants.static = True
-
 if torch.cuda.is_available() and not opt.gpus:
     print("WARNING: You have a CUDA device, should run with -gpus 0")
 
@@ -47,36 +43,46 @@ def main():
     start = time.time()
     print("Loading data from '%s'" % opt.data)
 
+    if opt.lm_doc_mask and opt.lm_model != 'transformer':
+        raise NotImplementedError("Document masks require -lm_model transformer")
+
     if opt.data_format == 'raw':
         dataset = torch.load(opt.data)
         elapse = str(datetime.timedelta(seconds=int(time.time() - start)))
         print("Done after %s" % elapse )
 
-
-        train_data = LanguageModelDataset(
-                                 dataset['train']['tgt'],
-                                 batch_size_sents=opt.batch_size_sents,
-                                 seq_length=opt.lm_seq_length)
-        valid_data = LanguageModelDataset(
-                                 dataset['valid']['tgt'],
-                                 batch_size_sents=opt.batch_size_sents,
-                                 seq_length=opt.lm_seq_length)
-
+        train, valid = dataset['train']['tgt'], dataset['valid']['tgt']
         dicts = dataset['dicts']
-        if "src" in dicts:
-            print(' * vocabulary size. source = %d; target = %d' %
-            (dicts['src'].size(), dicts['tgt'].size()))
-        else:
-            print(' * vocabulary size. target = %d' %
-            (dicts['tgt'].size()))
 
-        print(' * number of training sentences. %d' %
-          train_data.size())
-        print(' * maximum batch size (words per batch). %d' % opt.batch_size_words)
+    elif opt.data_format == 'mmem':
+        from onmt.data.mmap_indexed_dataset import MMapIndexedDataset
+
+        dicts = torch.load(opt.data + ".dict.pt")
+        train = MMapIndexedDataset(opt.data + '.train.tgt', warmup=opt.mmap_warmup)
+        valid = MMapIndexedDataset(opt.data + '.valid.tgt', warmup=opt.mmap_warmup)
 
     else:
         raise NotImplementedError
 
+    train_data = LanguageModelDataset(train,
+                                      batch_size_sents=opt.batch_size_sents,
+                                      seq_length=opt.lm_seq_length,
+                                      doc_mask=opt.lm_doc_mask)
+    valid_data = LanguageModelDataset(valid,
+                                      batch_size_sents=opt.batch_size_sents,
+                                      seq_length=opt.lm_seq_length,
+                                      doc_mask=opt.lm_doc_mask)
+
+    if "src" in dicts:
+        print(' * vocabulary size. source = %d; target = %d' %
+        (dicts['src'].size(), dicts['tgt'].size()))
+    else:
+        print(' * vocabulary size. target = %d' %
+        (dicts['tgt'].size()))
+
+    print(' * number of training blocks. %d (%d tokens each, %.2f%% without padding)' %
+          (train_data.size(), opt.lm_seq_length, 100 * train_data.packing_efficiency()))
+
     print('Building model...')
     model = build_language_model(opt, dicts)
 
@@ -84,7 +90,7 @@ def main():
     
     """ Building the loss function """
 
-    loss_function = NMTLossFunc(dicts['tgt'].size(), label_smoothing=opt.label_smoothing)
+    loss_function = NMTLossFunc(opt.model_size, dicts['tgt'].size(), label_smoothing=opt.label_smoothing)
 
     n_params = sum([p.nelement() for p in model.parameters()])
     print('* number of parameters: %d' % n_params)
@@ -98,7 +104,11 @@ def main():
         trainer = XETrainer(model, loss_function, train_data, valid_data, dicts, opt)
 
     
-    trainer.run(save_file=opt.load_from)
+    checkpoint = None
+    if opt.load_from:
+        checkpoint = torch.load(opt.load_from, map_location=lambda storage, loc: storage)
+
+    trainer.run(checkpoint=checkpoint)
 
 if __name__ == "__main__":
     main()
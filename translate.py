@@ -14,6 +14,8 @@ import numpy as np
 import apex
 from onmt.inference.fast_translator import FastTranslator
 from onmt.inference.stream_translator import StreamTranslator
+from onmt.data.audio_pipeline import FeatureReader, reshape_features, add_previous_context
+from onmt.inference.stream_pipeline import translate_stream
 
 parser = argparse.ArgumentParser(description='translate.py')
 onmt.markdown.add_md_help_argument(parser)
@@ -102,6 +104,11 @@ parser.add_argument('-gpu', type=int, default=-1,
                     help="Device to run on")
 parser.add_argument('-fast_translate', action='store_true',
                     help='Using the fast decoder')
+parser.add_argument('-max_latency', type=float, default=0.1,
+                    help="""With -src stdin: maximum time (seconds) a line waits for its batch to be filled.
+                    Use a small value for interactive input, 0 to always wait for full batches""")
+parser.add_argument('-queue_size', type=int, default=4,
+                    help="""With -src stdin: number of batches buffered between reading, decoding and writing""")
 
 def reportScore(name, score_total, words_total):
     print("%s AVG SCORE: %.4f, %s PPL: %.4f" % (
@@ -120,6 +127,16 @@ def lenPenalty(s, l, alpha):
     return s / l_term
 
 
+def getTokensFromSentence(line, input_type):
+    if input_type == 'word':
+        tokens = line.split()
+    elif input_type == 'char':
+        tokens = list(line.strip())
+    else:
+        raise NotImplementedError("Input type unknown")
+    return tokens
+
+
 def getSentenceFromTokens(tokens, input_type):
     if input_type == 'word':
         sent = " ".join(tokens)
@@ -159,14 +176,10 @@ def main():
     in_file = None
 
     if opt.src == "stdin":
+        # the lines are batched by the stream pipeline (see translate_stdin)
         in_file = sys.stdin
-        opt.batch_size = 1
-    elif opt.encoder_type == "audio" and opt.asr_format  == "h5":
-        in_file = h5.File(opt.src, 'r')
-    elif opt.encoder_type == "audio" and opt.asr_format == "scp":
-        import kaldiio
-        from kaldiio import ReadHelper
-        audio_data = iter(ReadHelper('scp:' + opt.src))
+    elif opt.encoder_type == "audio":
+        in_file = FeatureReader(opt.src, asr_format=opt.asr_format)
     else:
         in_file = open(opt.src)
 
@@ -184,36 +197,17 @@ def main():
         s_prev_context = []
         t_prev_context = []
 
-        i = 0
-        while True:
-            if opt.asr_format == "h5":
-                if i == len(in_file):
-                    break
-                line = np.array(in_file[str(i)])
-                i += 1
-            elif opt.asr_format == "scp":
-                try:
-                    _, line = next(audio_data)
-                except StopIteration:
-                    break
-
-            if opt.stride != 1:
-                line = line[0::opt.stride]
-            line = torch.from_numpy(line)
-            if opt.concat != 1:
-                add = (opt.concat - line.size()[0] % opt.concat) % opt.concat
-                z = torch.FloatTensor(add, line.size()[1]).zero_()
-                line = torch.cat((line, z), 0)
-                line = line.reshape((line.size()[0] // opt.concat, line.size()[1] * opt.concat))
+        for i in range(len(in_file)):
+            # stride and concat are done in numpy (one copy)
+            line = reshape_features(in_file[i], stride=opt.stride, concat=opt.concat)
 
             if opt.previous_context > 0:
                 s_prev_context.append(line)
-                for i in range(1, opt.previous_context + 1):
-                    if i < len(s_prev_context):
-                        line = torch.cat((torch.cat((s_prev_context[-i - 1], torch.zeros(1, line.size()[1]))), line))
+                # the previous utterances (oldest first), each one followed by a frame of zeros
+                line = add_previous_context(line, s_prev_context[-opt.previous_context - 1:-1])
                 if len(s_prev_context) > opt.previous_context:
                     s_prev_context = s_prev_context[-1 * opt.previous_context:]
-            src_batch += [line]
+            src_batch += [torch.from_numpy(line)]
 
             if tgtF:
                 # ~ tgt_tokens = tgtF.readline().split() if tgtF else None
@@ -226,12 +220,7 @@ def main():
                     if len(t_prev_context) > opt.previous_context:
                         t_prev_context = t_prev_context[-1 * opt.previous_context:]
 
-                if opt.input_type == 'word':
-                    tgt_tokens = tline.split() if tgtF else None
-                elif opt.input_type == 'char':
-                    tgt_tokens = list(tline.strip()) if tgtF else None
-                else:
-                    raise NotImplementedError("Input type unknown")
+                tgt_tokens = getTokensFromSentence(tline, opt.input_type)
 
                 tgt_batch += [tgt_tokens]
 
@@ -269,25 +258,18 @@ def main():
             gold_score_total += gold_score
             gold_words_total += goldWords
             src_batch, tgt_batch = [], []
+    # Text from stdin: asynchronous pipeline
+    elif opt.src == "stdin" and not opt.streaming:
+        count, pred_score_total, pred_words_total, gold_score_total, gold_words_total = \
+            translate_stdin(opt, in_file, tgtF, outF, translator)
     # Text processing
     else:
         for line in addone(in_file):
             if line is not None:
-                if opt.input_type == 'word':
-                    src_tokens = line.split()
-                elif opt.input_type == 'char':
-                    src_tokens = list(line.strip())
-                else:
-                    raise NotImplementedError("Input type unknown")
+                src_tokens = getTokensFromSentence(line, opt.input_type)
                 src_batch += [src_tokens]
                 if tgtF:
-                    # ~ tgt_tokens = tgtF.readline().split() if tgtF else None
-                    if opt.input_type == 'word':
-                        tgt_tokens = tgtF.readline().split() if tgtF else None
-                    elif opt.input_type == 'char':
-                        tgt_tokens = list(tgtF.readline().strip()) if tgtF else None
-                    else:
-                        raise NotImplementedError("Input type unknown")
+                    tgt_tokens = getTokensFromSentence(tgtF.readline(), opt.input_type)
                     tgt_batch += [tgt_tokens]
 
                 if len(src_batch) < opt.batch_size:
@@ -324,6 +306,41 @@ def main():
         json.dump(translator.beam_accum, open(opt.dump_beam, 'w'))
 
 
+def translate_stdin(opt, in_file, tgtF, outF, translator):
+    """
+    Translate the lines of stdin with full batches: a reader thread tokenizes the lines, the batches are
+    released when they are full or after opt.max_latency seconds, and a writer thread writes the translations
+    (in the input order) while the next batch is decoded
+    :return: the number of sentences and the totals of translate_batch
+    """
+    totals = [0, 0, 0, 0, 0]
+
+    def tokenize(line):
+        src_tokens = getTokensFromSentence(line, opt.input_type)
+        tgt_tokens = getTokensFromSentence(tgtF.readline(), opt.input_type) if tgtF else None
+        return src_tokens, tgt_tokens
+
+    def translate(batch):
+        src_batch = [src for src, _ in batch]
+        tgt_batch = [tgt for _, tgt in batch] if tgtF else []
+        return translator.translate(src_batch, tgt_batch)
+
+    def write(batch, result):
+        src_batch = [src for src, _ in batch]
+        tgt_batch = [tgt for _, tgt in batch] if tgtF else []
+        count, pred_score, pred_words, gold_score, gold_words = translate_batch(opt, tgtF, totals[0], outF,
+                                                                                translator, src_batch, tgt_batch,
+                                                                                *result, opt.input_type)
+        totals[0] = count
+        for i, value in enumerate([pred_score, pred_words, gold_score, gold_words]):
+            totals[i + 1] += value
+
+    translate_stream(in_file, tokenize, translate, write, batch_size=opt.batch_size,
+                     max_latency=opt.max_latency, queue_size=opt.queue_size)
+
+    return tuple(totals)
+
+
 def translate_batch(opt, tgtF, count, outF, translator, src_batch, tgt_batch, pred_batch, pred_score, pred_length, gold_score,
                    num_gold_words, all_gold_scores, input_type):
     original_pred_batch = pred_batch